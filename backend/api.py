@@ -4,25 +4,96 @@ from pathlib import Path
 # Adiciona a pasta codigo ao path do Python
 sys.path.insert(0, str(Path(__file__).parent / "codigo"))
 
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Header, Request, Depends
+from fastapi.responses import StreamingResponse, Response, PlainTextResponse, FileResponse, JSONResponse
+from fastapi.exception_handlers import http_exception_handler
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
 from typing import Optional, List
-from datetime import date
-from produto import ProdutoRepo
-from venda import VendaRepo
+from contextlib import asynccontextmanager
+import hmac
+import os
+import time
+from datetime import date, datetime, timedelta
+from produto import ProdutoRepo, CAMPOS_PRODUTO
+from venda import VendaRepo, CAMPOS_VENDA, nova_chave_venda
+from eventos import barramento
+import serializacao
+import colunar
+import feed
+from campos import selecionar_campos
+import dashboard
+import database
+import shards
+from cache import cache_catalogo, cache_relatorios, cache_dashboard, reserva_catalogo
+from invalidacao import barramento_invalidacao
+from metricas import metricas
+from sessao import Sessao
+from limitador import LimitadorConcorrencia
+from disjuntor import disjuntor_banco, acompanhar_dados_antigos
+from rastreamento import MiddlewareRastreamento, coletor_tracos, arvore
+from tarefas import gerenciador_tarefas, FilaCheiaError, FORMATOS
+import retry
+import perfil
+from inicializacao import Etapa, executar_etapas, aquecer_pool, encerrar_pools, importar_tardio
 from exceptions import (
     ProdutoNaoEncontradoError, 
     EstoqueInsuficienteError,
-    QuantidadeInvalidaError
+    QuantidadeInvalidaError,
+    TransacaoIndisponivelError,
+    BancoIndisponivelError
 )
 
+# NumPy só é carregado no primeiro uso dos relatórios (ou no aquecimento)
+relatorios = importar_tardio("relatorios")
+
+# Tempo máximo de cada etapa opcional do aquecimento
+TIMEOUT_INICIALIZACAO = float(os.getenv("INICIALIZACAO_TIMEOUT", 10))
+
+def aquecer_relatorios():
+    # O acesso ao atributo já carrega o módulo (e o NumPy)
+    if relatorios.snapshot_vendas.habilitado:
+        relatorios.snapshot_vendas.atualizar_se_necessario()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Aquece o pool e os caches antes de a instância receber tráfego"""
+    etapas = [
+        Etapa("pool", aquecer_pool, timeout=TIMEOUT_INICIALIZACAO, obrigatoria=True),
+        Etapa("catalogo", produto_repo.listar_todos, timeout=TIMEOUT_INICIALIZACAO),
+        Etapa("relatorios", aquecer_relatorios, timeout=TIMEOUT_INICIALIZACAO),
+        Etapa("vendas_pendentes", venda_repo.reconciliar_vendas_pendentes, timeout=TIMEOUT_INICIALIZACAO),
+    ]
+    try:
+        app.state.inicializacao = await executar_etapas(etapas)
+    except RuntimeError as e:
+        # Sem banco a API sobe mesmo assim; /health mostra o problema
+        print(f"Aquecimento incompleto: {e}")
+        app.state.inicializacao = {"erro": str(e)}
+    barramento_invalidacao.iniciar()
+    try:
+        gerenciador_tarefas.iniciar()
+    except OSError as e:
+        print(f"Fila de tarefas indisponível: {e}")
+    yield
+    gerenciador_tarefas.encerrar()
+    barramento_invalidacao.parar()
+    coletor_tracos.esvaziar()
+    encerrar_pools()
+
 app = FastAPI(
     title="Loja Virtual API",
     description="API REST para gerenciamento de produtos e vendas",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Limite adaptativo de concorrência por classe de rota (limitador.py). Fica
+# por dentro dos demais middlewares: o 503 ainda recebe os cabeçalhos CORS e
+# a espera na fila conta no prazo da requisição
+app.add_middleware(LimitadorConcorrencia)
+
 # Configuração CORS para permitir requisições do frontend
 app.add_middleware(
     CORSMiddleware,
@@ -30,8 +101,76 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Primario-Ate", "Age", "X-Cache", "Warning", "traceparent"],
 )
 
+# Leitura após escrita: quem acabou de escrever lê do primário por alguns
+# segundos, mesmo em requisições seguintes (cookie/cabeçalho abaixo)
+COOKIE_PRIMARIO = "primario_ate"
+HEADER_PRIMARIO = "X-Primario-Ate"
+METODOS_ESCRITA = {"POST", "PUT", "PATCH", "DELETE"}
+
+@app.middleware("http")
+async def leitura_apos_escrita(request: Request, call_next):
+    valor = request.headers.get(HEADER_PRIMARIO) or request.cookies.get(COOKIE_PRIMARIO)
+    try:
+        # Valor do cliente: limitado à janela; texto inválido, inf e nan são ignorados
+        if valor:
+            database.fixar_primario(float(valor))
+    except ValueError:
+        pass
+
+    escrita = request.method in METODOS_ESCRITA
+    if escrita:
+        database.fixar_primario()
+
+    response = await call_next(request)
+
+    if escrita and response.status_code < 400:
+        ate = time.time() + database.JANELA_LEITURA_PRIMARIO
+        response.set_cookie(
+            COOKIE_PRIMARIO, f"{ate:.3f}",
+            max_age=int(database.JANELA_LEITURA_PRIMARIO) + 1, httponly=True, samesite="lax"
+        )
+        response.headers[HEADER_PRIMARIO] = f"{ate:.3f}"
+    return response
+
+@app.middleware("http")
+async def prazo_requisicao(request: Request, call_next):
+    # Limita o tempo gasto em novas tentativas de transação (retry.py)
+    retry.definir_prazo()
+    return await call_next(request)
+
+@app.middleware("http")
+async def dados_antigos(request: Request, call_next):
+    """Marca as respostas servidas da reserva do catálogo (banco indisponível)"""
+    anotacoes = acompanhar_dados_antigos()
+    response = await call_next(request)
+    if "idade" in anotacoes:
+        response.headers["Age"] = str(int(anotacoes["idade"]))
+        response.headers["X-Cache"] = "reserva"
+        response.headers["Warning"] = '110 - "Response is Stale"'
+    return response
+
+@app.exception_handler(HTTPException)
+async def banco_indisponivel(request: Request, exc: HTTPException):
+    """
+    Os endpoints convertem qualquer erro em 500; se a causa foi o disjuntor
+    aberto (ou o banco fora sem reserva), responde 503 + Retry-After
+    """
+    causa = exc.__cause__ or exc.__context__
+    if exc.status_code == 500 and isinstance(causa, BancoIndisponivelError):
+        return JSONResponse(
+            status_code=503, content={"detail": str(causa)},
+            headers={"Retry-After": str(causa.tentar_apos)}
+        )
+    return await http_exception_handler(request, exc)
+
+# Rastreamento amostrado das requisições (rastreamento.py). Adicionado por
+# último, fica por fora de todos e o span da requisição inclui a fila do
+# limitador
+app.add_middleware(MiddlewareRastreamento)
+
 # Models Pydantic para validação
 class ProdutoCreate(BaseModel):
     nome: str = Field(..., min_length=1, max_length=100)
@@ -45,9 +184,21 @@ class ProdutoUpdate(BaseModel):
     preco: Optional[float] = Field(None, gt=0)
     estoque: Optional[int] = Field(None, ge=0)
 
+class ProdutoLoteItem(ProdutoUpdate):
+    id: int = Field(..., gt=0)
+
+class RegraPreco(BaseModel):
+    categoria: str = Field(..., min_length=1, max_length=50)
+    preco_fator: float = Field(..., gt=0, le=10)
+
+class ProdutoLote(BaseModel):
+    atualizacoes: List[ProdutoLoteItem] = Field(default_factory=list, max_length=10000)
+    regra: Optional[RegraPreco] = None
+
 class VendaCreate(BaseModel):
     produto_id: int = Field(..., gt=0)
     quantidade: int = Field(..., gt=0)
+    loja_id: Optional[int] = Field(None, gt=0, description="Padrão: LOJA_PADRAO")
 
 class ProdutoResponse(BaseModel):
     id: int
@@ -56,16 +207,76 @@ class ProdutoResponse(BaseModel):
     preco: float
     estoque: int
 
+class TarefaCreate(BaseModel):
+    tipo: str = Field(..., description="consulta, exportacao ou resumo_periodo")
+    parametros: dict = Field(default_factory=dict)
+    formato: str = Field("json", pattern="^(json|csv)$")
+
 class VendaResponse(BaseModel):
     venda_id: int
     produto_nome: str
     quantidade: int
     valor_total: float
     data_venda: str
+    loja_id: Optional[int] = None
+
+# Limite de pontos de /api/relatorios/vendas-serie
+MAX_PONTOS_SERIE = 10000
 
 # Inicialização dos repositórios
-produto_repo = ProdutoRepo()
-venda_repo = VendaRepo()
+produto_repo = ProdutoRepo(cache=cache_catalogo, reserva=reserva_catalogo)
+venda_repo = VendaRepo(cache_catalogo=cache_catalogo)
+
+# Caches limpos nas escritas deste processo e, com CACHE_INVALIDACAO_INTERVALO,
+# nas de outros workers/instâncias
+barramento_invalidacao.registrar("catalogo", cache_catalogo.invalidar)
+barramento_invalidacao.registrar("catalogo", lambda: relatorios.snapshot_vendas.invalidar())
+barramento_invalidacao.registrar("vendas", lambda: relatorios.snapshot_vendas.invalidar())
+barramento_invalidacao.registrar("catalogo", cache_relatorios.invalidar)
+barramento_invalidacao.registrar("vendas", cache_relatorios.invalidar)
+# A página inicial recarrega o painel a cada evento de escrita: em vez de
+# servir a versão antiga mais uma vez, a próxima leitura já recalcula
+barramento_invalidacao.registrar("catalogo", cache_dashboard.descartar)
+barramento_invalidacao.registrar("vendas", cache_dashboard.descartar)
+
+def conflito(e: TransacaoIndisponivelError):
+    """503 + Retry-After quando a transação não passou do deadlock/lock wait"""
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.tentar_apos)})
+
+def _transacao_confirmada(funcao, operacao, sessao):
+    resultado = retry.com_retentativa(funcao, operacao, sessao=sessao)
+    # Confirma já, e não no fim da requisição: o commit fica dentro do prazo
+    # de sessao.limitar_commit (feeds) e o atraso vira 503 aqui
+    sessao.confirmar()
+    return resultado
+
+async def em_transacao(funcao, operacao, sessao):
+    """
+    Executa a unidade de trabalho fora do event loop, repetindo em deadlocks,
+    e confirma a sessão
+    """
+    return await run_in_threadpool(_transacao_confirmada, funcao, operacao, sessao)
+
+def campos_pedidos(fields, permitidos):
+    """Campos de fields= validados (campos.py); 400 para nomes fora da lista"""
+    try:
+        return selecionar_campos(fields, permitidos)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def resposta_listagem(linhas, campos):
+    """Com fields= as linhas não têm todas as colunas do response_model"""
+    if campos:
+        return serializacao.JSONRapidoResponse(linhas)
+    return serializacao.resposta(linhas)
+
+def sessao_requisicao(request: Request):
+    """
+    Uma conexão e uma transação por requisição, abertas só se algum
+    repositório precisar; commit no fim ou rollback se a requisição falhar
+    """
+    with Sessao(database.get_connection, leitura=request.method not in METODOS_ESCRITA) as sessao:
+        yield sessao
 
 # ==================== ENDPOINTS DE PRODUTOS ====================
 
@@ -79,7 +290,9 @@ async def root():
         "health": "/health",
         "endpoints": {
             "produtos": "/api/produtos",
-            "vendas": "/api/vendas"
+            "vendas": "/api/vendas",
+            "dashboard": "/api/dashboard",
+            "eventos": "/api/eventos"
         }
     }
 
@@ -89,38 +302,111 @@ async def health_check():
     try:
         # Testa conexão com o banco
         produtos = produto_repo.listar_todos()
+        # Com o disjuntor aberto a contagem vem da reserva do catálogo
+        conectado = disjuntor_banco.estado == "fechado"
         return {
-            "status": "healthy",
-            "database": "connected",
-            "produtos_count": len(produtos)
+            "status": "healthy" if conectado else "degraded",
+            "database": "connected" if conectado else "unavailable",
+            "produtos_count": len(produtos),
+            "disjuntor": disjuntor_banco.estado,
+            "inicializacao": getattr(app.state, "inicializacao", None)
         }
     except Exception as e:
         return {
             "status": "unhealthy",
             "database": "disconnected",
-            "error": str(e)
+            "error": str(e),
+            "disjuntor": disjuntor_banco.estado,
+            "inicializacao": getattr(app.state, "inicializacao", None)
         }
 
+@app.get("/metrics", response_class=PlainTextResponse, tags=["Health"])
+async def exportar_metricas():
+    """Métricas deste processo no formato texto do Prometheus"""
+    return PlainTextResponse(metricas.texto(), media_type="text/plain; version=0.0.4")
+
+# Token exigido nas rotas de depuração que expõem detalhes do processo
+# (sem ADMIN_TOKEN elas ficam desligadas)
+TOKEN_ADMIN = os.getenv("ADMIN_TOKEN", "")
+
+def exigir_admin(x_admin_token: Optional[str] = Header(None)):
+    if not TOKEN_ADMIN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, TOKEN_ADMIN):
+        raise HTTPException(status_code=403, detail="Token de administrador inválido")
+
+@app.get("/debug/profile", response_class=PlainTextResponse, tags=["Health"], dependencies=[Depends(exigir_admin)])
+async def perfilar_worker(
+    seconds: float = Query(10, gt=0, le=perfil.MAX_SEGUNDOS, description="Duração do perfil"),
+    mode: str = Query("cpu", pattern="^(cpu|wall|alloc)$", description="cpu, wall ou alloc")
+):
+    """
+    Perfil deste worker durante `seconds` segundos, em formato collapsed
+    stacks (speedscope/flamegraph). Um perfil por vez por processo.
+    """
+    try:
+        texto = await run_in_threadpool(perfil.perfilar, seconds, mode)
+    except perfil.PerfilEmAndamentoError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    nome = f"perfil-{mode}-{os.getpid()}.txt"
+    return PlainTextResponse(texto, headers={"Content-Disposition": f'attachment; filename="{nome}"'})
+
+@app.get("/debug/traces", tags=["Health"], dependencies=[Depends(exigir_admin)])
+async def tracos_mais_lentos(limite: int = Query(20, ge=1, le=200)):
+    """Requisições amostradas mais lentas deste processo, com a árvore de spans"""
+    tracos = coletor_tracos.mais_lentos(limite)
+    return {"total": len(tracos), "tracos": [arvore(t) for t in tracos]}
+
 @app.get("/api/produtos", response_model=List[ProdutoResponse], tags=["Produtos"])
 async def listar_produtos(
-    categoria: Optional[str] = Query(None, description="Filtrar por categoria")
+    categoria: Optional[str] = Query(None, description="Filtrar por categoria"),
+    fields: Optional[str] = Query(None, description=f"Campos separados por vírgula: {', '.join(CAMPOS_PRODUTO)}"),
+    sessao: Sessao = Depends(sessao_requisicao)
 ):
     """Lista todos os produtos ou filtra por categoria"""
+    campos = campos_pedidos(fields, CAMPOS_PRODUTO)
     try:
         if categoria:
-            produtos = produto_repo.filtrar_por_categoria(categoria)
+            produtos = produto_repo.filtrar_por_categoria(categoria, sessao=sessao, campos=campos)
         else:
-            produtos = produto_repo.listar_todos()
+            compacto = serializacao.ativa() or campos is not None
+            produtos = produto_repo.listar_todos(sessao=sessao, compacto=compacto, campos=campos)
         
-        return produtos
+        return resposta_listagem(produtos, campos)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao listar produtos: {str(e)}")
 
+@app.get("/api/produtos/changes", tags=["Produtos"])
+async def produtos_alterados(
+    since_updated_at: Optional[datetime] = Query(None, description="updated_at da marca d'água anterior"),
+    since_id: int = Query(0, ge=0, description="id da marca d'água anterior"),
+    limit: int = Query(1000, ge=1, le=feed.LIMITE_MAXIMO),
+    sessao: Sessao = Depends(sessao_requisicao)
+):
+    """
+    Produtos criados ou alterados depois da marca d'água, em ordem de
+    alteração. Sem marca, começa do início; envie o "proximo" da resposta na
+    chamada seguinte até tem_mais ser falso.
+    """
+    try:
+        produtos, (atualizacao, ultimo_id), tem_mais = produto_repo.produtos_desde(
+            since_updated_at, since_id, limit, sessao=sessao
+        )
+        return {
+            "total": len(produtos),
+            "produtos": produtos,
+            "proximo": {"since_updated_at": atualizacao.isoformat(), "since_id": ultimo_id},
+            "tem_mais": tem_mais
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao buscar produtos alterados: {str(e)}")
+
 @app.get("/api/produtos/{produto_id}", response_model=ProdutoResponse, tags=["Produtos"])
-async def buscar_produto(produto_id: int):
+async def buscar_produto(produto_id: int, sessao: Sessao = Depends(sessao_requisicao)):
     """Busca um produto específico por ID"""
     try:
-        produto = produto_repo.buscar_por_id(produto_id)
+        produto = produto_repo.buscar_por_id(produto_id, sessao=sessao)
         if not produto:
             raise HTTPException(status_code=404, detail="Produto não encontrado")
         
@@ -131,30 +417,35 @@ async def buscar_produto(produto_id: int):
         raise HTTPException(status_code=500, detail=f"Erro ao buscar produto: {str(e)}")
 
 @app.post("/api/produtos", response_model=ProdutoResponse, status_code=201, tags=["Produtos"])
-async def criar_produto(produto: ProdutoCreate):
+async def criar_produto(produto: ProdutoCreate, sessao: Sessao = Depends(sessao_requisicao)):
     """Cria um novo produto"""
-    try:
+    def criar():
         produto_id = produto_repo.criar_produto(
             nome=produto.nome,
             preco=produto.preco,
             categoria=produto.categoria,
-            estoque=produto.estoque
+            estoque=produto.estoque,
+            sessao=sessao
         )
-        
-        novo_produto = produto_repo.buscar_por_id(produto_id)
+        return produto_repo.buscar_por_id(produto_id, sessao=sessao)
+
+    try:
+        novo_produto = await em_transacao(criar, "criar_produto", sessao)
         if not novo_produto:
             raise HTTPException(status_code=500, detail="Erro ao buscar produto criado")
         
         return novo_produto
+    except TransacaoIndisponivelError as e:
+        raise conflito(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao criar produto: {str(e)}")
 
 @app.put("/api/produtos/{produto_id}", response_model=ProdutoResponse, tags=["Produtos"])
-async def atualizar_produto(produto_id: int, produto: ProdutoUpdate):
+async def atualizar_produto(produto_id: int, produto: ProdutoUpdate, sessao: Sessao = Depends(sessao_requisicao)):
     """Atualiza um produto existente"""
-    try:
+    def atualizar():
         # Verifica se o produto existe
-        produto_existente = produto_repo.buscar_por_id(produto_id)
+        produto_existente = produto_repo.buscar_por_id(produto_id, sessao=sessao)
         if not produto_existente:
             raise HTTPException(status_code=404, detail="Produto não encontrado")
         
@@ -164,52 +455,167 @@ async def atualizar_produto(produto_id: int, produto: ProdutoUpdate):
             nome=produto.nome,
             categoria=produto.categoria,
             preco=produto.preco,
-            estoque=produto.estoque
+            estoque=produto.estoque,
+            sessao=sessao
         )
         
         # Busca o produto atualizado
-        produto_atualizado = produto_repo.buscar_por_id(produto_id)
-        return produto_atualizado
+        return produto_repo.buscar_por_id(produto_id, sessao=sessao)
+
+    try:
+        return await em_transacao(atualizar, "atualizar_produto", sessao)
         
     except HTTPException:
         raise
+    except TransacaoIndisponivelError as e:
+        raise conflito(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao atualizar produto: {str(e)}")
 
+@app.patch("/api/produtos", tags=["Produtos"])
+async def atualizar_produtos_em_lote(lote: ProdutoLote):
+    """
+    Atualiza vários produtos de uma vez: uma lista de atualizações parciais
+    por id e/ou uma regra de preço por categoria (ex.: preco_fator 0.9)
+    """
+    if not lote.atualizacoes and lote.regra is None:
+        raise HTTPException(status_code=400, detail="Informe atualizacoes ou regra")
+
+    try:
+        resultados = []
+        if lote.atualizacoes:
+            resultados = await run_in_threadpool(
+                produto_repo.atualizar_em_lote,
+                [item.model_dump(exclude_none=True) for item in lote.atualizacoes]
+            )
+
+        atualizados_regra = []
+        if lote.regra is not None:
+            atualizados_regra = await run_in_threadpool(
+                produto_repo.atualizar_preco_por_categoria, lote.regra.categoria, lote.regra.preco_fator
+            )
+
+        return {
+            "total": len(resultados),
+            "atualizados": sum(1 for r in resultados if r["status"] == "atualizado"),
+            "nao_encontrados": sum(1 for r in resultados if r["status"] == "nao_encontrado"),
+            "erros": sum(1 for r in resultados if r["status"] == "erro"),
+            "resultados": resultados,
+            "regra": None if lote.regra is None else {
+                "categoria": lote.regra.categoria,
+                "preco_fator": lote.regra.preco_fator,
+                "atualizados": len(atualizados_regra),
+                "ids": atualizados_regra
+            }
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao atualizar produtos em lote: {str(e)}")
+
 # ==================== ENDPOINTS DE VENDAS ====================
 
 @app.get("/api/vendas", response_model=List[VendaResponse], tags=["Vendas"])
 async def listar_vendas(
     data_inicio: Optional[date] = Query(None, description="Data inicial (YYYY-MM-DD)"),
-    data_fim: Optional[date] = Query(None, description="Data final (YYYY-MM-DD)")
+    data_fim: Optional[date] = Query(None, description="Data final (YYYY-MM-DD)"),
+    formato: Optional[str] = Query(None, description="colunar ou arrow (alternativa ao cabeçalho Accept)"),
+    incluir_arquivo: bool = Query(False, description="Incluir vendas arquivadas (anteriores à retenção)"),
+    fields: Optional[str] = Query(None, description=f"Campos separados por vírgula: {', '.join(CAMPOS_VENDA)}"),
+    loja_id: Optional[int] = Query(None, ge=1, description="Só as vendas da loja (lê apenas o shard dela)"),
+    accept: Optional[str] = Header(None),
+    sessao: Sessao = Depends(sessao_requisicao)
 ):
-    """Lista todas as vendas ou filtra por período"""
+    """Lista todas as vendas ou filtra por período e loja"""
+    campos = campos_pedidos(fields, CAMPOS_VENDA)
+    media_colunar = colunar.negociar(accept, formato)
+    if media_colunar == colunar.MEDIA_ARROW and not colunar.arrow_disponivel():
+        raise HTTPException(status_code=406, detail="Formato Arrow indisponível neste servidor")
+
     try:
+        if media_colunar:
+            inicio = data_inicio.strftime("%Y-%m-%d") if data_inicio and data_fim else None
+            fim = data_fim.strftime("%Y-%m-%d") if data_inicio and data_fim else None
+            colunas, linhas = venda_repo.listar_vendas_colunar(
+                inicio, fim, incluir_arquivo, sessao=sessao, campos=campos, loja_id=loja_id
+            )
+
+            if media_colunar == colunar.MEDIA_ARROW:
+                conteudo = colunar.para_arrow(colunas, linhas)
+            else:
+                conteudo = colunar.para_json(colunas, linhas)
+            return Response(content=conteudo, media_type=media_colunar, headers={"Vary": "Accept"})
+
+        # Linhas compactas só quando a resposta não passa pelo response_model
+        # (ele espera data_venda texto)
+        compacto = serializacao.ativa() or campos is not None
         if data_inicio and data_fim:
             vendas = venda_repo.buscar_por_periodo(
                 data_inicio.strftime("%Y-%m-%d"),
-                data_fim.strftime("%Y-%m-%d")
+                data_fim.strftime("%Y-%m-%d"),
+                incluir_arquivo,
+                sessao=sessao,
+                compacto=compacto,
+                campos=campos,
+                loja_id=loja_id
             )
         else:
-            vendas = venda_repo.listar_vendas()
+            vendas = venda_repo.listar_vendas(sessao=sessao, compacto=compacto, campos=campos, loja_id=loja_id)
         
-        return vendas
+        return resposta_listagem(vendas, campos)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao listar vendas: {str(e)}")
 
+@app.get("/api/vendas/changes", tags=["Vendas"])
+async def vendas_novas(
+    since_id: int = Query(0, ge=0, description="Último venda_id recebido (0 para começar do início)"),
+    limit: int = Query(1000, ge=1, le=feed.LIMITE_MAXIMO),
+    loja_id: Optional[int] = Query(None, ge=1, description="Obrigatório com as vendas em vários shards"),
+    sessao: Sessao = Depends(sessao_requisicao)
+):
+    """
+    Vendas registradas depois de since_id, em ordem de id. Envie o since_id
+    da resposta na chamada seguinte até tem_mais ser falso.
+    """
+    try:
+        vendas, ultimo_id, tem_mais = venda_repo.vendas_desde(since_id, limit, sessao=sessao, loja_id=loja_id)
+        return {
+            "total": len(vendas),
+            "vendas": vendas,
+            "since_id": ultimo_id,
+            "tem_mais": tem_mais
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao buscar vendas novas: {str(e)}")
+
 @app.post("/api/vendas", status_code=201, tags=["Vendas"])
-async def criar_venda(venda: VendaCreate):
+async def criar_venda(venda: VendaCreate, sessao: Sessao = Depends(sessao_requisicao)):
     """Registra uma nova venda e atualiza o estoque automaticamente"""
-    try:
-        venda_id, valor_total = venda_repo.registrar_venda(
+    # Fora de registrar(): as novas tentativas de em_transacao usam a mesma
+    # chave, e a venda em shard já gravada não é repetida
+    chave = nova_chave_venda()
+
+    def registrar():
+        return venda_repo.registrar_venda(
             produto_id=venda.produto_id,
-            quantidade=venda.quantidade
+            quantidade=venda.quantidade,
+            sessao=sessao,
+            loja_id=venda.loja_id,
+            chave=chave
         )
-        
-        # Busca informações completas da venda
-        vendas = venda_repo.listar_vendas()
-        venda_criada = next((v for v in vendas if v['venda_id'] == venda_id), None)
-        
+
+    try:
+        venda_id, valor_total = await em_transacao(registrar, "registrar_venda", sessao)
+        # Busca informações completas da venda pelo id, já depois do commit;
+        # se a leitura falhar a venda continua registrada
+        try:
+            venda_criada = await run_in_threadpool(
+                venda_repo.buscar_por_id, venda_id, sessao=sessao, loja_id=venda.loja_id or shards.LOJA_PADRAO
+            )
+        except Exception as e:
+            print(f"Erro ao buscar a venda {venda_id} registrada: {e}")
+            venda_criada = None
+
         if not venda_criada:
             return {
                 "venda_id": venda_id,
@@ -229,74 +635,298 @@ async def criar_venda(venda: VendaCreate):
         raise HTTPException(status_code=400, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    except TransacaoIndisponivelError as e:
+        raise conflito(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao registrar venda: {str(e)}")
 
 # ==================== ENDPOINTS DE RELATÓRIOS ====================
 
+def em_cache(response: Response, chave, carregar, cache=cache_relatorios):
+    """Resultado do cache de relatórios com a idade dos dados nos cabeçalhos"""
+    valor, idade, estado = cache.obter(chave, carregar)
+    response.headers["Age"] = str(int(idade))
+    response.headers["X-Cache"] = estado
+    return valor
+
+def _produtos_estoque_baixo(limite):
+    produtos = produto_repo.listar_todos()
+    produtos_baixo = [
+        {
+            "id": p['id'],
+            "nome": p['nome'],
+            "categoria": p['categoria'],
+            "estoque": p['estoque'],
+            "preco": p['preco']
+        }
+        for p in produtos if p['estoque'] < limite
+    ]
+
+    return {
+        "limite": limite,
+        "total_produtos": len(produtos_baixo),
+        "produtos": produtos_baixo
+    }
+
+def _categorias():
+    produtos = produto_repo.listar_todos()
+    categorias = list(set(p['categoria'] for p in produtos))
+
+    return {
+        "total": len(categorias),
+        "categorias": sorted(categorias)
+    }
+
+def _resumo():
+    produtos = produto_repo.listar_todos()
+    # Só o valor: sem o JOIN com produtos
+    vendas = venda_repo.listar_vendas(compacto=True, campos=("valor_total",))
+
+    total_produtos = len(produtos)
+    total_vendas = len(vendas)
+    valor_total_vendas = sum(v['valor_total'] for v in vendas)
+    produtos_sem_estoque = sum(1 for p in produtos if p['estoque'] == 0)
+
+    return {
+        "produtos": {
+            "total": total_produtos,
+            "sem_estoque": produtos_sem_estoque,
+            "com_estoque": total_produtos - produtos_sem_estoque
+        },
+        "vendas": {
+            "total": total_vendas,
+            "valor_total": float(valor_total_vendas)
+        }
+    }
+
 @app.get("/api/relatorios/produtos-estoque-baixo", tags=["Relatórios"])
-async def produtos_estoque_baixo(limite: int = Query(5, ge=0, description="Quantidade mínima de estoque")):
+async def produtos_estoque_baixo(
+    response: Response,
+    limite: int = Query(5, ge=0, description="Quantidade mínima de estoque")
+):
     """Lista produtos com estoque abaixo do limite especificado"""
     try:
-        produtos = produto_repo.listar_todos()
-        produtos_baixo = [
-            {
-                "id": p['id'],
-                "nome": p['nome'],
-                "categoria": p['categoria'],
-                "estoque": p['estoque'],
-                "preco": p['preco']
-            }
-            for p in produtos if p['estoque'] < limite
-        ]
-        
-        return {
-            "limite": limite,
-            "total_produtos": len(produtos_baixo),
-            "produtos": produtos_baixo
-        }
+        return em_cache(response, ("produtos-estoque-baixo", limite), lambda: _produtos_estoque_baixo(limite))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao buscar produtos: {str(e)}")
 
 @app.get("/api/relatorios/categorias", tags=["Relatórios"])
-async def listar_categorias():
+async def listar_categorias(response: Response):
     """Lista todas as categorias de produtos disponíveis"""
     try:
-        produtos = produto_repo.listar_todos()
-        categorias = list(set(p['categoria'] for p in produtos))
-        
-        return {
-            "total": len(categorias),
-            "categorias": sorted(categorias)
-        }
+        return em_cache(response, ("categorias",), _categorias)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao listar categorias: {str(e)}")
 
 @app.get("/api/relatorios/resumo", tags=["Relatórios"])
-async def resumo_geral():
+async def resumo_geral(response: Response):
     """Retorna um resumo geral do sistema"""
     try:
-        produtos = produto_repo.listar_todos()
-        vendas = venda_repo.listar_vendas()
-        
-        total_produtos = len(produtos)
-        total_vendas = len(vendas)
-        valor_total_vendas = sum(v['valor_total'] for v in vendas)
-        produtos_sem_estoque = sum(1 for p in produtos if p['estoque'] == 0)
-        
+        return em_cache(response, ("resumo",), _resumo)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao gerar resumo: {str(e)}")
+
+@app.get("/api/dashboard", tags=["Relatórios"])
+async def painel(
+    response: Response,
+    limite_estoque: int = Query(3, ge=0, description="Estoque abaixo do qual o produto entra na lista"),
+    top: int = Query(5, ge=1, le=50, description="Quantidade de produtos mais vendidos"),
+    recentes: int = Query(10, ge=1, le=100, description="Quantidade de vendas recentes")
+):
+    """
+    Tudo o que a página inicial mostra numa única requisição: contadores,
+    estoque baixo, mais vendidos e vendas recentes, lidos de um mesmo snapshot
+    """
+    chave = ("dashboard", limite_estoque, top, recentes)
+    try:
+        return await run_in_threadpool(
+            em_cache, response, chave,
+            lambda: dashboard.montar_dashboard(limite_estoque, top, recentes),
+            cache_dashboard
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao montar o dashboard: {str(e)}")
+
+# ==================== TAREFAS EM SEGUNDO PLANO ====================
+
+def estado_tarefa(tarefa):
+    estado = {k: v for k, v in tarefa.items() if k != "dono"}
+    if tarefa["estado"] == "concluida":
+        estado["resultado_url"] = f"/api/relatorios/jobs/{tarefa['id']}/resultado"
+    return estado
+
+@app.post("/api/relatorios/jobs", status_code=202, tags=["Relatórios"])
+async def criar_tarefa(tarefa: TarefaCreate, response: Response):
+    """Enfileira um relatório pesado ou exportação para rodar fora da requisição"""
+    try:
+        criada = await run_in_threadpool(gerenciador_tarefas.criar, tarefa.tipo, tarefa.parametros, tarefa.formato)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FilaCheiaError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+
+    response.headers["Location"] = f"/api/relatorios/jobs/{criada['id']}"
+    return estado_tarefa(criada)
+
+@app.get("/api/relatorios/jobs/{tarefa_id}", tags=["Relatórios"])
+async def consultar_tarefa(tarefa_id: str):
+    """Estado da tarefa: pendente, executando, concluida ou erro"""
+    tarefa = gerenciador_tarefas.obter(tarefa_id)
+    if tarefa is None:
+        raise HTTPException(status_code=404, detail="Tarefa não encontrada")
+    return estado_tarefa(tarefa)
+
+@app.get("/api/relatorios/jobs/{tarefa_id}/resultado", tags=["Relatórios"])
+async def baixar_resultado_tarefa(tarefa_id: str):
+    """Arquivo com o resultado de uma tarefa concluída"""
+    tarefa = gerenciador_tarefas.obter(tarefa_id)
+    if tarefa is None:
+        raise HTTPException(status_code=404, detail="Tarefa não encontrada")
+    if tarefa["estado"] != "concluida":
+        raise HTTPException(status_code=409, detail=f"Tarefa ainda não concluída ({tarefa['estado']})")
+
+    caminho = gerenciador_tarefas.caminho_resultado(tarefa)
+    return FileResponse(
+        caminho, media_type=FORMATOS[tarefa["formato"]],
+        filename=f"{tarefa['tipo']}-{tarefa['id']}.{tarefa['formato']}"
+    )
+
+@app.get("/api/relatorios/receita-categorias", tags=["Relatórios"])
+async def receita_por_categoria(dias: int = Query(30, ge=1, description="Janela em dias")):
+    """Quantidade vendida e receita por categoria nos últimos N dias"""
+    try:
         return {
-            "produtos": {
-                "total": total_produtos,
-                "sem_estoque": produtos_sem_estoque,
-                "com_estoque": total_produtos - produtos_sem_estoque
-            },
-            "vendas": {
-                "total": total_vendas,
-                "valor_total": float(valor_total_vendas)
-            }
+            "dias": dias,
+            "categorias": await run_in_threadpool(relatorios.snapshot_vendas.receita_por_categoria, dias)
         }
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao gerar resumo: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Erro ao gerar receita por categoria: {str(e)}")
+
+@app.get("/api/relatorios/top-produtos", tags=["Relatórios"])
+async def top_produtos(limite: int = Query(5, ge=1, le=100, description="Quantidade de produtos")):
+    """Produtos mais vendidos por quantidade"""
+    try:
+        return {
+            "limite": limite,
+            "produtos": await run_in_threadpool(relatorios.snapshot_vendas.top_produtos, limite)
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao gerar top produtos: {str(e)}")
+
+@app.get("/api/relatorios/produtos-criticos", tags=["Relatórios"])
+async def produtos_criticos(estoque_minimo: int = Query(3, ge=0, description="Estoque considerado crítico")):
+    """Produtos nunca vendidos ou com estoque crítico"""
+    try:
+        produtos = await run_in_threadpool(relatorios.snapshot_vendas.produtos_criticos, estoque_minimo)
+        return {
+            "estoque_minimo": estoque_minimo,
+            "total_produtos": len(produtos),
+            "produtos": produtos
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao gerar produtos críticos: {str(e)}")
+
+@app.get("/api/relatorios/media-movel", tags=["Relatórios"])
+async def media_movel(
+    janela: int = Query(7, ge=1, le=365, description="Tamanho da janela em dias"),
+    dias: int = Query(30, ge=1, le=3650, description="Quantidade de dias retornados")
+):
+    """Receita diária com média móvel"""
+    try:
+        return {
+            "janela": janela,
+            "serie": await run_in_threadpool(relatorios.snapshot_vendas.media_movel, janela, dias)
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao gerar média móvel: {str(e)}")
+
+@app.get("/api/relatorios/percentis", tags=["Relatórios"])
+async def percentis_vendas(
+    p: List[float] = Query([50, 90, 99], description="Percentis desejados (0-100)"),
+    dias: Optional[int] = Query(None, ge=1, description="Considerar apenas os últimos N dias")
+):
+    """Percentis do valor e da quantidade por venda"""
+    if any(valor < 0 or valor > 100 for valor in p):
+        raise HTTPException(status_code=400, detail="Percentis devem estar entre 0 e 100")
+    try:
+        return await run_in_threadpool(relatorios.snapshot_vendas.percentis, p, dias)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao calcular percentis: {str(e)}")
+
+@app.get("/api/relatorios/vendas-serie", tags=["Relatórios"])
+async def vendas_serie(
+    granularidade: str = Query("dia", pattern="^(hora|dia|semana|mes)$", description="hora, dia, semana ou mes"),
+    inicio: Optional[date] = Query(None, description="Data inicial (YYYY-MM-DD), padrão: 30 dias atrás"),
+    fim: Optional[date] = Query(None, description="Data final (YYYY-MM-DD), padrão: hoje"),
+    categoria: Optional[str] = Query(None, description="Filtrar por categoria"),
+    incluir_arquivo: bool = Query(False, description="Incluir vendas arquivadas (sempre consulta o banco)"),
+    loja_id: Optional[int] = Query(None, ge=1, description="Só a loja (consulta o shard dela no banco)"),
+    sessao: Sessao = Depends(sessao_requisicao)
+):
+    """Série de quantidade e receita por período, com os períodos sem venda zerados"""
+    fim = fim or date.today()
+    inicio = inicio or fim - timedelta(days=30)
+    if inicio > fim:
+        raise HTTPException(status_code=400, detail="A data inicial deve ser anterior à final")
+
+    _, total_periodos = relatorios.intervalo_periodos(inicio, fim, granularidade)
+    if total_periodos > MAX_PONTOS_SERIE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Intervalo gera {total_periodos} períodos (máximo {MAX_PONTOS_SERIE}). Use uma granularidade maior."
+        )
+
+    try:
+        if relatorios.snapshot_vendas.habilitado and not incluir_arquivo and loja_id is None:
+            fonte = "memoria"
+            serie = await run_in_threadpool(relatorios.snapshot_vendas.serie, granularidade, inicio, fim, categoria)
+        else:
+            fonte = "banco"
+            linhas = await run_in_threadpool(
+                venda_repo.serie_por_periodo,
+                granularidade, inicio, fim, categoria, incluir_arquivo, sessao=sessao, loja_id=loja_id
+            )
+            serie = relatorios.serie_de_linhas(inicio, fim, granularidade, linhas)
+
+        return {
+            "granularidade": granularidade,
+            "inicio": inicio.isoformat(),
+            "fim": fim.isoformat(),
+            "categoria": categoria,
+            "loja_id": loja_id,
+            "fonte": fonte,
+            "serie": serie
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao gerar série de vendas: {str(e)}")
+
+# ==================== ENDPOINTS DE EVENTOS ====================
+
+@app.get("/api/eventos", tags=["Eventos"])
+async def stream_eventos(
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
+    ultimo_id: Optional[int] = Query(None, ge=0, description="Alternativa ao cabeçalho Last-Event-ID")
+):
+    """Stream SSE com as alterações de vendas, estoque e produtos"""
+    if last_event_id and last_event_id.isdigit():
+        ultimo_id = int(last_event_id)
+
+    assinante, pendentes = barramento.assinar(ultimo_id)
+    if assinante is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Limite de clientes conectados atingido",
+            headers={"Retry-After": "5"}
+        )
+
+    return StreamingResponse(
+        barramento.stream(assinante, pendentes),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,121 @@
+"""
+Memória de pico: linhas como dict x linhas compactas (registros.py)
+
+Uso:
+    python benchmarks/bench_memoria_linhas.py              # vendas do MySQL local
+    python benchmarks/bench_memoria_linhas.py --sintetico 1000000
+
+Cada caminho roda num processo novo, para que o pico de RSS de um não
+esconda o do outro:
+
+  dict      VendaRepo.listar_vendas() como hoje (cursor dictionary=True e
+            strftime de data_venda em todas as linhas)
+  compacto  VendaRepo.listar_vendas(compacto=True), data formatada só na
+            serialização
+
+Os dois terminam serializando a lista com serializacao.dumps, como no
+caminho rápido de GET /api/vendas. Com --sintetico as linhas vêm de um
+cursor falso com o mesmo formato do conector (não precisa de banco).
+"""
+import argparse
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+BASE = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE / "codigo"))
+
+COLUNAS = ('venda_id', 'produto_id', 'quantidade', 'valor_total', 'data_venda', 'produto_nome', 'produto_preco')
+
+
+class CursorSintetico:
+    """Gera as linhas sob demanda, como um cursor sem buffer do conector"""
+
+    column_names = COLUNAS
+
+    def __init__(self, quantidade, dictionary=False):
+        self.dictionary = dictionary
+        inicio = datetime(2024, 1, 1)
+        self._linhas = (
+            (i, i % 500, i % 7 + 1, Decimal('59.70') + i % 100, inicio + timedelta(minutes=i),
+             f'Produto {i % 500}', Decimal('19.90'))
+            for i in range(quantidade, 0, -1)
+        )
+
+    def _formatar(self, linha):
+        return dict(zip(COLUNAS, linha)) if self.dictionary else linha
+
+    def fetchall(self):
+        return [self._formatar(l) for l in self._linhas]
+
+    def fetchmany(self, tamanho):
+        lote = []
+        for linha in self._linhas:
+            lote.append(self._formatar(linha))
+            if len(lote) == tamanho:
+                break
+        return lote
+
+
+def rss_atual_mb():
+    with open('/proc/self/statm') as arquivo:
+        paginas = int(arquivo.read().split()[1])
+    return paginas * resource.getpagesize() / 1024 / 1024
+
+
+def executar_caminho(caminho, sintetico):
+    """Roda um caminho neste processo e imprime 'linhas pico_mb base_mb segundos'"""
+    import serializacao
+    import venda
+
+    if sintetico:
+        def executar_falso(conn, sql, params=None, dictionary=False):
+            return CursorSintetico(sintetico, dictionary)
+        venda.executar = executar_falso
+        venda.get_connection = lambda leitura=False: type('Conexao', (), {'close': lambda self: None})()
+
+    base = rss_atual_mb()
+    inicio = time.perf_counter()
+    vendas = venda.VendaRepo().listar_vendas(compacto=(caminho == 'compacto'))
+    corpo = serializacao.dumps(vendas)
+    duracao = time.perf_counter() - inicio
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(len(vendas), f"{pico:.1f}", f"{base:.1f}", f"{duracao:.3f}", len(corpo))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pico de memória de listar_vendas: dict x compacto")
+    parser.add_argument("--sintetico", type=int, default=0, help="gera N linhas em vez de ler do MySQL")
+    parser.add_argument("--filho", choices=("dict", "compacto"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.filho:
+        executar_caminho(args.filho, args.sintetico)
+        return
+
+    resultados = {}
+    for caminho in ("dict", "compacto"):
+        comando = [sys.executable, __file__, "--filho", caminho, "--sintetico", str(args.sintetico)]
+        saida = subprocess.run(comando, capture_output=True, text=True)
+        if saida.returncode != 0:
+            raise SystemExit(saida.stderr)
+        resultados[caminho] = saida.stdout.strip().splitlines()[-1].split()
+
+    origem = f"{args.sintetico} linhas sintéticas" if args.sintetico else "vendas do MySQL"
+    print(f"listar_vendas + serializacao.dumps ({origem})")
+    print(f"{'caminho':<10}{'linhas':>10}{'pico RSS (MB)':>16}{'acima da base':>16}{'tempo (s)':>12}")
+    for caminho, (linhas, pico, base, duracao, _) in resultados.items():
+        print(f"{caminho:<10}{int(linhas):>10}{float(pico):>16.1f}{float(pico) - float(base):>16.1f}{float(duracao):>12.3f}")
+
+    pico_dict = float(resultados["dict"][1]) - float(resultados["dict"][2])
+    pico_compacto = float(resultados["compacto"][1]) - float(resultados["compacto"][2])
+    if pico_compacto > 0:
+        print(f"redução do pico acima da base: {pico_dict / pico_compacto:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Benchmark de buscas pontuais (buscar_por_id) contra um MySQL local
+
+Uso:
+    python benchmarks/bench_preparados.py [repeticoes]
+
+Compara três formas de fazer a mesma consulta por id:
+  1. conexão nova + consulta em texto (comportamento original dos repositórios)
+  2. conexão do pool + consulta em texto
+  3. conexão do pool + prepared statement em cache (ProdutoRepo.buscar_por_id)
+
+Usa as credenciais do .env (DB_HOST, DB_USER, ...) e os produtos existentes.
+"""
+import statistics
+import sys
+import time
+from pathlib import Path
+
+BASE = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE / "codigo"))
+
+import mysql.connector
+
+from database import config_db, get_connection
+from produto import ProdutoRepo
+import preparados
+
+SQL = 'SELECT * FROM produtos WHERE id = %s'
+
+
+def ids_existentes():
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT id FROM produtos ORDER BY id LIMIT 100')
+    ids = [linha[0] for linha in cursor.fetchall()]
+    cursor.close()
+    conn.close()
+    if not ids:
+        raise SystemExit("Nenhum produto cadastrado. Rode python codigo/database.py antes.")
+    return ids
+
+
+def texto_conexao_nova(produto_id):
+    conn = mysql.connector.connect(**config_db)
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(SQL, (produto_id,))
+    cursor.fetchone()
+    cursor.close()
+    conn.close()
+
+
+def texto_pool(produto_id):
+    conn = get_connection()
+    cursor = conn.cursor(dictionary=True, buffered=True)
+    cursor.execute(SQL, (produto_id,))
+    cursor.fetchone()
+    cursor.close()
+    conn.close()
+
+
+repo = ProdutoRepo()
+
+
+def preparado_pool(produto_id):
+    repo.buscar_por_id(produto_id)
+
+
+def medir(funcao, ids, repeticoes):
+    funcao(ids[0])  # aquecimento (abre conexão / prepara statement)
+    tempos = []
+    for i in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao(ids[i % len(ids)])
+        tempos.append(time.perf_counter() - inicio)
+    tempos.sort()
+    return {
+        "media": statistics.mean(tempos) * 1e6,
+        "p50": tempos[len(tempos) // 2] * 1e6,
+        "p99": tempos[int(len(tempos) * 0.99) - 1] * 1e6,
+        "ops": repeticoes / sum(tempos),
+    }
+
+
+def main():
+    repeticoes = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    ids = ids_existentes()
+
+    # Silencia os prints de conexão dos repositórios durante a medição
+    import builtins
+    print_original = builtins.print
+    builtins.print = lambda *a, **k: None
+    try:
+        resultados = [
+            ("texto + conexão nova", medir(texto_conexao_nova, ids, repeticoes)),
+            ("texto + pool", medir(texto_pool, ids, repeticoes)),
+            ("preparado + pool", medir(preparado_pool, ids, repeticoes)),
+        ]
+    finally:
+        builtins.print = print_original
+
+    print(f"buscar_por_id x {repeticoes} ({len(ids)} ids distintos)")
+    print(f"{'modo':<24}{'média (µs)':>12}{'p50 (µs)':>12}{'p99 (µs)':>12}{'ops/s':>10}")
+    for nome, r in resultados:
+        print(f"{nome:<24}{r['media']:>12.0f}{r['p50']:>12.0f}{r['p99']:>12.0f}{r['ops']:>10.0f}")
+
+    conn = get_connection()
+    cache = preparados.cache_da_conexao(conn)
+    print(f"cache da conexão: {len(cache)} statements, {cache.acertos} acertos, {cache.falhas} falhas")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
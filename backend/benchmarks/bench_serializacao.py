@@ -0,0 +1,99 @@
+"""
+Micro-benchmark: serialização padrão do FastAPI x caminho rápido
+
+Uso:
+    python benchmarks/bench_serializacao.py [quantidade_linhas] [repeticoes]
+
+O caminho padrão reproduz o que o FastAPI faz com response_model: valida
+cada linha com o modelo pydantic, converte para tipos JSON e codifica com
+json.dumps. O caminho rápido usa serializacao.dumps direto nas linhas.
+"""
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+from typing import List
+
+BASE = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE))
+sys.path.insert(0, str(BASE / "codigo"))
+
+from pydantic import TypeAdapter
+
+from api import ProdutoResponse, VendaResponse
+import serializacao
+
+
+def gerar_produtos(n):
+    agora = datetime.now()
+    return [
+        {
+            'id': i,
+            'nome': f'Produto {i}',
+            'preco': Decimal('19.90') + i,
+            'categoria': f'Categoria {i % 20}',
+            'estoque': i % 50,
+            'created_at': agora,
+        }
+        for i in range(1, n + 1)
+    ]
+
+
+def gerar_vendas(n):
+    inicio = datetime(2024, 1, 1)
+    return [
+        {
+            'venda_id': i,
+            'produto_id': i % 500,
+            'quantidade': i % 7 + 1,
+            'valor_total': Decimal('59.70') + i,
+            'data_venda': (inicio + timedelta(minutes=i)).strftime('%Y-%m-%d %H:%M:%S'),
+            'produto_nome': f'Produto {i % 500}',
+            'produto_preco': Decimal('19.90'),
+        }
+        for i in range(1, n + 1)
+    ]
+
+
+def caminho_padrao(adapter):
+    def serializar(linhas):
+        validados = adapter.validate_python(linhas)
+        conteudo = adapter.dump_python(validados, mode="json")
+        return json.dumps(conteudo, ensure_ascii=False, allow_nan=False,
+                          indent=None, separators=(",", ":")).encode("utf-8")
+    return serializar
+
+
+def medir(funcao, linhas, repeticoes):
+    funcao(linhas)  # aquecimento
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao(linhas)
+        tempos.append(time.perf_counter() - inicio)
+    tempos.sort()
+    return tempos[len(tempos) // 2]
+
+
+def main():
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    repeticoes = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    encoder = "orjson" if serializacao.orjson is not None else "json (stdlib)"
+    print(f"Linhas: {quantidade} | repetições: {repeticoes} | encoder rápido: {encoder}")
+    print(f"{'lista':<10}{'padrão (ms)':>14}{'rápido (ms)':>14}{'ganho':>10}")
+
+    casos = [
+        ("produtos", gerar_produtos(quantidade), TypeAdapter(List[ProdutoResponse])),
+        ("vendas", gerar_vendas(quantidade), TypeAdapter(List[VendaResponse])),
+    ]
+    for nome, linhas, adapter in casos:
+        padrao = medir(caminho_padrao(adapter), linhas, repeticoes)
+        rapido = medir(serializacao.dumps, linhas, repeticoes)
+        print(f"{nome:<10}{padrao * 1000:>14.1f}{rapido * 1000:>14.1f}{padrao / rapido:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
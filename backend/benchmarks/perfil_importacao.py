@@ -0,0 +1,52 @@
+"""
+Perfil do tempo de import da API (python -X importtime)
+
+Uso:
+    python benchmarks/perfil_importacao.py [quantidade]
+
+Importa api.py num processo novo e lista os módulos com maior tempo
+acumulado, para conferir que nada pesado (numpy, pyarrow) entrou no
+caminho de import. Não precisa de banco: a conexão só é aberta no lifespan.
+"""
+import subprocess
+import sys
+from pathlib import Path
+
+BASE = Path(__file__).resolve().parent.parent
+
+
+def medir():
+    resultado = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import api"],
+        cwd=BASE, capture_output=True, text=True
+    )
+    if resultado.returncode != 0:
+        raise SystemExit(resultado.stderr)
+
+    modulos = []
+    for linha in resultado.stderr.splitlines():
+        if not linha.startswith("import time:") or "cumulative" in linha:
+            continue
+        proprio, acumulado, nome = linha[len("import time:"):].split("|")
+        modulos.append((int(acumulado), int(proprio), nome.strip()))
+    return modulos
+
+
+def main():
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    modulos = medir()
+    total = next((acumulado for acumulado, _, nome in modulos if nome == "api"), None)
+
+    print(f"{'módulo':<48}{'acumulado (ms)':>16}{'próprio (ms)':>14}")
+    for acumulado, proprio, nome in sorted(modulos, reverse=True)[:quantidade]:
+        print(f"{nome:<48}{acumulado / 1000:>16.1f}{proprio / 1000:>14.1f}")
+
+    carregados = {nome for _, _, nome in modulos}
+    for pesado in ("numpy", "pyarrow"):
+        print(f"{pesado}: {'importado' if pesado in carregados else 'não importado'}")
+    if total is not None:
+        print(f"import api: {total / 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
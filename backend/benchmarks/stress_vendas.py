@@ -0,0 +1,270 @@
+"""
+Teste de carga do registro de vendas contra um MySQL local
+
+Uso:
+    python benchmarks/stress_vendas.py [--modo threads|async] [--clientes 32]
+        [--vendas 2000] [--cenario quente|espalhado|ambos] [--skus 50]
+        [--estoque 500] [--quantidade 1] [--manter]
+
+Cria produtos de teste (categoria "stress-<timestamp>"), dispara vendas
+concorrentes com VendaRepo.registrar_venda e confere no banco, por produto:
+
+  - estoque final + unidades vendidas == estoque inicial (nada vendido além
+    do estoque, nada perdido);
+  - cada venda confirmada existe uma única vez em vendas e não há vendas que
+    o cliente não viu confirmadas;
+  - nenhum estoque ficou negativo.
+
+Cenários: "quente" manda todos os clientes para o mesmo produto (disputa
+máxima pelo FOR UPDATE); "espalhado" sorteia entre --skus produtos. O
+estoque inicial é menor que o total pedido no cenário quente, então parte
+das vendas deve falhar por estoque insuficiente.
+
+No modo async as vendas saem de tarefas asyncio via asyncio.to_thread, como
+no threadpool do FastAPI. Relata TPS, percentis de latência, novas
+tentativas por deadlock/lock wait (retry.py) e os contadores de lock do
+InnoDB. Sai com código 1 se alguma verificação falhar. Os dados de teste
+são apagados no fim, exceto com --manter.
+"""
+import argparse
+import asyncio
+import builtins
+import random
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+BASE = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE / "codigo"))
+
+from database import get_connection
+from exceptions import EstoqueInsuficienteError, TransacaoIndisponivelError
+from metricas import metricas
+from produto import ProdutoRepo
+from venda import VendaRepo
+
+SQL_METRICAS_INNODB = """
+    SELECT NAME, COUNT FROM information_schema.INNODB_METRICS
+    WHERE NAME IN ('lock_deadlocks', 'lock_timeouts', 'lock_row_lock_waits')
+"""
+
+produto_repo = ProdutoRepo()
+venda_repo = VendaRepo()
+
+
+# ==================== PREPARAÇÃO E VERIFICAÇÃO ====================
+
+def criar_produtos(categoria, quantidade, estoque):
+    return {
+        produto_repo.criar_produto(f"{categoria} #{i}", 10.0, categoria, estoque): estoque
+        for i in range(quantidade)
+    }
+
+
+def consultar(sql, params=()):
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def contadores_innodb():
+    try:
+        return dict(consultar(SQL_METRICAS_INNODB))
+    except Exception as e:
+        print(f"Contadores do InnoDB indisponíveis: {e}")
+        return {}
+
+
+def verificar(estoques_iniciais, confirmadas):
+    """Lista de violações encontradas (vazia se tudo bateu)"""
+    ids = list(estoques_iniciais)
+    marcadores = ', '.join(['%s'] * len(ids))
+    estoques = dict(consultar(f"SELECT id, estoque FROM produtos WHERE id IN ({marcadores})", ids))
+    vendidas = dict(consultar(
+        f"SELECT produto_id, SUM(quantidade) FROM vendas WHERE produto_id IN ({marcadores}) GROUP BY produto_id",
+        ids
+    ))
+    vendas_banco = [
+        venda_id for (venda_id,) in
+        consultar(f"SELECT id FROM vendas WHERE produto_id IN ({marcadores})", ids)
+    ]
+
+    violacoes = []
+    for produto_id, inicial in estoques_iniciais.items():
+        final = estoques[produto_id]
+        vendido = int(vendidas.get(produto_id) or 0)
+        if final < 0:
+            violacoes.append(f"produto {produto_id}: estoque negativo ({final})")
+        if final + vendido != inicial:
+            violacoes.append(f"produto {produto_id}: {final} em estoque + {vendido} vendidas != {inicial} iniciais")
+
+    ids_confirmados = [venda_id for venda_id, _ in confirmadas]
+    duplicadas = [v for v, n in Counter(ids_confirmados).items() if n > 1]
+    if duplicadas:
+        violacoes.append(f"venda_id devolvido mais de uma vez: {duplicadas[:10]}")
+    perdidas = set(ids_confirmados) - set(vendas_banco)
+    if perdidas:
+        violacoes.append(f"{len(perdidas)} vendas confirmadas ausentes no banco: {sorted(perdidas)[:10]}")
+    fantasmas = set(vendas_banco) - set(ids_confirmados)
+    if fantasmas:
+        violacoes.append(f"{len(fantasmas)} vendas no banco sem confirmação ao cliente: {sorted(fantasmas)[:10]}")
+
+    unidades_confirmadas = Counter()
+    for _, (produto_id, quantidade) in confirmadas:
+        unidades_confirmadas[produto_id] += quantidade
+    for produto_id in ids:
+        if unidades_confirmadas[produto_id] != int(vendidas.get(produto_id) or 0):
+            violacoes.append(f"produto {produto_id}: unidades confirmadas diferem das gravadas")
+    return violacoes
+
+
+def apagar(estoques_iniciais):
+    ids = list(estoques_iniciais)
+    marcadores = ', '.join(['%s'] * len(ids))
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"DELETE FROM vendas WHERE produto_id IN ({marcadores})", ids)
+        cursor.execute(f"DELETE FROM produtos WHERE id IN ({marcadores})", ids)
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+
+# ==================== CARGA ====================
+
+def vender(produto_id, quantidade):
+    """(resultado, latência em segundos, venda_id ou None)"""
+    inicio = time.perf_counter()
+    try:
+        venda_id, _ = venda_repo.registrar_venda(produto_id, quantidade)
+        resultado = 'ok'
+    except EstoqueInsuficienteError:
+        venda_id, resultado = None, 'sem_estoque'
+    except TransacaoIndisponivelError:
+        venda_id, resultado = None, 'retry_esgotado'
+    except Exception as e:
+        venda_id, resultado = None, f'erro:{type(e).__name__}'
+    return resultado, time.perf_counter() - inicio, venda_id
+
+
+def executar_threads(pedidos, clientes):
+    with ThreadPoolExecutor(max_workers=clientes) as executor:
+        return list(executor.map(lambda p: vender(*p), pedidos))
+
+
+async def _executar_async(pedidos, clientes):
+    limite = asyncio.Semaphore(clientes)
+
+    async def uma(produto_id, quantidade):
+        async with limite:
+            return await asyncio.to_thread(vender, produto_id, quantidade)
+
+    return await asyncio.gather(*(uma(*p) for p in pedidos))
+
+
+def executar_async(pedidos, clientes):
+    return asyncio.run(_executar_async(pedidos, clientes))
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))]
+
+
+def retentativas():
+    return {
+        erro: metricas.valor('db_retentativas_total', operacao='registrar_venda', erro=erro) or 0
+        for erro in ('deadlock', 'lock_wait_timeout')
+    }
+
+
+def cenario(nome, args):
+    categoria = f"stress-{nome}-{int(time.time())}"
+    skus = 1 if nome == 'quente' else args.skus
+    # No cenário quente o estoque acaba antes dos pedidos: testa a recusa sob disputa
+    estoque = args.estoque if nome == 'quente' else max(args.estoque, args.vendas * args.quantidade // skus + 1)
+    estoques_iniciais = criar_produtos(categoria, skus, estoque)
+    ids = list(estoques_iniciais)
+    pedidos = [(random.choice(ids), args.quantidade) for _ in range(args.vendas)]
+
+    retentativas_antes = retentativas()
+    innodb_antes = contadores_innodb()
+    executar = executar_async if args.modo == 'async' else executar_threads
+
+    print_original = builtins.print
+    builtins.print = lambda *a, **k: None  # silencia os prints dos repositórios
+    try:
+        inicio = time.perf_counter()
+        resultados = executar(pedidos, args.clientes)
+        duracao = time.perf_counter() - inicio
+    finally:
+        builtins.print = print_original
+
+    innodb_depois = contadores_innodb()
+    retentativas_depois = retentativas()
+    confirmadas = [
+        (venda_id, pedido)
+        for (resultado, _, venda_id), pedido in zip(resultados, pedidos) if resultado == 'ok'
+    ]
+    violacoes = verificar(estoques_iniciais, confirmadas)
+
+    contagem = Counter(r for r, _, _ in resultados)
+    latencias = [l * 1000 for _, l, _ in resultados]
+    print(f"\n=== cenário {nome}: {skus} produto(s), estoque {estoque}, "
+          f"{args.vendas} vendas, {args.clientes} clientes ({args.modo}) ===")
+    print(f"duração {duracao:.2f}s | TPS (vendas confirmadas) {len(confirmadas) / duracao:.0f} "
+          f"| tentativas/s {len(resultados) / duracao:.0f}")
+    print("resultados: " + ", ".join(f"{k}={v}" for k, v in sorted(contagem.items())))
+    print(f"latência (ms): p50 {percentil(latencias, 50):.1f} | p95 {percentil(latencias, 95):.1f} "
+          f"| p99 {percentil(latencias, 99):.1f} | máx {max(latencias):.1f}")
+    print("novas tentativas: " + ", ".join(
+        f"{erro}={retentativas_depois[erro] - retentativas_antes[erro]}" for erro in retentativas_depois
+    ))
+    if innodb_antes and innodb_depois:
+        print("InnoDB: " + ", ".join(
+            f"{nome_metrica}={innodb_depois[nome_metrica] - innodb_antes.get(nome_metrica, 0)}"
+            for nome_metrica in sorted(innodb_depois)
+        ))
+
+    if violacoes:
+        print("FALHOU:")
+        for violacao in violacoes:
+            print(f"  - {violacao}")
+    else:
+        print("OK: estoque final + vendidas == estoque inicial; nenhuma venda perdida ou duplicada")
+
+    if not args.manter:
+        apagar(estoques_iniciais)
+    return not violacoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Carga concorrente em VendaRepo.registrar_venda")
+    parser.add_argument("--modo", choices=("threads", "async"), default="threads")
+    parser.add_argument("--clientes", type=int, default=32)
+    parser.add_argument("--vendas", type=int, default=2000)
+    parser.add_argument("--cenario", choices=("quente", "espalhado", "ambos"), default="ambos")
+    parser.add_argument("--skus", type=int, default=50)
+    parser.add_argument("--estoque", type=int, default=500)
+    parser.add_argument("--quantidade", type=int, default=1)
+    parser.add_argument("--manter", action="store_true", help="não apaga os produtos e vendas de teste")
+    args = parser.parse_args()
+
+    cenarios = ("quente", "espalhado") if args.cenario == "ambos" else (args.cenario,)
+    sucesso = all([cenario(nome, args) for nome in cenarios])
+    sys.exit(0 if sucesso else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+Caches em memória
+
+CacheTTL guarda os dados do catálogo (ProdutoRepo). As escritas do próprio
+processo invalidam o cache inteiro, e um contador de geração impede que uma
+carga iniciada antes da invalidação grave um valor antigo depois dela. As
+listas guardadas são compartilhadas entre as requisições e não devem ser
+alteradas por quem as recebe.
+
+CacheSWR guarda resultados de relatórios com stale-while-revalidate: até
+`ttl_fresco` o valor é servido como está; entre `ttl_fresco` e `ttl_maximo`
+é servido na hora enquanto uma única atualização roda em segundo plano;
+depois de `ttl_maximo` a requisição espera um novo cálculo. Cargas
+simultâneas da mesma chave são feitas uma vez só (single-flight).
+
+ReservaCatalogo guarda a última leitura boa de cada consulta do catálogo,
+sem expirar nem ser invalidada, para servir (marcada como antiga) quando o
+banco está indisponível (disjuntor.py).
+
+As chaves incluem valores do cliente (categoria, fields=), então cada cache
+guarda no máximo `maximo` entradas (CACHE_MAXIMO_ENTRADAS), descartando as
+mais antigas.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from metricas import metricas
+
+
+MAXIMO_ENTRADAS = int(os.getenv('CACHE_MAXIMO_ENTRADAS', 1000))
+
+
+class CacheTTL:
+    def __init__(self, ttl=30.0, maximo=MAXIMO_ENTRADAS):
+        self.ttl = ttl
+        self.maximo = maximo
+        # chave -> (expira_em, valor); com TTL fixo, a ordem de gravação é a de expiração
+        self._dados = OrderedDict()
+        self._lock = threading.Lock()
+        self._geracao = 0
+
+    def obter(self, chave, carregar):
+        """Retorna o valor em cache ou chama carregar() e guarda o resultado"""
+        item = self._dados.get(chave)
+        if item is not None:
+            if item[0] > time.monotonic():
+                return item[1]
+            with self._lock:
+                if self._dados.get(chave) is item:
+                    del self._dados[chave]
+
+        geracao = self._geracao
+        valor = carregar()
+        with self._lock:
+            if geracao == self._geracao:
+                self._dados.pop(chave, None)
+                self._dados[chave] = (time.monotonic() + self.ttl, valor)
+                self._podar()
+        return valor
+
+    def _podar(self):
+        """Com o lock: tira as entradas expiradas e as que passam de maximo"""
+        agora = time.monotonic()
+        while self._dados:
+            chave, item = next(iter(self._dados.items()))
+            if item[0] > agora and len(self._dados) <= self.maximo:
+                break
+            del self._dados[chave]
+
+    def invalidar(self):
+        with self._lock:
+            self._geracao += 1
+            self._dados.clear()
+
+    def __len__(self):
+        return len(self._dados)
+
+
+class CacheSWR:
+    def __init__(self, nome, ttl_fresco=10.0, ttl_maximo=60.0, trabalhadores=2, maximo=MAXIMO_ENTRADAS):
+        self.nome = nome
+        self.ttl_fresco = ttl_fresco
+        self.ttl_maximo = ttl_maximo
+        self.maximo = maximo
+        # chave -> (carregado_em, geracao, valor), da gravada há mais tempo para a mais recente
+        self._dados = OrderedDict()
+        # chave -> threading.Event da carga em andamento
+        self._carregando = {}
+        self._lock = threading.Lock()
+        self._geracao = 0
+        self._executor = ThreadPoolExecutor(max_workers=trabalhadores, thread_name_prefix=f"cache-{nome}")
+
+    def obter(self, chave, carregar):
+        """
+        Retorna (valor, idade em segundos, estado); estado é 'fresco',
+        'antigo' (atualização disparada em segundo plano) ou 'novo'
+        """
+        item = self._dados.get(chave)
+        if item is not None:
+            carregado_em, geracao, valor = item
+            idade = time.monotonic() - carregado_em
+            if idade < self.ttl_maximo:
+                if idade < self.ttl_fresco and geracao == self._geracao:
+                    estado = 'fresco'
+                else:
+                    estado = 'antigo'
+                    self._atualizar_em_segundo_plano(chave, carregar)
+                metricas.incrementar('cache_swr_total', cache=self.nome, estado=estado)
+                return valor, idade, estado
+            self._remover(chave, item)
+
+        metricas.incrementar('cache_swr_total', cache=self.nome, estado='novo')
+        carregado_em, valor = self._carregar(chave, carregar)
+        return valor, time.monotonic() - carregado_em, 'novo'
+
+    def _carregar(self, chave, carregar):
+        with self._lock:
+            evento = self._carregando.get(chave)
+            dono = evento is None
+            if dono:
+                evento = self._carregando[chave] = threading.Event()
+                geracao = self._geracao
+
+        if not dono:
+            # Outra requisição já está calculando: aproveita o resultado dela
+            evento.wait(self.ttl_maximo)
+            item = self._dados.get(chave)
+            if item is not None and time.monotonic() - item[0] < self.ttl_maximo:
+                return item[0], item[2]
+            inicio = time.monotonic()
+            return inicio, carregar()
+
+        try:
+            inicio = time.monotonic()
+            valor = carregar()
+            with self._lock:
+                # Carga iniciada antes de uma invalidação fica marcada como antiga
+                self._dados.pop(chave, None)
+                self._dados[chave] = (inicio, geracao, valor)
+                self._podar()
+            return inicio, valor
+        finally:
+            with self._lock:
+                del self._carregando[chave]
+            evento.set()
+
+    def _remover(self, chave, item):
+        """Apaga a entrada vencida, se ninguém a regravou nesse meio tempo"""
+        with self._lock:
+            if self._dados.get(chave) is item:
+                del self._dados[chave]
+
+    def _podar(self):
+        """Com o lock: tira as entradas além de ttl_maximo e as que passam de maximo"""
+        limite = time.monotonic() - self.ttl_maximo
+        while self._dados:
+            chave, item = next(iter(self._dados.items()))
+            if item[0] > limite and len(self._dados) <= self.maximo:
+                break
+            del self._dados[chave]
+
+    def _atualizar_em_segundo_plano(self, chave, carregar):
+        if chave in self._carregando:
+            return
+        self._executor.submit(self._atualizar, chave, carregar)
+
+    def _atualizar(self, chave, carregar):
+        try:
+            self._carregar(chave, carregar)
+        except Exception as e:
+            # Continua servindo o valor anterior até ttl_maximo
+            print(f"Erro ao atualizar cache '{self.nome}' ({chave}): {e}")
+            metricas.incrementar('cache_swr_falhas_total', cache=self.nome)
+
+    def invalidar(self):
+        """Marca tudo como antigo: o próximo acesso serve e recalcula em segundo plano"""
+        with self._lock:
+            self._geracao += 1
+
+    def descartar(self):
+        """Apaga tudo: o próximo acesso já espera o valor recalculado"""
+        with self._lock:
+            self._geracao += 1
+            self._dados.clear()
+
+    def __len__(self):
+        return len(self._dados)
+
+
+class ReservaCatalogo:
+    def __init__(self, maximo=MAXIMO_ENTRADAS):
+        # chave -> (guardado_em, valor), da usada há mais tempo para a mais recente
+        self._dados = OrderedDict()
+        self.maximo = maximo
+        self._lock = threading.Lock()
+
+    def guardar(self, chave, valor):
+        with self._lock:
+            self._dados[chave] = (time.time(), valor)
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self.maximo:
+                self._dados.popitem(last=False)
+        return valor
+
+    def obter(self, chave):
+        """(valor, idade em segundos) da última leitura boa ou None"""
+        with self._lock:
+            item = self._dados.get(chave)
+            if item is None:
+                return None
+            self._dados.move_to_end(chave)
+        guardado_em, valor = item
+        return valor, time.time() - guardado_em
+
+    def __len__(self):
+        return len(self._dados)
+
+
+cache_catalogo = CacheTTL(ttl=float(os.getenv('CACHE_CATALOGO_TTL', 30)))
+cache_relatorios = CacheSWR(
+    'relatorios',
+    ttl_fresco=float(os.getenv('CACHE_RELATORIOS_TTL', 10)),
+    ttl_maximo=float(os.getenv('CACHE_RELATORIOS_TTL_MAXIMO', 60)),
+)
+reserva_catalogo = ReservaCatalogo()
+
+# Painel da página inicial (dashboard.py): TTL curto, recarregado com frequência
+cache_dashboard = CacheSWR(
+    'dashboard',
+    ttl_fresco=float(os.getenv('CACHE_DASHBOARD_TTL', 5)),
+    ttl_maximo=float(os.getenv('CACHE_DASHBOARD_TTL_MAXIMO', 15)),
+    trabalhadores=1,
+)
@@ -0,0 +1,32 @@
+"""
+Projeção de colunas nas listagens (parâmetro fields= da API)
+
+O cliente pede só as colunas que usa ("fields=id,nome,estoque"). Os nomes
+são conferidos contra a lista de permitidos de cada listagem e viram a lista
+de colunas do SELECT, então o banco lê e envia linhas mais estreitas e pode
+responder só com um índice de cobertura quando todas as colunas estão nele.
+
+Os campos são devolvidos na ordem da lista de permitidos, não na ordem
+pedida: cada combinação gera sempre o mesmo SQL, reaproveitando o prepared
+statement e a entrada do cache.
+"""
+
+
+def selecionar_campos(texto, permitidos):
+    """
+    Tupla dos campos de `texto` (separados por vírgula) na ordem de
+    `permitidos`, ou None se nada foi pedido. ValueError para campos fora
+    da lista.
+    """
+    if texto is None:
+        return None
+    pedidos = {campo.strip() for campo in texto.split(',') if campo.strip()}
+    if not pedidos:
+        return None
+
+    invalidos = pedidos.difference(permitidos)
+    if invalidos:
+        raise ValueError(
+            f"Campos inválidos: {', '.join(sorted(invalidos))}. Use {', '.join(permitidos)}"
+        )
+    return tuple(campo for campo in permitidos if campo in pedidos)
@@ -0,0 +1,97 @@
+"""
+Representação colunar dos resultados de vendas para clientes de BI
+
+Em vez de uma lista de objetos que repete todas as chaves em cada linha,
+as colunas são montadas direto das tuplas do cursor:
+
+    {"colunas": [...], "total": N, "dados": {"venda_id": [...], ...}}
+
+Também é possível pedir Arrow IPC (stream), se o pyarrow estiver instalado.
+"""
+import importlib.util
+from datetime import datetime
+from decimal import Decimal
+from functools import lru_cache
+
+from serializacao import dumps
+
+
+MEDIA_JSON_COLUNAR = "application/vnd.loja.colunar+json"
+MEDIA_ARROW = "application/vnd.apache.arrow.stream"
+
+_ALIASES = {
+    "colunar": MEDIA_JSON_COLUNAR,
+    "arrow": MEDIA_ARROW,
+}
+
+
+def negociar(accept=None, formato=None):
+    """
+    Decide o formato da resposta a partir do parâmetro `formato` ou do
+    cabeçalho Accept. Retorna o media type colunar escolhido ou None para
+    manter a lista de objetos padrão.
+    """
+    if formato:
+        return _ALIASES.get(formato.lower())
+
+    if not accept:
+        return None
+
+    for parte in accept.split(","):
+        media = parte.split(";")[0].strip().lower()
+        if media in (MEDIA_JSON_COLUNAR, MEDIA_ARROW):
+            return media
+    return None
+
+
+def _converter_coluna(valores):
+    """Converte a coluna inteira de uma vez a partir do tipo do primeiro valor"""
+    amostra = next((v for v in valores if v is not None), None)
+    if isinstance(amostra, Decimal):
+        return [float(v) if v is not None else None for v in valores]
+    if isinstance(amostra, datetime):
+        return [v.isoformat(sep=' ', timespec='seconds') if v is not None else None for v in valores]
+    return list(valores)
+
+
+def para_colunas(colunas, linhas):
+    """Transpõe as tuplas do cursor em um dict de colunas"""
+    if linhas:
+        transpostas = zip(*linhas)
+    else:
+        transpostas = ([] for _ in colunas)
+
+    return {
+        "colunas": list(colunas),
+        "total": len(linhas),
+        "dados": {nome: _converter_coluna(valores) for nome, valores in zip(colunas, transpostas)},
+    }
+
+
+def para_json(colunas, linhas):
+    return dumps(para_colunas(colunas, linhas))
+
+
+@lru_cache(maxsize=None)
+def arrow_disponivel():
+    # Só verifica se o pacote existe; o import (pesado) fica para o primeiro uso
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def para_arrow(colunas, linhas):
+    """Serializa as colunas como um stream Arrow IPC"""
+    if not arrow_disponivel():
+        raise RuntimeError("pyarrow não está instalado")
+    import pyarrow
+    import pyarrow.ipc
+
+    if linhas:
+        arrays = [pyarrow.array(list(valores)) for valores in zip(*linhas)]
+    else:
+        arrays = [pyarrow.array([], type=pyarrow.null()) for _ in colunas]
+    tabela = pyarrow.Table.from_arrays(arrays, names=list(colunas))
+
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, tabela.schema) as writer:
+        writer.write_table(tabela)
+    return sink.getvalue().to_pybytes()
@@ -0,0 +1,196 @@
+"""
+Painel da página inicial (GET /api/dashboard) numa única requisição
+
+Os contadores, os produtos com estoque baixo, os mais vendidos e as vendas
+recentes saem de uma mesma transação somente leitura aberta com CONSISTENT
+SNAPSHOT, então os números batem entre si mesmo com vendas entrando no meio.
+O MySQL não compartilha um snapshot entre conexões: as quatro consultas
+rodam em sequência na mesma conexão, todas agregadas no banco ou limitadas
+por LIMIT, em vez de a página baixar as listas inteiras de produtos e vendas.
+
+Com as vendas em vários shards (shards.py), os totais de vendas e os mais
+vendidos são agregados em cada shard, em paralelo, e somados aqui; cada
+shard tem o próprio snapshot, então só os números de um mesmo shard são
+garantidamente do mesmo instante.
+
+A API guarda o resultado em cache.cache_dashboard (TTL curto).
+"""
+from database import get_connection
+from preparados import executar
+from rastreamento import span
+from sessao import Sessao
+from shards import roteador_shards
+from venda import VendaRepo
+
+
+# Máximo de produtos na lista de estoque baixo (os contadores contam todos)
+MAX_ESTOQUE_BAIXO = 50
+
+SQL_INICIO = "START TRANSACTION WITH CONSISTENT SNAPSHOT, READ ONLY"
+
+# Uma leitura de cada tabela
+SQL_CONTADORES = """
+    SELECT p.total_produtos, p.sem_estoque, p.estoque_baixo, v.total_vendas, v.valor_total
+    FROM (
+        SELECT COUNT(*) AS total_produtos,
+               COALESCE(SUM(estoque = 0), 0) AS sem_estoque,
+               COALESCE(SUM(estoque < %s), 0) AS estoque_baixo
+        FROM produtos
+    ) p
+    CROSS JOIN (
+        SELECT COUNT(*) AS total_vendas, COALESCE(SUM(valor_total), 0) AS valor_total
+        FROM vendas
+    ) v
+"""
+
+# Com vendas em vários shards: os contadores de produtos e, em cada shard,
+# os de vendas e o total vendido de cada produto (sem LIMIT: o top de cada
+# shard não dá o top geral)
+SQL_CONTADORES_PRODUTOS = """
+    SELECT COUNT(*) AS total_produtos,
+           COALESCE(SUM(estoque = 0), 0) AS sem_estoque,
+           COALESCE(SUM(estoque < %s), 0) AS estoque_baixo
+    FROM produtos
+"""
+
+SQL_CONTADORES_VENDAS = "SELECT COUNT(*), COALESCE(SUM(valor_total), 0) FROM vendas"
+
+SQL_VENDIDOS_POR_PRODUTO = """
+    SELECT p.id, p.nome, t.total_vendido
+    FROM (
+        SELECT produto_id, SUM(quantidade) AS total_vendido
+        FROM vendas
+        GROUP BY produto_id
+    ) t
+    JOIN produtos p ON p.id = t.produto_id
+"""
+
+SQL_ESTOQUE_BAIXO = """
+    SELECT id, nome, categoria, estoque, preco
+    FROM produtos
+    WHERE estoque < %s
+    ORDER BY estoque, id
+    LIMIT %s
+"""
+
+# Agrega por produto_id antes do JOIN: só os `top` produtos buscam o nome
+SQL_TOP_PRODUTOS = """
+    SELECT p.id, p.nome, t.total_vendido
+    FROM (
+        SELECT produto_id, SUM(quantidade) AS total_vendido
+        FROM vendas
+        GROUP BY produto_id
+        ORDER BY total_vendido DESC, produto_id
+        LIMIT %s
+    ) t
+    JOIN produtos p ON p.id = t.produto_id
+    ORDER BY t.total_vendido DESC, p.id
+"""
+
+venda_repo = VendaRepo()
+
+
+def _iniciar_snapshot(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(SQL_INICIO)
+    finally:
+        cursor.close()
+
+
+def _resumo(conn, limite_estoque, vendas=None):
+    """Contadores do painel; `vendas` = (total, valor) já somados dos shards"""
+    if vendas is None:
+        total_produtos, sem_estoque, estoque_baixo, total_vendas, valor_total = executar(
+            conn, SQL_CONTADORES, (limite_estoque,)
+        ).fetchone()
+    else:
+        total_produtos, sem_estoque, estoque_baixo = executar(
+            conn, SQL_CONTADORES_PRODUTOS, (limite_estoque,)
+        ).fetchone()
+        total_vendas, valor_total = vendas
+    return {
+        "produtos": {
+            "total": total_produtos,
+            "sem_estoque": int(sem_estoque),
+            "com_estoque": total_produtos - int(sem_estoque),
+            "estoque_baixo": int(estoque_baixo),
+        },
+        "vendas": {
+            "total": total_vendas,
+            "valor_total": float(valor_total),
+        },
+    }
+
+
+def _estoque_baixo(conn, limite_estoque):
+    cursor = executar(conn, SQL_ESTOQUE_BAIXO, (limite_estoque, MAX_ESTOQUE_BAIXO), dictionary=True)
+    produtos = cursor.fetchall()
+    for produto in produtos:
+        produto['preco'] = float(produto['preco'])
+    return {"limite": limite_estoque, "produtos": produtos}
+
+
+def _top_produtos(conn, top):
+    cursor = executar(conn, SQL_TOP_PRODUTOS, (top,))
+    return [
+        {"id": produto_id, "nome": nome, "total_vendido": int(total)}
+        for produto_id, nome, total in cursor.fetchall()
+    ]
+
+
+def _vendas_do_shard(shard):
+    """Totais e vendido por produto de um shard, lidos do mesmo snapshot"""
+    conn = shard.conectar(leitura=True)
+    try:
+        _iniciar_snapshot(conn)
+        total, valor = executar(conn, SQL_CONTADORES_VENDAS).fetchone()
+        return total, valor, executar(conn, SQL_VENDIDOS_POR_PRODUTO).fetchall()
+    finally:
+        conn.close()
+
+
+def _somar_vendas_dos_shards(partes, top):
+    """((total, valor), top_produtos) a partir dos agregados parciais de cada shard"""
+    total_vendas, valor_total = 0, 0
+    vendidos = {}
+    for total, valor, linhas in partes:
+        total_vendas += total
+        valor_total += valor
+        for produto_id, nome, quantidade in linhas:
+            _, anterior = vendidos.get(produto_id, (nome, 0))
+            vendidos[produto_id] = (nome, anterior + quantidade)
+
+    mais_vendidos = sorted(vendidos.items(), key=lambda item: (-item[1][1], item[0]))[:top]
+    return (total_vendas, valor_total), [
+        {"id": produto_id, "nome": nome, "total_vendido": int(total)}
+        for produto_id, (nome, total) in mais_vendidos
+    ]
+
+
+def montar_dashboard(limite_estoque=3, top=5, recentes=10, obter_conexao=get_connection):
+    """Dados do painel lidos de um único snapshot (uma conexão, quatro consultas)"""
+    vendas = None
+    if roteador_shards.fragmentado:
+        with span('dashboard.vendas_shards'):
+            vendas, top_produtos = _somar_vendas_dos_shards(roteador_shards.espalhar(_vendas_do_shard), top)
+
+    with Sessao(obter_conexao, leitura=True) as sessao:
+        conn = sessao.conexao(leitura=True)
+        _iniciar_snapshot(conn)
+
+        with span('dashboard.resumo'):
+            resumo = _resumo(conn, limite_estoque, vendas)
+        with span('dashboard.estoque_baixo'):
+            estoque_baixo = _estoque_baixo(conn, limite_estoque)
+        if vendas is None:
+            with span('dashboard.top_produtos'):
+                top_produtos = _top_produtos(conn, top)
+        vendas_recentes = venda_repo.listar_recentes(recentes, sessao=sessao)
+
+    return {
+        "resumo": resumo,
+        "estoque_baixo": estoque_baixo,
+        "top_produtos": top_produtos,
+        "vendas_recentes": vendas_recentes,
+    }
@@ -1,8 +1,17 @@
 import mysql.connector
 from mysql.connector import Error 
 from pathlib import Path
+from contextvars import ContextVar
+from collections import deque
+import itertools
+import math
 import os
+import threading
+import time
 from dotenv import load_dotenv
+import preparados
+from disjuntor import disjuntor_banco
+from rastreamento import rastreado, span
 
 # Carrega variáveis de ambiente do arquivo .env (se existir)
 load_dotenv()
@@ -12,15 +21,293 @@ config_db = {
     'host': os.getenv('DB_HOST', 'localhost'),
     'user': os.getenv('DB_USER', 'root'),
     'password': os.getenv('DB_PASSWORD', '12345678'),
-    'database': os.getenv('DB_NAME', 'loja_virtual')
+    'database': os.getenv('DB_NAME', 'loja_virtual'),
+    # Sem limite o connect espera o timeout do sistema com o servidor fora do ar
+    'connection_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', 5))
 }
 
-def get_connection():
+
+def _config_replicas(hosts):
+    """Monta a configuração das réplicas de leitura a partir de 'host[:porta],...'"""
+    replicas = []
+    for item in filter(None, (h.strip() for h in hosts.split(','))):
+        host, _, porta = item.partition(':')
+        config = dict(config_db, host=host)
+        if porta:
+            config['port'] = int(porta)
+        replicas.append(config)
+    return replicas
+
+
+# Réplicas de leitura (opcional). Sem DB_READ_HOSTS tudo vai para o primário.
+config_leitura = _config_replicas(os.getenv('DB_READ_HOSTS', ''))
+
+# Atraso máximo aceito numa réplica antes de tirá-la do rodízio (segundos)
+MAX_ATRASO_REPLICA = float(os.getenv('DB_REPLICA_MAX_LAG', 2))
+INTERVALO_CHECAGEM_REPLICA = float(os.getenv('DB_REPLICA_CHECK_INTERVAL', 5))
+
+# Depois de uma escrita, o cliente lê do primário por esta janela (segundos)
+JANELA_LEITURA_PRIMARIO = float(os.getenv('DB_STICKY_WINDOW', 5))
+
+# Instante (time.time()) até o qual as leituras do contexto atual vão para o primário
+_primario_ate = ContextVar('primario_ate', default=0.0)
+
+
+def fixar_primario(ate=None):
+    """
+    Faz as leituras do contexto atual irem para o primário até `ate`. O valor
+    pode vir do cliente (cookie/cabeçalho): nunca passa da janela a partir de
+    agora, e inf/nan dão ValueError.
+    """
+    limite = time.time() + JANELA_LEITURA_PRIMARIO
+    if ate is None:
+        ate = limite
+    elif not math.isfinite(ate):
+        raise ValueError(f"Instante inválido para a leitura no primário: {ate}")
+    ate = min(ate, limite)
+    if ate > _primario_ate.get():
+        _primario_ate.set(ate)
+    return _primario_ate.get()
+
+
+def leitura_fixada_no_primario():
+    return time.time() < _primario_ate.get()
+
+
+# Conexões ociosas mantidas por servidor. Com 0 cada conexão é fechada de verdade.
+TAMANHO_POOL = int(os.getenv('DB_POOL_SIZE', 5))
+# Conexões ociosas há mais tempo que isso são testadas (ping) antes do reuso
+VALIDAR_OCIOSA_APOS = 30.0
+
+
+class ConexaoPool:
+    """
+    Conexão emprestada do pool. Repassa tudo para a conexão física, mas
+    close() devolve a conexão ao pool em vez de encerrá-la, preservando o
+    cache de prepared statements dela.
+    """
+
+    def __init__(self, conexao, pool):
+        object.__setattr__(self, '_conexao', conexao)
+        object.__setattr__(self, '_pool', pool)
+
+    @property
+    def conexao_fisica(self):
+        return self._conexao
+
+    @property
+    def disjuntor(self):
+        """Disjuntor do banco desta conexão (None: o do principal)"""
+        return self._pool.disjuntor
+
+    def __getattr__(self, nome):
+        return getattr(self._conexao, nome)
+
+    def __setattr__(self, nome, valor):
+        setattr(self._conexao, nome, valor)
+
+    def commit(self):
+        with span('db.commit'):
+            self._conexao.commit()
+
+    def close(self):
+        conexao = self._conexao
+        if conexao is None:
+            return
+        object.__setattr__(self, '_conexao', None)
+        self._pool.devolver(conexao)
+
+
+class PoolConexoes:
+    def __init__(self, config, tamanho=TAMANHO_POOL, disjuntor=None):
+        self.config = config
+        self.tamanho = tamanho
+        # Disjuntor que mede o SQL das conexões deste pool (shards.py)
+        self.disjuntor = disjuntor
+        self._ociosas = deque()
+
+    def retirar(self):
+        """Retorna uma conexão ociosa válida ou None"""
+        while True:
+            try:
+                conexao, devolvida_em = self._ociosas.pop()
+            except IndexError:
+                return None
+            if time.monotonic() - devolvida_em > VALIDAR_OCIOSA_APOS:
+                try:
+                    conexao.ping(reconnect=True, attempts=1)
+                except Exception:
+                    self._fechar(conexao)
+                    continue
+            return ConexaoPool(conexao, self)
+
+    def embrulhar(self, conexao):
+        return ConexaoPool(conexao, self)
+
+    def devolver(self, conexao):
+        try:
+            preparados.liberar(conexao)
+            # Encerra a transação implícita aberta pelos SELECTs para que a
+            # próxima requisição não leia um snapshot antigo
+            if conexao.in_transaction:
+                conexao.rollback()
+            conexao.autocommit = False
+        except Exception as e:
+            print(f"Descartando conexão do pool: {e}")
+            self._fechar(conexao)
+            return
+
+        if len(self._ociosas) < self.tamanho:
+            self._ociosas.append((conexao, time.monotonic()))
+        else:
+            self._fechar(conexao)
+
+    def limpar(self):
+        while self._ociosas:
+            self._fechar(self._ociosas.pop()[0])
+
+    @staticmethod
+    def _fechar(conexao):
+        try:
+            conexao.close()
+        except Exception:
+            pass
+
+    def __len__(self):
+        return len(self._ociosas)
+
+
+pool_primario = PoolConexoes(config_db)
+
+
+class Replica:
+    def __init__(self, config):
+        self.config = config
+        self.saudavel = True
+        self.atraso = None
+        self.pool = PoolConexoes(config)
+
+    @property
+    def nome(self):
+        return f"{self.config['host']}:{self.config.get('port', 3306)}"
+
+    def conectar(self):
+        conexao = self.pool.retirar()
+        if conexao is not None:
+            return conexao
+        return self.pool.embrulhar(mysql.connector.connect(**self.config))
+
+    def checar(self, max_atraso):
+        """Mede o atraso de replicação e marca a réplica como saudável ou não"""
+        conn = None
+        try:
+            # Conexão própria do monitor, fora do pool
+            conn = mysql.connector.connect(**self.config)
+            cursor = conn.cursor(dictionary=True)
+            try:
+                cursor.execute("SHOW REPLICA STATUS")
+            except Error:
+                # MySQL anterior a 8.0.22
+                cursor.execute("SHOW SLAVE STATUS")
+            status = cursor.fetchone() or {}
+            cursor.close()
+
+            atraso = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+            self.atraso = atraso
+            # None significa replicação parada
+            self.saudavel = atraso is not None and atraso <= max_atraso
+        except Exception as e:
+            print(f"Réplica {self.nome} indisponível: {e}")
+            self.atraso = None
+            self.saudavel = False
+        finally:
+            if conn:
+                conn.close()
+        return self.saudavel
+
+
+class RoteadorLeitura:
+    """
+    Distribui as leituras entre as réplicas saudáveis em rodízio. Uma thread
+    em segundo plano mede o atraso de cada réplica e tira do rodízio as que
+    passarem de max_atraso (ou estiverem fora do ar) até a próxima checagem.
+    """
+
+    def __init__(self, configs, max_atraso=2.0, intervalo_checagem=5.0):
+        self.replicas = [Replica(c) for c in configs]
+        self.max_atraso = max_atraso
+        self.intervalo_checagem = intervalo_checagem
+        self._lock = threading.Lock()
+        self._rodizio = itertools.count()
+        self._monitor = None
+
+    def checar_replicas(self):
+        for replica in self.replicas:
+            replica.checar(self.max_atraso)
+
+    def _monitorar(self):
+        while True:
+            time.sleep(self.intervalo_checagem)
+            self.checar_replicas()
+
+    def _iniciar_monitor(self):
+        with self._lock:
+            if self._monitor is None:
+                self.checar_replicas()
+                self._monitor = threading.Thread(target=self._monitorar, name="monitor-replicas", daemon=True)
+                self._monitor.start()
+
+    def escolher(self):
+        """Retorna a próxima réplica saudável ou None para usar o primário"""
+        if not self.replicas:
+            return None
+        if self._monitor is None and self.intervalo_checagem > 0:
+            self._iniciar_monitor()
+
+        saudaveis = [r for r in self.replicas if r.saudavel]
+        if not saudaveis:
+            return None
+        return saudaveis[next(self._rodizio) % len(saudaveis)]
+
+    def descartar(self, replica):
+        """Tira a réplica do rodízio até a próxima checagem"""
+        replica.saudavel = False
+
+
+roteador_leitura = RoteadorLeitura(config_leitura, MAX_ATRASO_REPLICA, INTERVALO_CHECAGEM_REPLICA)
+
+
+@rastreado('db.get_connection')
+def get_connection(leitura=False):
+    """
+    Abre uma conexão com o banco. Com leitura=True a conexão pode ir para
+    uma réplica, exceto logo após uma escrita do mesmo cliente. Com o
+    disjuntor aberto lança BancoIndisponivelError sem tentar conectar.
+    """
+    disjuntor_banco.permitir()
+    with disjuntor_banco.medir():
+        return _abrir_conexao(leitura)
+
+
+def _abrir_conexao(leitura):
+    if leitura and not leitura_fixada_no_primario():
+        replica = roteador_leitura.escolher()
+        if replica is not None:
+            try:
+                return replica.conectar()
+            except Error as e:
+                print(f"Erro ao conectar na réplica {replica.nome}, usando o primário: {e}")
+                roteador_leitura.descartar(replica)
+
+    conexao = pool_primario.retirar()
+    if conexao is not None:
+        return conexao
+
     try:
         conexao = mysql.connector.connect(**config_db)
         if conexao.is_connected():
             print("Conexao bem-sucedida ao banco de dados MySQL")
-            return conexao
+            return pool_primario.embrulhar(conexao)
     except Error as e:
         print(f"Erro ao conectar ao MySQL: {e}")
         raise
@@ -0,0 +1,226 @@
+"""
+Disjuntor (circuit breaker) da camada de banco
+
+Com o MySQL fora do ar ou lento, cada requisição esperava o timeout do
+connect e ocupava um worker à toa. O disjuntor acompanha o resultado das
+chamadas ao banco (obter conexão e executar SQL) numa janela deslizante e
+abre quando a taxa de falhas de disponibilidade ou de chamadas lentas passa
+do limite:
+
+  fechado      tudo passa; resultados contados na janela
+  aberto       get_connection falha na hora com BancoIndisponivelError, sem
+               tocar no banco, por `tempo_aberto` segundos
+  meio_aberto  até `sondas` requisições passam como sonda; se todas derem
+               certo o disjuntor fecha, uma falha volta a abrir
+
+Só contam como falha os erros de disponibilidade (conexão recusada ou
+perdida, servidor saindo, conexões esgotadas, timeout); erros de SQL,
+duplicidade ou deadlock mostram que o banco respondeu. Lentidão só conta
+na obtenção da conexão: um relatório pesado ou uma espera por lock demoram
+sem que o banco esteja fora do ar.
+
+Enquanto o banco está indisponível, o catálogo é servido da última leitura
+boa (cache.ReservaCatalogo) e a resposta sai marcada como antiga: o
+repositório chama marcar_antigo() e a API põe Age/Warning na resposta.
+"""
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from mysql.connector import errors
+
+from exceptions import BancoIndisponivelError
+from metricas import metricas
+
+
+FECHADO, MEIO_ABERTO, ABERTO = 'fechado', 'meio_aberto', 'aberto'
+CODIGOS_ESTADO = {FECHADO: 0, MEIO_ABERTO: 1, ABERTO: 2}
+
+# Erros do servidor/cliente que indicam banco indisponível
+ERROS_INDISPONIBILIDADE = {
+    1040,  # too many connections
+    1053,  # server shutdown in progress
+    2002,  # can't connect (socket)
+    2003,  # can't connect (TCP)
+    2005,  # unknown host
+    2006,  # server has gone away
+    2013,  # lost connection during query
+    2055,  # lost connection (system error)
+    3024,  # max_execution_time excedido
+}
+
+
+def indica_indisponibilidade(erro):
+    """Indica se o erro deve contar como falha no disjuntor"""
+    if isinstance(erro, (TimeoutError, ConnectionError)):
+        return True
+    if isinstance(erro, errors.Error):
+        return erro.errno in ERROS_INDISPONIBILIDADE or isinstance(erro, errors.InterfaceError)
+    return False
+
+
+class Disjuntor:
+    def __init__(self, nome, limite_falhas=0.5, limite_lentas=0.8, latencia_lenta=2.0,
+                 minimo_chamadas=10, janela=10.0, tempo_aberto=5.0, sondas=2, habilitado=True):
+        self.nome = nome
+        self.limite_falhas = limite_falhas
+        self.limite_lentas = limite_lentas
+        self.latencia_lenta = latencia_lenta
+        self.minimo_chamadas = minimo_chamadas
+        self.janela = janela
+        self.tempo_aberto = tempo_aberto
+        self.sondas = sondas
+        self.habilitado = habilitado
+
+        self.estado = FECHADO
+        self._lock = threading.Lock()
+        # (instante, falhou, lenta) das chamadas dentro da janela
+        self._chamadas = deque()
+        self._falhas = 0
+        self._lentas = 0
+        self._aberto_ate = 0.0
+        self._sondas_liberadas = 0
+        self._sondas_ok = 0
+        self._meio_aberto_desde = 0.0
+
+        metricas.definir_funcao('disjuntor_estado', lambda: CODIGOS_ESTADO[self.estado], disjuntor=nome)
+
+    # ----- estado -----
+
+    def _mudar(self, estado, agora):
+        metricas.incrementar('disjuntor_transicoes_total', disjuntor=self.nome, para=estado)
+        print(f"Disjuntor '{self.nome}': {self.estado} -> {estado}")
+        self.estado = estado
+        if estado == ABERTO:
+            self._aberto_ate = agora + self.tempo_aberto
+        elif estado == MEIO_ABERTO:
+            self._meio_aberto_desde = agora
+            self._sondas_liberadas = 0
+            self._sondas_ok = 0
+        else:
+            self._chamadas.clear()
+            self._falhas = self._lentas = 0
+
+    def tentar_apos(self, agora=None):
+        """Segundos até a próxima sonda (para o Retry-After)"""
+        agora = time.monotonic() if agora is None else agora
+        return max(1, int(self._aberto_ate - agora + 0.999))
+
+    def permitir(self):
+        """Libera a chamada ou lança BancoIndisponivelError sem tocar no banco"""
+        if not self.habilitado or self.estado == FECHADO:
+            return
+
+        agora = time.monotonic()
+        with self._lock:
+            if self.estado == ABERTO and agora >= self._aberto_ate:
+                self._mudar(MEIO_ABERTO, agora)
+            if self.estado == MEIO_ABERTO:
+                # Sonda que nunca registrou resultado não trava o meio aberto
+                if agora - self._meio_aberto_desde > self.tempo_aberto:
+                    self._meio_aberto_desde = agora
+                    self._sondas_liberadas = self._sondas_ok
+                if self._sondas_liberadas < self.sondas:
+                    self._sondas_liberadas += 1
+                    return
+            if self.estado == FECHADO:
+                return
+
+        metricas.incrementar('disjuntor_rejeicoes_total', disjuntor=self.nome)
+        raise BancoIndisponivelError(
+            f"Banco de dados indisponível ({self.nome}), tente novamente", tentar_apos=self.tentar_apos(agora)
+        )
+
+    # ----- resultados -----
+
+    def registrar(self, duracao, erro=None, contar_lenta=True):
+        """Conta o resultado de uma chamada ao banco (contar_lenta=False: só o erro)"""
+        if not self.habilitado:
+            return
+        falhou = erro is not None and indica_indisponibilidade(erro)
+        lenta = contar_lenta and not falhou and duracao >= self.latencia_lenta
+        agora = time.monotonic()
+
+        with self._lock:
+            if self.estado == MEIO_ABERTO:
+                if falhou or lenta:
+                    self._mudar(ABERTO, agora)
+                else:
+                    self._sondas_ok += 1
+                    if self._sondas_ok >= self.sondas:
+                        self._mudar(FECHADO, agora)
+                return
+            if self.estado == ABERTO:
+                return
+
+            self._chamadas.append((agora, falhou, lenta))
+            self._falhas += falhou
+            self._lentas += lenta
+            limite = agora - self.janela
+            while self._chamadas and self._chamadas[0][0] < limite:
+                _, f, l = self._chamadas.popleft()
+                self._falhas -= f
+                self._lentas -= l
+
+            total = len(self._chamadas)
+            if total >= self.minimo_chamadas and (
+                self._falhas / total >= self.limite_falhas or self._lentas / total >= self.limite_lentas
+            ):
+                self._mudar(ABERTO, agora)
+
+    @contextmanager
+    def medir(self, contar_lenta=True):
+        """Registra a duração e o erro (se houver) do bloco"""
+        inicio = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self.registrar(time.monotonic() - inicio, e, contar_lenta)
+            raise
+        self.registrar(time.monotonic() - inicio, contar_lenta=contar_lenta)
+
+    def resetar(self):
+        with self._lock:
+            self._mudar(FECHADO, time.monotonic())
+
+
+def _env_bool(nome, padrao):
+    return os.getenv(nome, padrao).lower() in ('1', 'true', 'sim')
+
+
+disjuntor_banco = Disjuntor(
+    'mysql',
+    limite_falhas=float(os.getenv('DISJUNTOR_LIMITE_FALHAS', 0.5)),
+    limite_lentas=float(os.getenv('DISJUNTOR_LIMITE_LENTAS', 0.8)),
+    latencia_lenta=float(os.getenv('DISJUNTOR_LATENCIA_LENTA', 2.0)),
+    minimo_chamadas=int(os.getenv('DISJUNTOR_MINIMO_CHAMADAS', 10)),
+    janela=float(os.getenv('DISJUNTOR_JANELA', 10)),
+    tempo_aberto=float(os.getenv('DISJUNTOR_TEMPO_ABERTO', 5)),
+    sondas=int(os.getenv('DISJUNTOR_SONDAS', 2)),
+    habilitado=_env_bool('DISJUNTOR_HABILITADO', '1'),
+)
+
+
+# ==================== RESPOSTAS COM DADOS ANTIGOS ====================
+
+# Objeto da requisição atual onde os repositórios anotam a idade dos dados
+# servidos da reserva. É um dict mutável para a anotação chegar ao
+# middleware mesmo feita numa cópia do contexto (threadpool, tarefas)
+_dados_antigos = ContextVar('dados_antigos', default=None)
+
+
+def acompanhar_dados_antigos():
+    """Começa a acompanhar a requisição atual; retorna o dict das anotações"""
+    anotacoes = {}
+    _dados_antigos.set(anotacoes)
+    return anotacoes
+
+
+def marcar_antigo(idade):
+    """Anota que a resposta atual usa dados de `idade` segundos atrás"""
+    anotacoes = _dados_antigos.get()
+    if anotacoes is not None:
+        anotacoes['idade'] = max(anotacoes.get('idade', 0), idade)
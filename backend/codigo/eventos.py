@@ -0,0 +1,162 @@
+"""
+Barramento de eventos em memória usado pelo stream SSE (/api/eventos)
+
+Os repositórios publicam deltas compactos (venda criada, estoque alterado,
+produto atualizado) depois do commit. Cada evento é serializado uma única vez
+no formato SSE e distribuído para todos os clientes conectados, cada um com
+uma fila limitada. Um cliente lento demais é desconectado e reconecta usando
+o cabeçalho Last-Event-ID, recebendo o que perdeu a partir do histórico.
+"""
+import asyncio
+import json
+import os
+import threading
+from collections import deque
+from datetime import date, datetime
+from decimal import Decimal
+
+
+def _converter(valor):
+    """Converte tipos vindos do MySQL para algo serializável em JSON"""
+    if isinstance(valor, Decimal):
+        return float(valor)
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    raise TypeError(f"Tipo não serializável: {type(valor).__name__}")
+
+
+class Evento:
+    """Evento já serializado no formato text/event-stream"""
+    __slots__ = ("id", "tipo", "frame")
+
+    def __init__(self, evento_id, tipo, dados):
+        self.id = evento_id
+        self.tipo = tipo
+        payload = json.dumps(dados, default=_converter, separators=(",", ":"))
+        self.frame = f"id: {evento_id}\nevent: {tipo}\ndata: {payload}\n\n".encode("utf-8")
+
+
+class Assinante:
+    """Cliente SSE conectado, com uma fila de tamanho limitado"""
+
+    def __init__(self, loop, tamanho_buffer):
+        self.loop = loop
+        self.fila = asyncio.Queue(maxsize=tamanho_buffer)
+        self.desconectado = False
+
+    def entregar(self, evento):
+        # Executado sempre na thread do event loop do assinante
+        if self.desconectado:
+            return
+        try:
+            self.fila.put_nowait(evento)
+        except asyncio.QueueFull:
+            # Cliente não acompanha o ritmo: descarta o buffer e encerra o
+            # stream. O navegador reconecta com Last-Event-ID.
+            self.desconectado = True
+            while not self.fila.empty():
+                self.fila.get_nowait()
+            self.fila.put_nowait(None)
+
+
+class BarramentoEventos:
+    def __init__(self, tamanho_historico=1000, tamanho_buffer=256, max_assinantes=5000):
+        self.tamanho_buffer = tamanho_buffer
+        self.max_assinantes = max_assinantes
+        self._lock = threading.Lock()
+        self._historico = deque(maxlen=tamanho_historico)
+        self._ultimo_id = 0
+        self._assinantes = set()
+
+    @property
+    def ultimo_id(self):
+        return self._ultimo_id
+
+    @property
+    def total_assinantes(self):
+        return len(self._assinantes)
+
+    def publicar(self, tipo, dados):
+        """Registra o evento no histórico e distribui para os assinantes"""
+        with self._lock:
+            self._ultimo_id += 1
+            evento = Evento(self._ultimo_id, tipo, dados)
+            self._historico.append(evento)
+            assinantes = list(self._assinantes)
+
+        for assinante in assinantes:
+            try:
+                assinante.loop.call_soon_threadsafe(assinante.entregar, evento)
+            except RuntimeError:
+                # Event loop já encerrado
+                self.cancelar(assinante)
+        return evento
+
+    def assinar(self, ultimo_id_recebido=None):
+        """
+        Registra um novo assinante e retorna (assinante, pendentes).
+        `pendentes` são os eventos do histórico posteriores a ultimo_id_recebido,
+        ou None quando não é possível retomar (histórico já descartado ou
+        servidor reiniciado) e o cliente precisa recarregar os dados.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if len(self._assinantes) >= self.max_assinantes:
+                return None, []
+
+            assinante = Assinante(loop, self.tamanho_buffer)
+            pendentes = []
+            if ultimo_id_recebido is not None:
+                pendentes = self._eventos_desde(ultimo_id_recebido)
+            self._assinantes.add(assinante)
+        return assinante, pendentes
+
+    def cancelar(self, assinante):
+        with self._lock:
+            self._assinantes.discard(assinante)
+
+    def _eventos_desde(self, ultimo_id_recebido):
+        if ultimo_id_recebido > self._ultimo_id:
+            return None
+        if ultimo_id_recebido == self._ultimo_id:
+            return []
+        if not self._historico or self._historico[0].id > ultimo_id_recebido + 1:
+            return None
+        return [e for e in self._historico if e.id > ultimo_id_recebido]
+
+    async def stream(self, assinante, pendentes, intervalo_keepalive=15.0):
+        """Gerador assíncrono com os frames SSE de um assinante"""
+        try:
+            yield b"retry: 3000\n\n"
+            if pendentes is None:
+                yield f"id: {self._ultimo_id}\nevent: reset\ndata: {{}}\n\n".encode("utf-8")
+            else:
+                for evento in pendentes:
+                    yield evento.frame
+
+            while True:
+                try:
+                    evento = await asyncio.wait_for(assinante.fila.get(), timeout=intervalo_keepalive)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                if evento is None:
+                    break
+                yield evento.frame
+        finally:
+            self.cancelar(assinante)
+
+
+def publicar(tipo, dados):
+    """Publica no barramento global sem deixar falhas afetarem a escrita"""
+    try:
+        barramento.publicar(tipo, dados)
+    except Exception as e:
+        print(f"Erro ao publicar evento {tipo}: {e}")
+
+
+barramento = BarramentoEventos(
+    tamanho_historico=int(os.getenv('SSE_HISTORICO', 1000)),
+    tamanho_buffer=int(os.getenv('SSE_BUFFER_CLIENTE', 256)),
+    max_assinantes=int(os.getenv('SSE_MAX_CLIENTES', 5000)),
+)
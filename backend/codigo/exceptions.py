@@ -57,4 +57,20 @@ class ConexaoError(DatabaseError):
     """Exceção lançada quando há erro de conexão com o banco"""
     def __init__(self, message="Erro ao conectar ao banco de dados"):
         self.message = message
-        super().__init__(self.message)
\ No newline at end of file
+        super().__init__(self.message)
+
+
+class TransacaoIndisponivelError(DatabaseError):
+    """Exceção lançada quando a transação continua em conflito (deadlock/lock wait) após as novas tentativas"""
+    def __init__(self, message="Banco de dados ocupado, tente novamente", tentar_apos=1):
+        self.message = message
+        self.tentar_apos = tentar_apos
+        super().__init__(self.message)
+
+
+class BancoIndisponivelError(DatabaseError):
+    """Exceção lançada sem tocar no banco enquanto o disjuntor está aberto (disjuntor.py)"""
+    def __init__(self, message="Banco de dados indisponível, tente novamente", tentar_apos=1):
+        self.message = message
+        self.tentar_apos = tentar_apos
+        super().__init__(self.message)
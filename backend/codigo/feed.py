@@ -0,0 +1,41 @@
+"""
+Feeds incrementais de alterações (GET /api/vendas/changes e
+GET /api/produtos/changes)
+
+O cliente guarda a marca d'água devolvida em cada resposta e a envia na
+próxima chamada; a consulta parte dela por um índice (vendas.id ou
+produtos.updated_at, id), então o custo depende só do que mudou.
+
+O id e o updated_at são definidos no INSERT/UPDATE, mas a linha só fica
+visível no commit: uma linha recente pode aparecer antes de outra com marca
+menor ainda não confirmada. Por isso o feed para na primeira linha mais nova
+que MARGEM_FEED segundos (a consulta a marca na coluna `recente`), para a
+marca d'água não passar por cima da que ainda vai aparecer.
+
+A margem só vale se o commit vier em até MARGEM_FEED segundos da escrita.
+Os repositórios chamam sessao.limitar_commit(sessao, MARGEM_FEED) antes do
+INSERT/UPDATE, a API confirma a sessão assim que a unidade de trabalho
+termina (em_transacao) e, se o prazo já passou, a transação é desfeita
+(503) em vez de confirmar uma linha abaixo de uma marca já entregue.
+"""
+import os
+
+
+MARGEM_FEED = float(os.getenv('FEED_MARGEM_SEGUNDOS', 2))
+LIMITE_MAXIMO = int(os.getenv('FEED_LIMITE_MAXIMO', 5000))
+
+
+def linhas_confirmadas(linhas, limite):
+    """
+    (linhas, tem_mais) do feed: até `limite` linhas (a consulta busca
+    limite + 1), cortadas antes da primeira marcada como recente. Remove a
+    coluna auxiliar `recente`.
+    """
+    tem_mais = len(linhas) > limite
+    linhas = linhas[:limite]
+    for i, linha in enumerate(linhas):
+        if linha.pop('recente'):
+            # O restante volta numa próxima chamada
+            del linhas[i:]
+            return linhas, False
+    return linhas, tem_mais
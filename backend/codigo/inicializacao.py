@@ -0,0 +1,112 @@
+"""
+Inicialização da API: etapas de aquecimento e importação tardia de módulos
+
+O lifespan do FastAPI (api.py) executa as etapas antes de aceitar tráfego,
+para que a primeira requisição de uma instância nova já encontre conexões
+abertas, statements preparados e caches carregados. Etapas obrigatórias
+rodam em sequência e interrompem a subida se falharem; as opcionais rodam
+em paralelo (threads) e cada uma tem seu próprio timeout.
+"""
+import asyncio
+import importlib.util
+import sys
+import time
+
+from database import pool_primario, roteador_leitura, get_connection
+from preparados import executar
+from shards import roteador_shards
+
+
+class Etapa:
+    def __init__(self, nome, funcao, timeout=5.0, obrigatoria=False):
+        self.nome = nome
+        self.funcao = funcao
+        self.timeout = timeout
+        self.obrigatoria = obrigatoria
+
+
+async def _executar_etapa(etapa):
+    inicio = time.perf_counter()
+    resultado = {"status": "ok"}
+    try:
+        # A thread continua rodando se o timeout estourar; só paramos de esperar
+        await asyncio.wait_for(asyncio.to_thread(etapa.funcao), timeout=etapa.timeout)
+    except asyncio.TimeoutError:
+        resultado = {"status": "timeout"}
+    except Exception as e:
+        resultado = {"status": "erro", "erro": str(e)}
+    resultado["duracao_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+    print(f"Inicialização [{etapa.nome}]: {resultado['status']} em {resultado['duracao_ms']} ms")
+    return etapa.nome, resultado
+
+
+async def executar_etapas(etapas):
+    """
+    Executa as etapas obrigatórias em ordem e depois as opcionais em paralelo.
+    Retorna um relatório {nome: {"status", "duracao_ms", ...}}.
+    """
+    relatorio = {}
+    for etapa in (e for e in etapas if e.obrigatoria):
+        nome, resultado = await _executar_etapa(etapa)
+        relatorio[nome] = resultado
+        if resultado["status"] != "ok":
+            raise RuntimeError(f"Etapa obrigatória '{nome}' falhou: {resultado}")
+
+    opcionais = [e for e in etapas if not e.obrigatoria]
+    for nome, resultado in await asyncio.gather(*(_executar_etapa(e) for e in opcionais)):
+        relatorio[nome] = resultado
+    return relatorio
+
+
+# ==================== ETAPAS DE AQUECIMENTO ====================
+
+# Statements mais usados, preparados em cada conexão aquecida
+SQL_AQUECIMENTO = 'SELECT * FROM produtos WHERE id = %s'
+
+
+def aquecer_pool(quantidade=None):
+    """
+    Abre `quantidade` conexões com o primário (padrão: tamanho do pool),
+    prepara a busca por id em cada uma e devolve todas ao pool.
+    """
+    quantidade = pool_primario.tamanho if quantidade is None else quantidade
+    conexoes = []
+    try:
+        for _ in range(quantidade):
+            conn = get_connection()
+            executar(conn, SQL_AQUECIMENTO, (0,), dictionary=True).fetchall()
+            conexoes.append(conn)
+    finally:
+        for conn in conexoes:
+            conn.close()
+
+    # Mede o atraso das réplicas antes do primeiro uso
+    if roteador_leitura.replicas:
+        roteador_leitura.escolher()
+
+
+def importar_tardio(nome):
+    """
+    Registra o módulo para ser carregado só no primeiro acesso a um atributo.
+    Usado para módulos pesados (NumPy, pyarrow) fora do caminho de import da API.
+    """
+    if nome in sys.modules:
+        return sys.modules[nome]
+
+    spec = importlib.util.find_spec(nome)
+    if spec is None:
+        raise ImportError(f"Módulo não encontrado: {nome}")
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    modulo = importlib.util.module_from_spec(spec)
+    sys.modules[nome] = modulo
+    loader.exec_module(modulo)
+    return modulo
+
+
+def encerrar_pools():
+    """Fecha as conexões ociosas do primário, das réplicas e dos shards"""
+    pool_primario.limpar()
+    for replica in roteador_leitura.replicas:
+        replica.pool.limpar()
+    roteador_shards.encerrar()
@@ -0,0 +1,217 @@
+"""
+Invalidação de caches entre processos (vários workers do uvicorn ou pods)
+
+Cada escrita, depois do commit dos dados, limpa na hora os caches
+registrados deste processo (catálogo, relatórios, painel) e marca o nome
+como pendente. Uma thread em cada processo, a cada `intervalo` segundos,
+incrementa de uma vez a versão dos nomes pendentes na tabela cache_versoes
+e lê a tabela (poucas linhas, busca pela chave primária); ao ver uma versão
+nova, limpa os caches locais registrados para o nome. Assim as escritas não
+abrem conexão nem disputam as linhas de cache_versoes (no máximo um UPDATE
+por processo e intervalo), e um worker enxerga a escrita de outro em
+~2 * intervalo segundos, sem depender de serviços externos.
+
+Se a tabela ficar inacessível (ou não existir) por mais de `limite_falhas`
+segundos, os caches são limpos uma vez, com um aviso no log, e as novas
+leituras vão se espaçando até ESPERA_MAXIMA; a partir daí a defasagem fica
+limitada pelo TTL de cada cache.
+
+O barramento só é ligado por padrão com vários workers (WEB_CONCURRENCY >
+1) e algum cache com TTL; CACHE_INVALIDACAO_INTERVALO define o intervalo
+explicitamente. Com intervalo=0 só há invalidação local, suficiente para um
+único processo.
+"""
+import os
+import threading
+import time
+from functools import lru_cache
+
+from cache import cache_catalogo, cache_dashboard, cache_relatorios
+from database import get_connection
+from preparados import executar
+from metricas import metricas
+
+
+def _intervalo_padrao():
+    """
+    CACHE_INVALIDACAO_INTERVALO ou, sem a variável, 1s com vários workers e
+    algum cache ligado
+    """
+    valor = os.getenv('CACHE_INVALIDACAO_INTERVALO', '').strip()
+    if valor:
+        return float(valor)
+    varios_workers = int(os.getenv('WEB_CONCURRENCY', 1) or 1) > 1
+    caches_ligados = cache_catalogo.ttl > 0 or cache_relatorios.ttl_fresco > 0 or cache_dashboard.ttl_fresco > 0
+    return 1.0 if varios_workers and caches_ligados else 0.0
+
+
+INTERVALO_INVALIDACAO = _intervalo_padrao()
+# Espera máxima entre leituras enquanto cache_versoes falha
+ESPERA_MAXIMA = float(os.getenv('CACHE_INVALIDACAO_ESPERA_MAXIMA', 30))
+
+SQL_VERSOES = (
+    'SELECT nome, versao, TIMESTAMPDIFF(MICROSECOND, atualizado_em, NOW(6)) '
+    'FROM cache_versoes'
+)
+
+
+@lru_cache(maxsize=8)
+def _sql_incremento(quantidade):
+    """INSERT ... ON DUPLICATE KEY para `quantidade` nomes (um statement preparado por quantidade)"""
+    valores = ', '.join(['(%s, 1)'] * quantidade)
+    return (
+        f'INSERT INTO cache_versoes (nome, versao) VALUES {valores} '
+        'ON DUPLICATE KEY UPDATE versao = versao + 1'
+    )
+
+
+class BarramentoInvalidacao:
+    def __init__(self, intervalo=INTERVALO_INVALIDACAO, limite_falhas=None):
+        self.intervalo = intervalo
+        self.limite_falhas = limite_falhas if limite_falhas is not None else 3 * intervalo
+        self._inscritos = {}
+        self._versoes = None
+        # Nomes alterados neste processo, ainda não publicados em cache_versoes
+        self._pendentes = set()
+        # Espera até a próxima leitura; cresce enquanto a tabela falha
+        self.espera = intervalo
+        # Caches já limpos na falha atual (não repete a cada tentativa)
+        self._limpos_na_falha = False
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._thread = None
+        self.sincronizado_em = None
+
+    @property
+    def habilitado(self):
+        return self.intervalo > 0
+
+    def registrar(self, nome, funcao):
+        """Chama funcao() quando o cache `nome` for alterado em outro processo"""
+        self._inscritos.setdefault(nome, []).append(funcao)
+
+    def _limpar(self, nome):
+        for funcao in self._inscritos.get(nome, []):
+            try:
+                funcao()
+            except Exception as e:
+                print(f"Erro ao invalidar cache '{nome}': {e}")
+
+    def _invalidar_local(self, nome):
+        self._limpar(nome)
+        metricas.incrementar('cache_invalidacoes_total', cache=nome)
+
+    def notificar(self, *nomes):
+        """
+        Limpa os caches deste processo e marca os nomes para avisar os outros
+        na próxima rodada; chamar depois do commit da escrita
+        """
+        for nome in nomes:
+            self._limpar(nome)
+        if not self.habilitado or not nomes:
+            return
+        with self._lock:
+            self._pendentes.update(nomes)
+
+    def publicar_pendentes(self):
+        """Incrementa numa única instrução as versões alteradas desde a última rodada"""
+        with self._lock:
+            nomes, self._pendentes = tuple(sorted(self._pendentes)), set()
+        if not nomes:
+            return
+        conn = None
+        try:
+            conn = get_connection()
+            executar(conn, _sql_incremento(len(nomes)), nomes)
+            conn.commit()
+        except Exception as e:
+            # Tenta de novo na próxima rodada
+            print(f"Erro ao publicar invalidação de {nomes}: {e}")
+            metricas.incrementar('cache_invalidacao_falhas_total', operacao='notificar')
+            with self._lock:
+                self._pendentes.update(nomes)
+        finally:
+            if conn:
+                conn.close()
+
+    def sincronizar(self):
+        """Lê as versões e invalida os caches que mudaram desde a última leitura"""
+        conn = None
+        try:
+            conn = get_connection()
+            linhas = executar(conn, SQL_VERSOES).fetchall()
+        except Exception as e:
+            print(f"Erro ao ler versões de cache: {e}")
+            metricas.incrementar('cache_invalidacao_falhas_total', operacao='sincronizar')
+            self._limpar_se_defasado()
+            return
+        finally:
+            if conn:
+                conn.close()
+
+        with self._lock:
+            anteriores = self._versoes
+            self._versoes = {nome: versao for nome, versao, _ in linhas}
+            self.sincronizado_em = time.monotonic()
+            self.espera = self.intervalo
+            self._limpos_na_falha = False
+
+        # Na primeira leitura só guarda as versões de referência
+        if anteriores is None:
+            return
+
+        for nome, versao, atraso_us in linhas:
+            if anteriores.get(nome) != versao:
+                self._invalidar_local(nome)
+                # Tempo entre a escrita (relógio do banco) e a limpeza local
+                if atraso_us is not None:
+                    metricas.definir('cache_invalidacao_atraso_segundos', max(atraso_us, 0) / 1e6, cache=nome)
+
+    def _limpar_se_defasado(self):
+        # Espaça as leituras enquanto a tabela falha
+        self.espera = min(max(self.espera, self.intervalo) * 2, max(ESPERA_MAXIMA, self.intervalo))
+        idade = self.idade_sincronizacao()
+        if self._limpos_na_falha or (idade is not None and idade <= self.limite_falhas):
+            return
+        # Limpa uma vez; depois disso a defasagem fica limitada pelo TTL de cada cache
+        print(f"Versões de cache inacessíveis há {'?' if idade is None else round(idade)}s: "
+              f"caches locais limpos, próxima leitura em {self.espera:.0f}s")
+        self._limpos_na_falha = True
+        for nome in self._inscritos:
+            self._invalidar_local(nome)
+
+    def idade_sincronizacao(self):
+        """Segundos desde a última leitura bem-sucedida das versões"""
+        if self.sincronizado_em is None:
+            return None
+        return time.monotonic() - self.sincronizado_em
+
+    def _executar(self):
+        while not self._parar.wait(self.espera):
+            self.publicar_pendentes()
+            self.sincronizar()
+
+    def iniciar(self):
+        if not self.habilitado or self._thread is not None:
+            return
+        self.sincronizar()
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._executar, name="invalidacao-cache", daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        if self._thread is not None:
+            self._parar.set()
+            self._thread.join(timeout=self.intervalo + 1)
+            self._thread = None
+            # Escritas da última rodada
+            self.publicar_pendentes()
+
+
+barramento_invalidacao = BarramentoInvalidacao()
+# Limite da defasagem atual dos caches deste processo
+metricas.definir_funcao('cache_invalidacao_idade_segundos', barramento_invalidacao.idade_sincronizacao)
+
+
+def notificar(*nomes):
+    barramento_invalidacao.notificar(*nomes)
@@ -0,0 +1,219 @@
+"""
+Limite adaptativo de concorrência na frente do banco (middleware ASGI)
+
+Cada classe de rota (escritas, leituras pontuais, relatórios) tem um limite
+de requisições simultâneas que se ajusta pela latência observada (AIMD):
+
+- latência perto da referência: o limite sobe devagar (+1 a cada ~limite
+  respostas);
+- latência acima de `tolerancia` x referência, ou erro 5xx: o limite cai
+  multiplicativamente (x `reducao`), no máximo uma vez por "RTT": só conta
+  a resposta de uma requisição que começou depois da última redução.
+
+A referência é por rota (método + caminho, com ids trocados por {id}), já
+que na mesma classe há rotas rápidas e lentas: é a média suavizada das
+latências normais da rota, e respostas lentas só a fazem subir aos poucos,
+então uma lentidão do MySQL derruba o limite antes de esgotar max_connections.
+Acima do limite as requisições esperam numa fila limitada por um tempo
+máximo (e pelo prazo da requisição); fila cheia ou espera estourada recebem
+503 + Retry-After na hora, sem tocar no banco.
+"""
+import asyncio
+import os
+import re
+import time
+from collections import deque
+
+from metricas import metricas
+import retry
+
+
+# Rotas com referência própria por classe; as demais dividem uma referência
+MAXIMO_ROTAS = 256
+
+# Segmentos numéricos do caminho (/api/produtos/12 -> /api/produtos/{id})
+_IDS = re.compile(r'/\d+(?=/|$)')
+
+
+class LimiteAdaptativo:
+    def __init__(self, nome, inicial=10, minimo=1, maximo=100, fila_maxima=50, espera_maxima=1.0,
+                 tolerancia=2.0, reducao=0.9, suavizacao=0.1):
+        self.nome = nome
+        self.limite = float(inicial)
+        self.minimo = minimo
+        self.maximo = maximo
+        self.fila_maxima = fila_maxima
+        self.espera_maxima = espera_maxima
+        self.tolerancia = tolerancia
+        self.reducao = reducao
+        self.suavizacao = suavizacao
+        self.em_uso = 0
+        self.referencias = {}
+        self._reduzido_em = float('-inf')
+        self._fila = deque()
+
+        metricas.definir_funcao('limitador_limite', lambda: self.limite, classe=nome)
+        metricas.definir_funcao('limitador_em_uso', lambda: self.em_uso, classe=nome)
+        metricas.definir_funcao('limitador_fila', lambda: len(self._fila), classe=nome)
+
+    def _rejeitar(self, motivo):
+        metricas.incrementar('limitador_rejeicoes_total', classe=self.nome, motivo=motivo)
+        return False
+
+    async def entrar(self):
+        """True se a requisição pode seguir; False se deve ser descartada"""
+        if self.em_uso < int(self.limite) and not self._fila:
+            self.em_uso += 1
+            return True
+
+        if len(self._fila) >= self.fila_maxima:
+            return self._rejeitar('fila_cheia')
+
+        espera = self.espera_maxima
+        restante = retry.tempo_restante()
+        if restante is not None:
+            espera = min(espera, restante)
+        if espera <= 0:
+            return self._rejeitar('prazo')
+
+        vez = asyncio.get_running_loop().create_future()
+        self._fila.append(vez)
+        try:
+            # A vaga já vem contada em em_uso por quem liberou (_chamar_proximos)
+            await asyncio.wait_for(asyncio.shield(vez), timeout=espera)
+            return True
+        except asyncio.TimeoutError:
+            if vez.done():
+                # Ganhou a vaga no mesmo instante do timeout
+                return True
+            self._fila.remove(vez)
+            vez.cancel()
+            return self._rejeitar('espera')
+
+    def sair(self, latencia, erro=False, rota=None):
+        self.em_uso -= 1
+        self._ajustar(latencia, erro, rota)
+        self._chamar_proximos()
+
+    def _referencia(self, rota, latencia):
+        """Referência da rota antes desta resposta, já atualizada com ela"""
+        if rota not in self.referencias and len(self.referencias) >= MAXIMO_ROTAS:
+            rota = None
+        referencia = self.referencias.get(rota)
+        if referencia is None:
+            self.referencias[rota] = latencia
+            return latencia
+
+        if latencia > self.tolerancia * referencia:
+            # Lentidão não vira referência: sobe só 1% por resposta
+            self.referencias[rota] = referencia * 1.01
+        else:
+            self.referencias[rota] = referencia + self.suavizacao * (latencia - referencia)
+        return referencia
+
+    def _ajustar(self, latencia, erro, rota):
+        referencia = self._referencia(rota, latencia)
+
+        if erro or latencia > self.tolerancia * referencia:
+            agora = time.monotonic()
+            # Respostas de requisições anteriores à última redução ainda
+            # refletem o limite antigo
+            if agora - latencia >= self._reduzido_em:
+                self.limite = max(self.minimo, self.limite * self.reducao)
+                self._reduzido_em = agora
+        else:
+            self.limite = min(self.maximo, self.limite + 1 / self.limite)
+
+    def _chamar_proximos(self):
+        while self._fila and self.em_uso < int(self.limite):
+            vez = self._fila.popleft()
+            if not vez.done():
+                self.em_uso += 1
+                vez.set_result(True)
+
+
+def _classificar(metodo, caminho):
+    """Classe de limite da rota ou None para rotas fora do limitador"""
+    if not caminho.startswith('/api/') or caminho.startswith('/api/eventos'):
+        # health, metrics, docs e o stream SSE (conexão longa, sem banco)
+        return None
+    if metodo in ('POST', 'PUT', 'PATCH', 'DELETE'):
+        return 'escrita'
+    if caminho.startswith('/api/relatorios') or caminho.startswith('/api/dashboard'):
+        return 'relatorio'
+    return 'leitura'
+
+
+def _rota(metodo, caminho):
+    """Chave da referência de latência: método e caminho sem os ids"""
+    return f"{metodo} {_IDS.sub('/{id}', caminho)}"
+
+
+def _config(classe, inicial, maximo):
+    prefixo = f'LIMITADOR_{classe.upper()}'
+    return LimiteAdaptativo(
+        classe,
+        inicial=int(os.getenv(f'{prefixo}_INICIAL', inicial)),
+        maximo=int(os.getenv(f'{prefixo}_MAXIMO', maximo)),
+        fila_maxima=int(os.getenv('LIMITADOR_FILA', 50)),
+        espera_maxima=float(os.getenv('LIMITADOR_ESPERA', 1.0)),
+    )
+
+
+def limites_padrao():
+    return {
+        'escrita': _config('escrita', 8, 32),
+        'leitura': _config('leitura', 16, 64),
+        'relatorio': _config('relatorio', 4, 16),
+    }
+
+
+class LimitadorConcorrencia:
+    """Middleware ASGI; limites=None usa limites_padrao()"""
+
+    def __init__(self, app, limites=None, habilitado=None, tentar_apos=1):
+        self.app = app
+        self.limites = limites if limites is not None else limites_padrao()
+        if habilitado is None:
+            habilitado = os.getenv('LIMITADOR_HABILITADO', '1') == '1'
+        self.habilitado = habilitado
+        self.tentar_apos = tentar_apos
+
+    async def __call__(self, scope, receive, send):
+        metodo, caminho = scope.get('method'), scope.get('path', '')
+        classe = _classificar(metodo, caminho) if scope['type'] == 'http' else None
+        limite = self.limites.get(classe) if self.habilitado else None
+        if limite is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not await limite.entrar():
+            await self._recusar(send, classe)
+            return
+
+        status = {'codigo': 500}
+
+        async def enviar(mensagem):
+            if mensagem['type'] == 'http.response.start':
+                status['codigo'] = mensagem['status']
+            await send(mensagem)
+
+        inicio = time.monotonic()
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            # 503 do próprio banco (retry esgotado) também conta como sobrecarga
+            limite.sair(time.monotonic() - inicio, erro=status['codigo'] >= 500, rota=_rota(metodo, caminho))
+
+    async def _recusar(self, send, classe):
+        corpo = f'{{"detail":"Servidor sobrecarregado ({classe}), tente novamente"}}'.encode()
+        await send({
+            'type': 'http.response.start',
+            'status': 503,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(corpo)).encode()),
+                (b'retry-after', str(self.tentar_apos).encode()),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': corpo})
@@ -0,0 +1,261 @@
+"""
+Manutenção da tabela vendas: particionamento mensal e arquivamento
+
+Uso (a partir de backend/):
+    python codigo/manutencao.py particionar [--meses-futuros 3]
+    python codigo/manutencao.py criar-particoes [--meses-futuros 3]
+    python codigo/manutencao.py arquivar [--retencao-meses 12]
+    python codigo/manutencao.py verificar-poda [--inicio 2024-03-01 --fim 2024-03-31]
+
+`particionar` converte a tabela uma única vez: o particionamento exige que
+data_venda faça parte da chave primária e não aceita chaves estrangeiras, por
+isso a FK de produto_id é removida (registrar_venda já valida o produto com
+SELECT ... FOR UPDATE). As partições são mensais, por RANGE sobre
+UNIX_TIMESTAMP(data_venda), com uma partição pmax no fim.
+
+`criar-particoes` deve rodar periodicamente (cron) para que as vendas dos
+próximos meses nunca caiam em pmax. `arquivar` copia as partições mais antigas
+que a retenção para vendas_arquivo (tabela comprimida) e remove a partição;
+as consultas com incluir_arquivo=True leem da view vendas_todas.
+
+Com as vendas em vários shards (shards.py), rode os comandos em cada um,
+com DB_HOST/DB_NAME apontando para o banco do shard.
+"""
+import argparse
+from datetime import date
+
+from database import get_connection
+from invalidacao import notificar
+from venda import SQL_VENDAS_PERIODO
+
+
+PREFIXO = 'p'
+PARTICAO_MAXIMA = 'pmax'
+
+SQL_PARTICOES = """
+    SELECT PARTITION_NAME
+    FROM information_schema.PARTITIONS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'vendas' AND PARTITION_NAME IS NOT NULL
+    ORDER BY PARTITION_ORDINAL_POSITION
+"""
+
+SQL_CHAVES_ESTRANGEIRAS = """
+    SELECT CONSTRAINT_NAME
+    FROM information_schema.REFERENTIAL_CONSTRAINTS
+    WHERE CONSTRAINT_SCHEMA = DATABASE() AND TABLE_NAME = 'vendas'
+"""
+
+COLUNAS = 'id, produto_id, quantidade, data_venda, valor_total, loja_id'
+
+
+# ==================== CÁLCULO DAS PARTIÇÕES ====================
+
+def _somar_meses(dia, meses):
+    indice = dia.year * 12 + dia.month - 1 + meses
+    return date(indice // 12, indice % 12 + 1, 1)
+
+
+def nome_particao(mes):
+    """Nome da partição do mês (p202403 guarda março de 2024)"""
+    return f"{PREFIXO}{mes.year:04d}{mes.month:02d}"
+
+
+def mes_da_particao(nome):
+    if nome == PARTICAO_MAXIMA or not nome.startswith(PREFIXO):
+        return None
+    return date(int(nome[1:5]), int(nome[5:7]), 1)
+
+
+def definicao_particao(mes):
+    limite = _somar_meses(mes, 1)
+    return (
+        f"PARTITION {nome_particao(mes)} "
+        f"VALUES LESS THAN (UNIX_TIMESTAMP('{limite.isoformat()} 00:00:00'))"
+    )
+
+
+def meses_entre(primeiro, ultimo):
+    """Primeiro dia de cada mês de `primeiro` até `ultimo` (inclusive)"""
+    mes = primeiro.replace(day=1)
+    meses = []
+    while mes <= ultimo:
+        meses.append(mes)
+        mes = _somar_meses(mes, 1)
+    return meses
+
+
+def particoes_faltantes(existentes, hoje, meses_futuros):
+    """Meses sem partição entre o último existente e hoje + meses_futuros"""
+    meses = [m for m in map(mes_da_particao, existentes) if m is not None]
+    ultimo_desejado = _somar_meses(hoje.replace(day=1), meses_futuros)
+    inicio = _somar_meses(max(meses), 1) if meses else hoje.replace(day=1)
+    return meses_entre(inicio, ultimo_desejado)
+
+
+def particoes_para_arquivar(existentes, hoje, retencao_meses):
+    """Partições cujo mês inteiro é anterior à janela de retenção"""
+    corte = _somar_meses(hoje.replace(day=1), -retencao_meses)
+    return [
+        nome for nome in existentes
+        if mes_da_particao(nome) is not None and mes_da_particao(nome) < corte
+    ]
+
+
+def sql_particionar(meses):
+    definicoes = [definicao_particao(m) for m in meses]
+    definicoes.append(f"PARTITION {PARTICAO_MAXIMA} VALUES LESS THAN MAXVALUE")
+    return (
+        "ALTER TABLE vendas PARTITION BY RANGE (UNIX_TIMESTAMP(data_venda)) (\n    "
+        + ",\n    ".join(definicoes)
+        + "\n)"
+    )
+
+
+def sql_reorganizar(meses):
+    """Divide pmax nas partições dos meses informados"""
+    definicoes = [definicao_particao(m) for m in meses]
+    definicoes.append(f"PARTITION {PARTICAO_MAXIMA} VALUES LESS THAN MAXVALUE")
+    return (
+        f"ALTER TABLE vendas REORGANIZE PARTITION {PARTICAO_MAXIMA} INTO (\n    "
+        + ",\n    ".join(definicoes)
+        + "\n)"
+    )
+
+
+# ==================== OPERAÇÕES NO BANCO ====================
+
+def listar_particoes(cursor):
+    cursor.execute(SQL_PARTICOES)
+    return [linha[0] for linha in cursor.fetchall()]
+
+
+def particionar(meses_futuros=3, hoje=None):
+    """Converte vendas em tabela particionada por mês (executar uma vez)"""
+    hoje = hoje or date.today()
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        if listar_particoes(cursor):
+            print("A tabela vendas já está particionada.")
+            return
+
+        for (nome,) in _buscar(cursor, SQL_CHAVES_ESTRANGEIRAS):
+            print(f"Removendo chave estrangeira {nome} (não suportada em tabelas particionadas)")
+            cursor.execute(f"ALTER TABLE vendas DROP FOREIGN KEY {nome}")
+
+        cursor.execute(
+            "ALTER TABLE vendas "
+            "MODIFY data_venda TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, "
+            "DROP PRIMARY KEY, ADD PRIMARY KEY (id, data_venda)"
+        )
+
+        cursor.execute("SELECT MIN(data_venda) FROM vendas")
+        primeira = cursor.fetchone()[0]
+        primeiro_mes = primeira.date() if primeira else hoje
+        meses = meses_entre(primeiro_mes, _somar_meses(hoje.replace(day=1), meses_futuros))
+
+        print(f"Criando {len(meses)} partições mensais ({nome_particao(meses[0])} a {nome_particao(meses[-1])})")
+        cursor.execute(sql_particionar(meses))
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def criar_particoes(meses_futuros=3, hoje=None):
+    """Garante partições até hoje + meses_futuros; retorna os nomes criados"""
+    hoje = hoje or date.today()
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        existentes = listar_particoes(cursor)
+        if not existentes:
+            raise RuntimeError("A tabela vendas não está particionada. Rode 'particionar' antes.")
+
+        meses = particoes_faltantes(existentes, hoje, meses_futuros)
+        if meses:
+            cursor.execute(sql_reorganizar(meses))
+        criadas = [nome_particao(m) for m in meses]
+        print(f"Partições criadas: {', '.join(criadas) or 'nenhuma'}")
+        return criadas
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def arquivar(retencao_meses=12, hoje=None):
+    """
+    Move as partições anteriores à retenção para vendas_arquivo. A cópia usa
+    INSERT IGNORE, então repetir após uma falha entre a cópia e o DROP não
+    duplica vendas.
+    """
+    hoje = hoje or date.today()
+    conn = get_connection()
+    cursor = conn.cursor()
+    arquivadas = []
+    try:
+        for nome in particoes_para_arquivar(listar_particoes(cursor), hoje, retencao_meses):
+            cursor.execute(
+                f"INSERT IGNORE INTO vendas_arquivo ({COLUNAS}) "
+                f"SELECT {COLUNAS} FROM vendas PARTITION ({nome})"
+            )
+            copiadas = cursor.rowcount
+            conn.commit()
+            cursor.execute(f"ALTER TABLE vendas DROP PARTITION {nome}")
+            print(f"Partição {nome} arquivada ({copiadas} vendas)")
+            arquivadas.append(nome)
+    finally:
+        cursor.close()
+        conn.close()
+
+    if arquivadas:
+        notificar('vendas')
+    return arquivadas
+
+
+def verificar_poda(data_inicio, data_fim):
+    """Mostra as partições lidas por VendaRepo.buscar_por_periodo (EXPLAIN)"""
+    conn = get_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("EXPLAIN " + SQL_VENDAS_PERIODO, (data_inicio, data_fim))
+        for linha in cursor.fetchall():
+            if linha.get('table') == 'v':
+                print(f"Partições lidas de {data_inicio} a {data_fim}: {linha.get('partitions')}")
+                return linha.get('partitions')
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def _buscar(cursor, sql):
+    cursor.execute(sql)
+    return cursor.fetchall()
+
+
+# =========================================================
+# PONTO DE EXECUÇÃO PRINCIPAL
+# =========================================================
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Manutenção da tabela vendas")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    for nome in ("particionar", "criar-particoes"):
+        sub = comandos.add_parser(nome)
+        sub.add_argument("--meses-futuros", type=int, default=3)
+
+    sub = comandos.add_parser("arquivar")
+    sub.add_argument("--retencao-meses", type=int, default=12)
+
+    sub = comandos.add_parser("verificar-poda")
+    sub.add_argument("--inicio", default=date.today().replace(day=1).isoformat())
+    sub.add_argument("--fim", default=date.today().isoformat())
+
+    args = parser.parse_args()
+    if args.comando == "particionar":
+        particionar(args.meses_futuros)
+    elif args.comando == "criar-particoes":
+        criar_particoes(args.meses_futuros)
+    elif args.comando == "arquivar":
+        arquivar(args.retencao_meses)
+    else:
+        verificar_poda(args.inicio, args.fim)
@@ -0,0 +1,78 @@
+"""
+Métricas do processo no formato texto do Prometheus (GET /metrics)
+
+Contadores e medidores simples, identificados por nome e rótulos:
+
+    metricas.incrementar("cache_invalidacoes_total", cache="catalogo")
+    metricas.definir("cache_invalidacao_atraso_segundos", 0.8, cache="catalogo")
+
+Medidores calculados na hora da coleta podem ser registrados com
+definir_funcao. Cada worker expõe só as suas métricas; a agregação entre
+processos fica com quem coleta.
+"""
+import threading
+
+
+class Metricas:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._valores = {}
+        self._tipos = {}
+        self._funcoes = {}
+
+    @staticmethod
+    def _chave(nome, rotulos):
+        return nome, tuple(sorted(rotulos.items()))
+
+    def incrementar(self, nome, valor=1, **rotulos):
+        chave = self._chave(nome, rotulos)
+        with self._lock:
+            self._tipos.setdefault(nome, "counter")
+            self._valores[chave] = self._valores.get(chave, 0) + valor
+
+    def definir(self, nome, valor, **rotulos):
+        with self._lock:
+            self._tipos.setdefault(nome, "gauge")
+            self._valores[self._chave(nome, rotulos)] = valor
+
+    def definir_funcao(self, nome, funcao, **rotulos):
+        """Medidor cujo valor é obtido chamando funcao() a cada coleta"""
+        with self._lock:
+            self._tipos.setdefault(nome, "gauge")
+            self._funcoes[self._chave(nome, rotulos)] = funcao
+
+    def valor(self, nome, **rotulos):
+        chave = self._chave(nome, rotulos)
+        if chave in self._funcoes:
+            return self._funcoes[chave]()
+        return self._valores.get(chave)
+
+    def texto(self):
+        with self._lock:
+            itens = dict(self._valores)
+            funcoes = dict(self._funcoes)
+            tipos = dict(self._tipos)
+
+        for chave, funcao in funcoes.items():
+            try:
+                valor = funcao()
+            except Exception:
+                continue
+            if valor is not None:
+                itens[chave] = valor
+
+        linhas = []
+        ultimo_nome = None
+        for (nome, rotulos), valor in sorted(itens.items()):
+            if nome != ultimo_nome:
+                linhas.append(f"# TYPE {nome} {tipos[nome]}")
+                ultimo_nome = nome
+            if rotulos:
+                texto_rotulos = ",".join(f'{k}="{v}"' for k, v in rotulos)
+                linhas.append(f"{nome}{{{texto_rotulos}}} {float(valor)}")
+            else:
+                linhas.append(f"{nome} {float(valor)}")
+        return "\n".join(linhas) + "\n"
+
+
+metricas = Metricas()
@@ -0,0 +1,149 @@
+"""
+Perfil sob demanda do worker em execução (GET /debug/profile)
+
+Três modos, todos com custo limitado e sem dependências externas:
+
+- wall: uma thread lê as pilhas de todas as threads (sys._current_frames)
+  a cada `intervalo` segundos, estejam rodando ou esperando (I/O, locks);
+- cpu: igual ao wall, mas só conta a amostra da thread que gastou CPU desde
+  a anterior (relógio de CPU por thread, Linux); onde não houver esse
+  relógio, cai para wall;
+- alloc: tracemalloc durante o período, agrupado pela pilha de alocação,
+  com o peso em bytes ainda alocados no fim.
+
+O resultado está no formato "collapsed stacks" (uma pilha por linha, da raiz
+para a folha, separada por ';' e seguida do peso), aberto direto no
+speedscope ou no flamegraph.pl. Só um perfil roda por vez no processo.
+"""
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+
+MODOS = ('cpu', 'wall', 'alloc')
+MAX_SEGUNDOS = float(os.getenv('PERFIL_MAX_SEGUNDOS', 30))
+INTERVALO_AMOSTRAGEM = 0.01
+PROFUNDIDADE_MAXIMA = 64
+QUADROS_ALOCACAO = 16
+
+_em_execucao = threading.Lock()
+
+
+class PerfilEmAndamentoError(Exception):
+    """Já existe um perfil rodando neste processo"""
+
+
+def _nome_quadro(codigo):
+    arquivo = os.path.basename(codigo.co_filename)
+    return f"{codigo.co_name} ({arquivo}:{codigo.co_firstlineno})"
+
+
+def _pilha(quadro):
+    nomes = []
+    while quadro is not None and len(nomes) < PROFUNDIDADE_MAXIMA:
+        nomes.append(_nome_quadro(quadro.f_code))
+        quadro = quadro.f_back
+    nomes.reverse()
+    return nomes
+
+
+def _relogio_cpu(ident):
+    """Função que lê o tempo de CPU da thread, ou None se não houver suporte"""
+    try:
+        relogio = time.pthread_getcpuclockid(ident)
+        time.clock_gettime(relogio)
+    except (AttributeError, OSError, OverflowError):
+        return None
+    return lambda: time.clock_gettime(relogio)
+
+
+def amostrar_pilhas(segundos, modo='wall', intervalo=INTERVALO_AMOSTRAGEM):
+    """Counter de pilhas colapsadas -> número de amostras"""
+    amostras = Counter()
+    proprio = threading.get_ident()
+    nomes = {t.ident: t.name for t in threading.enumerate()}
+    relogios = {}
+    cpu_anterior = {}
+    fim = time.monotonic() + segundos
+
+    while time.monotonic() < fim:
+        for ident, quadro in sys._current_frames().items():
+            if ident == proprio:
+                continue
+
+            if modo == 'cpu':
+                if ident not in relogios:
+                    relogios[ident] = _relogio_cpu(ident)
+                relogio = relogios[ident]
+                if relogio is not None:
+                    try:
+                        agora = relogio()
+                    except OSError:
+                        # A thread terminou entre a listagem e a leitura
+                        relogios[ident] = None
+                        continue
+                    anterior = cpu_anterior.get(ident)
+                    cpu_anterior[ident] = agora
+                    if anterior is None or agora <= anterior:
+                        continue
+
+            if ident not in nomes:
+                nomes.update({t.ident: t.name for t in threading.enumerate()})
+            pilha = [f"thread {nomes.get(ident, ident)}"] + _pilha(quadro)
+            amostras[';'.join(pilha)] += 1
+        time.sleep(intervalo)
+
+    return amostras
+
+
+def amostrar_alocacoes(segundos, quadros=QUADROS_ALOCACAO):
+    """Counter de pilhas de alocação -> bytes alocados durante o período"""
+    ja_ativo = tracemalloc.is_tracing()
+    if not ja_ativo:
+        tracemalloc.start(quadros)
+    try:
+        inicio = tracemalloc.take_snapshot()
+        time.sleep(segundos)
+        fim = tracemalloc.take_snapshot()
+    finally:
+        if not ja_ativo:
+            tracemalloc.stop()
+
+    filtros = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    diferencas = fim.filter_traces(filtros).compare_to(inicio.filter_traces(filtros), 'traceback')
+    alocacoes = Counter()
+    for estatistica in diferencas:
+        if estatistica.size_diff <= 0:
+            continue
+        pilha = [
+            f"{os.path.basename(q.filename)}:{q.lineno}"
+            for q in reversed(estatistica.traceback)
+        ]
+        alocacoes[';'.join(pilha)] += estatistica.size_diff
+    return alocacoes
+
+
+def colapsar(contagens):
+    return ''.join(f"{pilha} {peso}\n" for pilha, peso in contagens.most_common())
+
+
+def perfilar(segundos, modo='cpu'):
+    """
+    Executa o perfil (bloqueia por `segundos`) e devolve o texto colapsado.
+    Lança PerfilEmAndamentoError se outro perfil já estiver rodando.
+    """
+    if modo not in MODOS:
+        raise ValueError(f"Modo inválido: {modo}. Use {', '.join(MODOS)}")
+    segundos = min(max(segundos, 0.1), MAX_SEGUNDOS)
+
+    if not _em_execucao.acquire(blocking=False):
+        raise PerfilEmAndamentoError("Já existe um perfil em andamento neste worker")
+    try:
+        if modo == 'alloc':
+            return colapsar(amostrar_alocacoes(segundos))
+        return colapsar(amostrar_pilhas(segundos, modo))
+    finally:
+        _em_execucao.release()
@@ -0,0 +1,126 @@
+"""
+Cache de prepared statements por conexão
+
+Cada texto SQL usado pelos repositórios é preparado uma única vez por
+conexão (protocolo binário do MySQL) e o cursor preparado fica guardado num
+LRU limitado. Nas próximas execuções só os parâmetros são enviados, sem o
+servidor analisar e planejar a consulta de novo. Se a conexão for refeita
+(connection_id diferente), o cache é descartado, pois os statements do
+servidor morreram com a sessão anterior.
+
+Uso nos repositórios:
+
+    cursor = executar(conn, sql, params, dictionary=True)
+    rows = cursor.fetchall()
+
+Os cursores do cache não devem ser fechados por quem os usa.
+"""
+import os
+import weakref
+from collections import OrderedDict
+
+from disjuntor import Disjuntor, disjuntor_banco
+from rastreamento import span, span_atual, resumir_sql
+
+
+TAMANHO_CACHE = int(os.getenv('DB_STMT_CACHE_SIZE', 32))
+
+
+class CachePreparados:
+    def __init__(self, conexao, tamanho=TAMANHO_CACHE):
+        self.conexao = conexao
+        self.tamanho = tamanho
+        self.connection_id = getattr(conexao, 'connection_id', None)
+        self._cursores = OrderedDict()
+        self._ultimo = None
+        self.acertos = 0
+        self.falhas = 0
+
+    def _drenar_ultimo(self):
+        """Lê o que sobrou do resultado anterior (ex.: após um fetchone)"""
+        if self._ultimo is not None and getattr(self.conexao, '_unread_result', False) is True:
+            try:
+                self._ultimo.fetchall()
+            except Exception:
+                pass
+
+    def obter(self, sql, dictionary=False):
+        """Retorna (sql_em_cache, cursor) para o texto SQL, preparando na primeira vez"""
+        chave = (sql, dictionary)
+        self._drenar_ultimo()
+
+        item = self._cursores.get(chave)
+        if item is not None:
+            self._cursores.move_to_end(chave)
+            self.acertos += 1
+        else:
+            self.falhas += 1
+            cursor = self.conexao.cursor(prepared=True, dictionary=dictionary)
+            # O conector só reaproveita o statement se receber o mesmo
+            # objeto str, por isso o texto guardado é o usado na execução
+            item = (sql, cursor)
+            self._cursores[chave] = item
+            if len(self._cursores) > self.tamanho:
+                _, (_, antigo) = self._cursores.popitem(last=False)
+                try:
+                    antigo.close()
+                except Exception:
+                    pass
+
+        self._ultimo = item[1]
+        return item
+
+    def liberar(self):
+        """Deixa a conexão sem resultados pendentes antes de voltar ao pool"""
+        self._drenar_ultimo()
+        self._ultimo = None
+
+    def __len__(self):
+        return len(self._cursores)
+
+
+_caches = weakref.WeakKeyDictionary()
+
+
+def cache_da_conexao(conn):
+    """Cache da conexão física, recriado se a conexão tiver sido refeita"""
+    # Conexões do pool (database.ConexaoPool) expõem a conexão física
+    conexao = conn.conexao_fisica if hasattr(type(conn), 'conexao_fisica') else conn
+
+    cache = _caches.get(conexao)
+    if cache is None or cache.connection_id != getattr(conexao, 'connection_id', None):
+        cache = CachePreparados(conexao)
+        _caches[conexao] = cache
+    return cache
+
+
+def executar(conn, sql, params=None, dictionary=False):
+    """Executa o SQL com um cursor preparado do cache e retorna o cursor"""
+    sql_cache, cursor = cache_da_conexao(conn).obter(sql, dictionary)
+    # Erros de disponibilidade alimentam o disjuntor do banco da conexão (o
+    # do shard ou o principal); a duração do SQL não (consulta pesada ou
+    # espera por lock não é banco fora do ar)
+    disjuntor = getattr(conn, 'disjuntor', None)
+    if not isinstance(disjuntor, Disjuntor):
+        disjuntor = disjuntor_banco
+    with disjuntor.medir(contar_lenta=False):
+        if span_atual() is None:
+            _executar_cursor(cursor, sql_cache, params)
+        else:
+            # Inclui a espera por locks (SELECT ... FOR UPDATE) e o tempo do servidor
+            with span('sql', sql=resumir_sql(sql)):
+                _executar_cursor(cursor, sql_cache, params)
+    return cursor
+
+
+def _executar_cursor(cursor, sql, params):
+    if params is None:
+        cursor.execute(sql)
+    else:
+        cursor.execute(sql, params)
+
+
+def liberar(conn):
+    cache = _caches.get(conn)
+    if cache is not None:
+        cache.liberar()
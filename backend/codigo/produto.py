@@ -1,122 +1,313 @@
 # produto.py
 
-from database import get_connection
+from datetime import datetime
+from functools import lru_cache
 
+from database import get_connection, leitura_fixada_no_primario
+from eventos import publicar
+from invalidacao import notificar
+from preparados import executar
+from sessao import abrir, apos_commit, limitar_commit
+from retry import com_retentativa
+from rastreamento import rastrear_classe
+from disjuntor import indica_indisponibilidade, marcar_antigo
+from exceptions import BancoIndisponivelError
+from registros import Registro, ler_registros
+from feed import MARGEM_FEED, linhas_confirmadas
 
+
+@lru_cache(maxsize=None)
+def _sql_atualizacao(campos):
+    """
+    SQL do UPDATE parcial para uma combinação de campos. Sempre o mesmo
+    objeto str por combinação, para reaproveitar o prepared statement.
+    """
+    atribuicoes = ', '.join(f"{campo} = %s" for campo in campos)
+    return f"UPDATE produtos SET {atribuicoes} WHERE id = %s"
+
+
+# Linhas por transação nas atualizações em lote
+TAMANHO_LOTE = 500
+
+
+@lru_cache(maxsize=8)
+def _sql_ids_lote(quantidade):
+    """SELECT dos ids existentes do lote, travando as linhas até o commit"""
+    marcadores = ', '.join(['%s'] * quantidade)
+    return f"SELECT id FROM produtos WHERE id IN ({marcadores}) FOR UPDATE"
+
+
+@lru_cache(maxsize=8)
+def _sql_lote(quantidade):
+    """
+    UPDATE de `quantidade` produtos num único statement, juntando com uma
+    tabela derivada (id, nome, categoria, preco, estoque). Campos NULL mantêm o
+    valor atual. Lotes cheios sempre reaproveitam o mesmo prepared statement.
+    """
+    linhas = ['SELECT %s AS id, %s AS nome, %s AS categoria, %s AS preco, %s AS estoque']
+    linhas += ['SELECT %s, %s, %s, %s, %s'] * (quantidade - 1)
+    return (
+        f"UPDATE produtos p JOIN ({' UNION ALL '.join(linhas)}) t ON p.id = t.id SET "
+        "p.nome = COALESCE(t.nome, p.nome), "
+        "p.categoria = COALESCE(t.categoria, p.categoria), "
+        "p.preco = COALESCE(t.preco, p.preco), "
+        "p.estoque = COALESCE(t.estoque, p.estoque)"
+    )
+
+
+# Colunas que podem ser pedidas em fields= (campos.py)
+CAMPOS_PRODUTO = ('id', 'nome', 'preco', 'categoria', 'estoque', 'created_at', 'updated_at')
+
+
+@lru_cache(maxsize=None)
+def _sql_listagem(campos, por_categoria):
+    """SELECT da listagem do catálogo com todas as colunas ou só `campos`"""
+    colunas = ', '.join(campos) if campos else '*'
+    filtro = ' WHERE categoria = %s' if por_categoria else ''
+    return f"SELECT {colunas} FROM produtos{filtro} ORDER BY id"
+
+
+SQL_IDS_CATEGORIA = (
+    'SELECT id FROM produtos WHERE categoria = %s AND id > %s ORDER BY id LIMIT %s FOR UPDATE'
+)
+SQL_PRECO_FATOR = (
+    'UPDATE produtos SET preco = GREATEST(ROUND(preco * %s, 2), 0.01) '
+    'WHERE categoria = %s AND id BETWEEN %s AND %s'
+)
+
+# Feed incremental (GET /api/produtos/changes) pelo índice (updated_at, id);
+# o id desempata produtos alterados no mesmo microssegundo
+SQL_PRODUTOS_DESDE = """
+    SELECT *, updated_at >= NOW(6) - INTERVAL %s SECOND AS recente
+    FROM produtos
+    WHERE updated_at > %s OR (updated_at = %s AND id > %s)
+    ORDER BY updated_at, id
+    LIMIT %s
+"""
+
+# Marca d'água inicial do feed de produtos (antes de qualquer updated_at)
+INICIO_FEED = datetime(1970, 1, 2)
+
+
+@rastrear_classe
 class ProdutoRepo:
-    def __init__(self):
-        pass
+    def __init__(self, cache=None, reserva=None):
+        # cache.CacheTTL opcional para as listagens do catálogo
+        self.cache = cache
+        # cache.ReservaCatalogo opcional: última leitura boa, usada com o banco fora
+        self.reserva = reserva
 
-    def listar_todos(self):
-        conn = None
+    def _usar_cache(self, sessao):
+        # Numa sessão de escrita a leitura pode ver dados ainda não confirmados,
+        # que não podem ir para o cache compartilhado. Logo após uma escrita
+        # (leitura fixada no primário) o cache ainda pode ter a versão anterior.
+        return (self.cache is not None and (sessao is None or sessao.leitura)
+                and not leitura_fixada_no_primario())
+
+    def _ler_catalogo(self, chave, sessao, consultar):
+        """Leitura pelo cache, guardando o resultado na reserva"""
+        def carregar():
+            valor = consultar()
+            if self.reserva is not None and (sessao is None or sessao.leitura):
+                self.reserva.guardar(chave, valor)
+            return valor
+
+        if self._usar_cache(sessao):
+            return self.cache.obter(chave, carregar)
+        return carregar()
+
+    def _da_reserva(self, chave, sessao, erro):
+        """
+        Última leitura boa da chave quando o banco está indisponível, marcada
+        como antiga na resposta. Outros erros continuam como antes (None).
+        """
+        if not (isinstance(erro, BancoIndisponivelError) or indica_indisponibilidade(erro)):
+            return None
+        item = None
+        if self.reserva is not None and (sessao is None or sessao.leitura):
+            item = self.reserva.obter(chave)
+        if item is None:
+            # Sem cópia para servir: erro explícito em vez de catálogo vazio
+            if isinstance(erro, BancoIndisponivelError):
+                raise erro
+            raise BancoIndisponivelError(f"Banco de dados indisponível: {erro}") from erro
+
+        valor, idade = item
+        marcar_antigo(idade)
+        return valor
+
+    def _invalidar_cache(self):
+        if self.cache is not None:
+            self.cache.invalidar()
+        # Caches registrados no barramento (relatórios, painel) deste processo
+        # e dos demais workers/instâncias
+        notificar('catalogo')
+
+    def _consultar_todos(self, sessao=None, compacto=False, campos=None):
+        conn = abrir(sessao, get_connection, leitura=True)
         try:
-            conn = get_connection()
-            cursor = conn.cursor(dictionary=True) 
-            
-            sql = 'SELECT * FROM produtos ORDER BY id'
-            cursor.execute(sql)
+            sql = _sql_listagem(campos, False)
+            if compacto:
+                return ler_registros(executar(conn, sql))
+            cursor = executar(conn, sql, dictionary=True)
             
             rows = cursor.fetchall()
             return rows
+        finally:
+            conn.close()
+
+    def _produto_da_reserva(self, produto_id, sessao, erro):
+        """Produto da última listagem completa guardada (banco indisponível)"""
+        chave = 'todos'
+        if self.reserva is not None and self.reserva.obter(chave) is None:
+            chave = ('todos', 'compacto')
+        produtos = self._da_reserva(chave, sessao, erro)
+        for produto in produtos or ():
+            if produto['id'] == produto_id:
+                return produto.como_dict() if isinstance(produto, Registro) else dict(produto)
+        return None
+
+    def listar_todos(self, sessao=None, compacto=False, campos=None):
+        """
+        Todos os produtos; compacto=True devolve linhas compactas (registros.py)
+        e `campos` (tupla de CAMPOS_PRODUTO) limita as colunas lidas
+        """
+        chave = ('todos', 'compacto') if compacto else 'todos'
+        if campos:
+            chave = (chave, campos)
+        try:
+            return self._ler_catalogo(chave, sessao, lambda: self._consultar_todos(sessao, compacto, campos))
         
         except Exception as e:
             print(f"Erro ao listar produtos: {e}")
-            return [] # Retorna lista vazia em caso de erro
-            
-        finally:
-            if conn:
-                conn.close()
+            reserva = self._da_reserva(chave, sessao, e)
+            return [] if reserva is None else reserva # Retorna lista vazia em caso de erro
 
 
-    def buscar_por_id(self, produto_id):
+    def buscar_por_id(self, produto_id, sessao=None):
         conn = None
         try:
-            conn = get_connection()
-            cursor = conn.cursor(dictionary=True)
+            conn = abrir(sessao, get_connection)
             
             sql = 'SELECT * FROM produtos WHERE id = %s' 
-            cursor.execute(sql, (produto_id,))
+            cursor = executar(conn, sql, (produto_id,), dictionary=True)
 
             row = cursor.fetchone()
             return row
             
         except Exception as e:
             print(f"Erro ao buscar produto por ID: {e}")
-            return None
+            return self._produto_da_reserva(produto_id, sessao, e)
             
         finally:
             if conn:
                 conn.close()
 
 
-    def filtrar_por_categoria(self, categoria):
-        conn = None
+    def _consultar_categoria(self, categoria, sessao=None, campos=None):
+        conn = abrir(sessao, get_connection, leitura=True)
         try:
-            conn = get_connection()
-            cursor = conn.cursor(dictionary=True)
-            
-            sql = 'SELECT * FROM produtos WHERE categoria = %s ORDER BY id' 
-            cursor.execute(sql, (categoria,))
+            sql = _sql_listagem(campos, True)
+            cursor = executar(conn, sql, (categoria,), dictionary=True)
             
             rows = cursor.fetchall()
             return rows
+        finally:
+            conn.close()
+
+    def filtrar_por_categoria(self, categoria, sessao=None, campos=None):
+        chave = ('categoria', categoria, campos) if campos else ('categoria', categoria)
+        try:
+            return self._ler_catalogo(chave, sessao, lambda: self._consultar_categoria(categoria, sessao, campos))
             
         except Exception as e:
             print(f"Erro ao filtrar produtos por categoria: {e}")
-            return []
-            
+            reserva = self._da_reserva(chave, sessao, e)
+            return [] if reserva is None else reserva
+
+    def produtos_desde(self, desde_atualizacao=None, desde_id=0, limite=1000, sessao=None):
+        """
+        Produtos criados ou alterados depois da marca d'água (updated_at, id),
+        em ordem de alteração. Retorna (produtos, (updated_at, id), tem_mais);
+        a marca devolvida é a da próxima chamada. Exclusões não aparecem.
+        """
+        conn = None
+        try:
+            conn = abrir(sessao, get_connection, leitura=True)
+            desde_atualizacao = desde_atualizacao or INICIO_FEED
+            params = (MARGEM_FEED, desde_atualizacao, desde_atualizacao, desde_id, limite + 1)
+            cursor = executar(conn, SQL_PRODUTOS_DESDE, params, dictionary=True)
+            produtos, tem_mais = linhas_confirmadas(cursor.fetchall(), limite)
+
+            if produtos:
+                marca = (produtos[-1]['updated_at'], produtos[-1]['id'])
+            else:
+                marca = (desde_atualizacao, desde_id)
+            return produtos, marca, tem_mais
+
+        except Exception as e:
+            print(f"Erro ao buscar produtos alterados: {e}")
+            raise e
+
         finally:
             if conn:
                 conn.close()
 
-    def criar_produto(self, nome, preco, categoria, estoque):
-        conn = get_connection()
-        cursor = conn.cursor()
+    def criar_produto(self, nome, preco, categoria, estoque, sessao=None):
+        conn = abrir(sessao, get_connection)
+        limitar_commit(sessao, MARGEM_FEED)
         sql = "INSERT INTO produtos (nome, preco, categoria, estoque) VALUES (%s, %s, %s, %s)"
-        cursor.execute(sql, (nome, preco, categoria, estoque))
+        cursor = executar(conn, sql, (nome, preco, categoria, estoque))
         conn.commit()
         produto_id = cursor.lastrowid
-        cursor.close()
         conn.close()
+
+        def notificar_criacao():
+            self._invalidar_cache()
+            publicar('produto_criado', {
+                'id': produto_id, 'nome': nome, 'preco': preco,
+                'categoria': categoria, 'estoque': estoque
+            })
+        apos_commit(sessao, notificar_criacao)
         return produto_id
 
 
-    def atualizar_estoque(self, produto_id, novo_estoque):
-        conn = get_connection()
-        cursor = conn.cursor()
+    def atualizar_estoque(self, produto_id, novo_estoque, sessao=None):
+        conn = abrir(sessao, get_connection)
+        limitar_commit(sessao, MARGEM_FEED)
         sql = "UPDATE produtos SET estoque = %s WHERE id = %s"
-        cursor.execute(sql, (novo_estoque, produto_id))
+        executar(conn, sql, (novo_estoque, produto_id))
         conn.commit()
-        cursor.close()
         conn.close()
 
+        def notificar_estoque():
+            self._invalidar_cache()
+            publicar('estoque_alterado', {'produto_id': produto_id, 'estoque': novo_estoque})
+        apos_commit(sessao, notificar_estoque)
+
     
-    def atualizar_produto(self, produto_id, nome=None, categoria=None, preco=None, estoque=None):
+    def atualizar_produto(self, produto_id, nome=None, categoria=None, preco=None, estoque=None, sessao=None):
         """Atualiza os campos fornecidos de um produto"""
         conn = None
-        cursor = None
         try:
-            conn = get_connection()
-            cursor = conn.cursor()
-            
             # Prepara os campos para atualização
             campos = []
             valores = []
             
             if nome is not None:
-                campos.append("nome = %s")
+                campos.append("nome")
                 valores.append(nome)
             
             if categoria is not None:
-                campos.append("categoria = %s")
+                campos.append("categoria")
                 valores.append(categoria)
             
             if preco is not None:
-                campos.append("preco = %s")
+                campos.append("preco")
                 valores.append(preco)
             
             if estoque is not None:
-                campos.append("estoque = %s")
+                campos.append("estoque")
                 valores.append(estoque)
             
             # Se não houver campos para atualizar, retorna
@@ -126,10 +317,22 @@ class ProdutoRepo:
             # Adiciona o ID no final dos valores
             valores.append(produto_id)
             
-            # Monta e executa o SQL
-            sql = f"UPDATE produtos SET {', '.join(campos)} WHERE id = %s"
-            cursor.execute(sql, tuple(valores))
+            # SQL montado uma vez por combinação de campos
+            conn = abrir(sessao, get_connection)
+            limitar_commit(sessao, MARGEM_FEED)
+            executar(conn, _sql_atualizacao(tuple(campos)), tuple(valores))
             conn.commit()
+
+            # Publica apenas os campos alterados
+            alterados = {'id': produto_id}
+            for campo, valor in (('nome', nome), ('categoria', categoria), ('preco', preco), ('estoque', estoque)):
+                if valor is not None:
+                    alterados[campo] = valor
+
+            def notificar_atualizacao():
+                self._invalidar_cache()
+                publicar('produto_atualizado', alterados)
+            apos_commit(sessao, notificar_atualizacao)
             
         except Exception as e:
             print(f"Erro ao atualizar produto: {e}")
@@ -138,7 +341,112 @@ class ProdutoRepo:
             raise
             
         finally:
-            if cursor:
-                cursor.close()
             if conn:
-                conn.close()
\ No newline at end of file
+                conn.close()
+
+
+    def atualizar_em_lote(self, atualizacoes, tamanho_lote=TAMANHO_LOTE):
+        """
+        Aplica atualizações parciais [{'id': 1, 'preco': 9.9}, ...] em lotes
+        de `tamanho_lote`, cada um com um SELECT ... FOR UPDATE e um UPDATE
+        numa transação própria. Ids repetidos valem pela última ocorrência.
+        Retorna [{'id', 'status'}] com status atualizado, nao_encontrado ou erro.
+        Usa conexão própria, fora da sessão da requisição, para manter as
+        transações curtas.
+        """
+        por_id = {}
+        for item in atualizacoes:
+            por_id[item['id']] = item
+        ids = list(por_id)
+
+        status = {}
+        conn = get_connection()
+
+        def aplicar(lote):
+            cursor = executar(conn, _sql_ids_lote(len(lote)), tuple(lote))
+            existentes = [linha[0] for linha in cursor.fetchall()]
+
+            if existentes:
+                valores = []
+                for produto_id in existentes:
+                    item = por_id[produto_id]
+                    valores += [produto_id, item.get('nome'), item.get('categoria'),
+                                item.get('preco'), item.get('estoque')]
+                executar(conn, _sql_lote(len(existentes)), tuple(valores))
+            conn.commit()
+            return existentes
+
+        try:
+            for inicio in range(0, len(ids), tamanho_lote):
+                lote = ids[inicio:inicio + tamanho_lote]
+                try:
+                    existentes = com_retentativa(
+                        lambda: aplicar(lote), 'atualizar_em_lote', desfazer=conn.rollback, conexao=conn
+                    )
+
+                    encontrados = set(existentes)
+                    for produto_id in lote:
+                        status[produto_id] = {'status': 'atualizado' if produto_id in encontrados else 'nao_encontrado'}
+
+                except Exception as e:
+                    print(f"Erro ao atualizar lote de produtos: {e}")
+                    conn.rollback()
+                    for produto_id in lote:
+                        status[produto_id] = {'status': 'erro', 'erro': str(e)}
+        finally:
+            conn.close()
+
+        atualizados = [produto_id for produto_id in ids if status[produto_id]['status'] == 'atualizado']
+        self._notificar_lote(atualizados)
+        return [{'id': produto_id, **status[produto_id]} for produto_id in ids]
+
+
+    def atualizar_preco_por_categoria(self, categoria, fator, tamanho_lote=TAMANHO_LOTE):
+        """
+        Multiplica o preço de todos os produtos da categoria por `fator`,
+        percorrendo por faixas de id com uma transação por faixa (conexão
+        própria, como em atualizar_em_lote).
+        Retorna a lista de ids atualizados.
+        """
+        atualizados = []
+        ultimo_id = 0
+        conn = get_connection()
+
+        def aplicar_faixa(ultimo_id):
+            cursor = executar(conn, SQL_IDS_CATEGORIA, (categoria, ultimo_id, tamanho_lote))
+            ids = [linha[0] for linha in cursor.fetchall()]
+            if ids:
+                executar(conn, SQL_PRECO_FATOR, (fator, categoria, ids[0], ids[-1]))
+            conn.commit()
+            return ids
+
+        try:
+            while True:
+                ids = com_retentativa(
+                    lambda: aplicar_faixa(ultimo_id), 'atualizar_preco_por_categoria', desfazer=conn.rollback,
+                    conexao=conn
+                )
+                if not ids:
+                    break
+                atualizados += ids
+                ultimo_id = ids[-1]
+
+        except Exception as e:
+            print(f"Erro ao atualizar preços da categoria {categoria}: {e}")
+            conn.rollback()
+            raise
+
+        finally:
+            conn.close()
+            # Faixas já confirmadas antes de um erro também precisam ser avisadas
+            self._notificar_lote(atualizados)
+
+        return atualizados
+
+
+    def _notificar_lote(self, ids):
+        """Uma invalidação e um evento por lote, em vez de um por produto"""
+        if not ids:
+            return
+        self._invalidar_cache()
+        publicar('produtos_atualizados', {'ids': ids, 'total': len(ids)})
@@ -0,0 +1,290 @@
+"""
+Rastreamento leve das requisições (spans em memória, sem dependências)
+
+Cada requisição amostrada vira um traço com spans aninhados: a requisição,
+os métodos dos repositórios (rastrear_classe), cada SQL executado
+(preparados.executar), a obtenção de conexão e o commit. O span atual fica
+num ContextVar, então os spans abertos dentro do threadpool do FastAPI
+(run_in_threadpool copia o contexto) entram no traço certo.
+
+O cabeçalho W3C `traceparent` é respeitado: uma requisição que chega com o
+bit "sampled" é sempre rastreada e mantém o trace_id de quem chamou; as
+demais são amostradas com TRACE_AMOSTRAGEM. A resposta devolve o
+`traceparent` do span da requisição.
+
+Os traços terminados vão para um buffer em memória (GET /debug/traces
+mostra os mais lentos) e, com TRACE_ARQUIVO definido, para um arquivo JSONL
+(um traço por linha), gravado por uma thread própria a partir de uma fila
+limitada (fila cheia descarta o traço do arquivo, não a requisição). Fora de
+uma requisição amostrada, span() não faz nada.
+"""
+import functools
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+TAXA_AMOSTRAGEM = float(os.getenv('TRACE_AMOSTRAGEM', 0.1))
+ARQUIVO_TRACOS = os.getenv('TRACE_ARQUIVO', '')
+TRACOS_EM_MEMORIA = int(os.getenv('TRACE_MEMORIA', 500))
+# Traços esperando a gravação no arquivo
+FILA_EXPORTACAO = int(os.getenv('TRACE_FILA', 1000))
+
+# Rotas que não são rastreadas (stream SSE, coleta de métricas e a própria depuração)
+ROTAS_IGNORADAS = ('/api/eventos', '/metrics', '/health', '/debug')
+
+TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+_span_atual = ContextVar('span_atual', default=None)
+
+
+def _novo_id(bits):
+    return f'{random.getrandbits(bits):0{bits // 4}x}'
+
+
+class Traco:
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+        self.spans = []
+
+    def registro(self):
+        raiz = self.spans[0]
+        return {
+            'trace_id': self.trace_id,
+            'nome': raiz.nome,
+            'inicio': raiz.inicio,
+            'duracao_ms': raiz.duracao_ms,
+            'atributos': raiz.atributos,
+            'spans': [s.registro() for s in self.spans],
+        }
+
+
+class Span:
+    __slots__ = ('traco', 'nome', 'span_id', 'pai_id', 'inicio', '_inicio_mono', 'duracao_ms', 'atributos', 'erro')
+
+    def __init__(self, traco, nome, pai_id=None, atributos=None):
+        self.traco = traco
+        self.nome = nome
+        self.span_id = _novo_id(64)
+        self.pai_id = pai_id
+        self.inicio = time.time()
+        self._inicio_mono = time.perf_counter()
+        self.duracao_ms = None
+        self.atributos = atributos or {}
+        self.erro = None
+        traco.spans.append(self)
+
+    def terminar(self):
+        self.duracao_ms = round((time.perf_counter() - self._inicio_mono) * 1000, 3)
+
+    @property
+    def traceparent(self):
+        return f'00-{self.traco.trace_id}-{self.span_id}-01'
+
+    def registro(self):
+        registro = {
+            'nome': self.nome,
+            'span_id': self.span_id,
+            'pai_id': self.pai_id,
+            'inicio': self.inicio,
+            'duracao_ms': self.duracao_ms,
+        }
+        if self.atributos:
+            registro['atributos'] = self.atributos
+        if self.erro:
+            registro['erro'] = self.erro
+        return registro
+
+
+def span_atual():
+    return _span_atual.get()
+
+
+@contextmanager
+def span(nome, **atributos):
+    """Span filho do atual; fora de um traço amostrado não registra nada"""
+    pai = _span_atual.get()
+    if pai is None:
+        yield None
+        return
+
+    filho = Span(pai.traco, nome, pai.span_id, atributos)
+    token = _span_atual.set(filho)
+    try:
+        yield filho
+    except BaseException as e:
+        filho.erro = f'{type(e).__name__}: {e}'
+        raise
+    finally:
+        filho.terminar()
+        _span_atual.reset(token)
+
+
+def rastreado(nome=None):
+    """Decorador: executa a função dentro de um span (nome padrão: qualname)"""
+    def decorador(funcao):
+        nome_span = nome or funcao.__qualname__
+
+        @functools.wraps(funcao)
+        def embrulhada(*args, **kwargs):
+            if _span_atual.get() is None:
+                return funcao(*args, **kwargs)
+            with span(nome_span):
+                return funcao(*args, **kwargs)
+        return embrulhada
+    return decorador
+
+
+def rastrear_classe(cls):
+    """Rastreia todos os métodos públicos da classe (repositórios)"""
+    for nome, atributo in list(vars(cls).items()):
+        if not nome.startswith('_') and callable(atributo):
+            setattr(cls, nome, rastreado(f'{cls.__name__}.{nome}')(atributo))
+    return cls
+
+
+def resumir_sql(sql, tamanho=200):
+    return ' '.join(sql.split())[:tamanho]
+
+
+# ==================== COLETA DOS TRAÇOS ====================
+
+class ColetorTracos:
+    def __init__(self, capacidade=TRACOS_EM_MEMORIA, arquivo=ARQUIVO_TRACOS, fila_maxima=FILA_EXPORTACAO):
+        self._recentes = deque(maxlen=capacidade)
+        self.arquivo = arquivo
+        self._fila = queue.Queue(maxsize=fila_maxima)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.descartados = 0
+
+    def exportar(self, traco):
+        registro = traco.registro()
+        self._recentes.append(registro)
+        if not self.arquivo:
+            return
+        # Chamado no event loop: o arquivo fica com a thread de gravação
+        try:
+            self._fila.put_nowait(registro)
+        except queue.Full:
+            self.descartados += 1
+            return
+        self._iniciar()
+
+    def _iniciar(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._gravar, name="exportar-tracos", daemon=True)
+                self._thread.start()
+
+    def _gravar(self):
+        while True:
+            registros = [self._fila.get()]
+            # O que mais estiver na fila vai na mesma escrita
+            while True:
+                try:
+                    registros.append(self._fila.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                linhas = ''.join(json.dumps(r, default=str, ensure_ascii=False) + '\n' for r in registros)
+                with open(self.arquivo, 'a', encoding='utf-8') as arquivo:
+                    arquivo.write(linhas)
+            except OSError as e:
+                print(f"Erro ao exportar {len(registros)} traço(s): {e}")
+            finally:
+                for _ in registros:
+                    self._fila.task_done()
+
+    def esvaziar(self, timeout=5.0):
+        """Espera a gravação dos traços já enfileirados; False se o tempo acabar"""
+        with self._fila.all_tasks_done:
+            return self._fila.all_tasks_done.wait_for(lambda: not self._fila.unfinished_tasks, timeout)
+
+    def mais_lentos(self, limite=20):
+        recentes = list(self._recentes)
+        recentes.sort(key=lambda r: r['duracao_ms'] or 0, reverse=True)
+        return recentes[:limite]
+
+    def limpar(self):
+        self._recentes.clear()
+
+
+coletor_tracos = ColetorTracos()
+
+
+def arvore(registro):
+    """Traço com os spans aninhados em 'filhos' em vez da lista plana"""
+    nos = {s['span_id']: dict(s, filhos=[]) for s in registro['spans']}
+    raizes = []
+    for no in nos.values():
+        pai = nos.get(no['pai_id'])
+        (pai['filhos'] if pai is not None else raizes).append(no)
+    resultado = {k: v for k, v in registro.items() if k != 'spans'}
+    resultado['spans'] = raizes
+    return resultado
+
+
+# ==================== MIDDLEWARE ====================
+
+def ler_traceparent(valor):
+    """(trace_id, span_id do pai, amostrado) ou None se o cabeçalho for inválido"""
+    correspondencia = TRACEPARENT.match((valor or '').strip().lower())
+    if correspondencia is None:
+        return None
+    trace_id, pai_id, flags = correspondencia.groups()
+    if trace_id == '0' * 32 or pai_id == '0' * 16:
+        return None
+    return trace_id, pai_id, bool(int(flags, 16) & 1)
+
+
+class MiddlewareRastreamento:
+    """Middleware ASGI que abre o span da requisição e exporta o traço"""
+
+    def __init__(self, app, taxa=TAXA_AMOSTRAGEM, coletor=None):
+        self.app = app
+        self.taxa = taxa
+        self.coletor = coletor or coletor_tracos
+
+    async def __call__(self, scope, receive, send):
+        caminho = scope.get('path', '')
+        if scope['type'] != 'http' or caminho.startswith(ROTAS_IGNORADAS):
+            await self.app(scope, receive, send)
+            return
+
+        cabecalhos = dict(scope.get('headers') or [])
+        pai = ler_traceparent(cabecalhos.get(b'traceparent', b'').decode('latin-1'))
+        amostrado = pai[2] if pai is not None else random.random() < self.taxa
+        if not amostrado:
+            await self.app(scope, receive, send)
+            return
+
+        traco = Traco(pai[0] if pai is not None else _novo_id(128))
+        raiz = Span(traco, f"{scope.get('method')} {caminho}", pai[1] if pai is not None else None,
+                    {'metodo': scope.get('method'), 'rota': caminho})
+        token = _span_atual.set(raiz)
+
+        async def enviar(mensagem):
+            if mensagem['type'] == 'http.response.start':
+                raiz.atributos['status'] = mensagem['status']
+                mensagem = dict(mensagem, headers=list(mensagem.get('headers', [])) + [
+                    (b'traceparent', raiz.traceparent.encode())
+                ])
+            await send(mensagem)
+
+        try:
+            await self.app(scope, receive, enviar)
+        except BaseException as e:
+            raiz.erro = f'{type(e).__name__}: {e}'
+            raise
+        finally:
+            raiz.terminar()
+            _span_atual.reset(token)
+            self.coletor.exportar(traco)
@@ -0,0 +1,82 @@
+"""
+Linhas compactas para resultados grandes
+
+Com cursor(dictionary=True) cada linha vira um dict com as mesmas chaves
+repetidas (~180 bytes só de estrutura por linha, além dos valores). Aqui
+cada linha é uma tupla (56 bytes + 8 por coluna) de um tipo criado uma vez
+por conjunto de colunas, que ainda aceita o acesso por nome usado no resto
+do código:
+
+    venda['valor_total'], venda.valor_total, venda.get('data_venda')
+
+Datas continuam como datetime e só são formatadas na serialização
+(serializacao.dumps). As listas são lidas do cursor em lotes, então a cópia
+intermediária das tuplas cruas nunca passa de um lote. Colunas que se
+repetem muito (as do produto num JOIN com vendas) podem ser passadas em
+`repetidos`: linhas com o mesmo valor passam a apontar para o mesmo objeto,
+em vez de uma cópia por linha criada pelo conector.
+"""
+from collections import namedtuple
+from functools import lru_cache
+
+
+TAMANHO_LOTE = 1000
+
+
+class Registro(tuple):
+    """Base dos tipos de linha compacta (para isinstance)"""
+    __slots__ = ()
+
+
+@lru_cache(maxsize=64)
+def tipo_registro(colunas):
+    """Tipo de linha compacta para a tupla de nomes de colunas"""
+    indices = {nome: i for i, nome in enumerate(colunas)}
+    base = namedtuple('Linha', colunas)
+
+    class Linha(base, Registro):
+        __slots__ = ()
+
+        def __getitem__(self, chave):
+            if isinstance(chave, str):
+                return tuple.__getitem__(self, indices[chave])
+            return tuple.__getitem__(self, chave)
+
+        def get(self, chave, padrao=None):
+            indice = indices.get(chave)
+            return padrao if indice is None else tuple.__getitem__(self, indice)
+
+        def keys(self):
+            return colunas
+
+        def como_dict(self):
+            return dict(zip(colunas, self))
+
+    return Linha
+
+
+def ler_registros(cursor, lote=TAMANHO_LOTE, repetidos=()):
+    """Lê o resultado do cursor (não dictionary) como lista de linhas compactas"""
+    colunas = tuple(cursor.column_names)
+    montar = tipo_registro(colunas)._make
+    compartilhados = [(i, {}) for i, nome in enumerate(colunas) if nome in repetidos]
+
+    def compartilhar(linha):
+        linha = list(linha)
+        for i, valores in compartilhados:
+            linha[i] = valores.setdefault(linha[i], linha[i])
+        return montar(linha)
+
+    criar = compartilhar if compartilhados else montar
+
+    registros = []
+    while True:
+        linhas = cursor.fetchmany(lote)
+        if not linhas:
+            return registros
+        registros.extend(map(criar, linhas))
+
+
+def como_dicts(linhas):
+    """Converte linhas compactas em dicts (para quem precisa de dict de verdade)"""
+    return [l.como_dict() if isinstance(l, Registro) else l for l in linhas]
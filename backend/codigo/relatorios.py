@@ -0,0 +1,511 @@
+"""
+Motor de relatórios em memória baseado em NumPy
+
+Mantém um snapshot colunar da tabela `vendas` (produto_id, quantidade, valor
+em centavos e data como segundos desde 1970, todos int64) e uma cópia
+pequena da tabela `produtos`. O snapshot é atualizado de forma incremental
+buscando apenas as vendas com id maior que o último carregado (por shard,
+ver shards.py: os ids só crescem dentro de cada banco), e os
+relatórios de `database/queries.sql` são respondidos com group-bys
+vetorizados (np.bincount) em vez de consultas agregadas no MySQL.
+
+O id é dado no INSERT, não no commit: uma venda de id menor pode ficar
+visível depois de outra de id maior. Por isso cada atualização relê os
+últimos JANELA_RELEITURA ids e descarta os já carregados. Vendas removidas
+do banco (exclusão em cascata de um produto, partições movidas por
+manutencao.py arquivar) só saem do snapshot na recarga completa, feita a
+cada RELATORIOS_RECARGA_COMPLETA segundos.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from database import get_connection
+from preparados import executar
+from shards import roteador_shards
+
+
+SEGUNDOS_DIA = 86400
+
+# A data é lida como segundos "de parede" desde 1970, sem conversão de fuso,
+# para que os cortes por dia batam com o que está gravado no banco.
+SQL_VENDAS = """
+    SELECT id, produto_id, quantidade, valor_total,
+           TIMESTAMPDIFF(SECOND, '1970-01-01 00:00:00', data_venda) AS ts
+    FROM vendas
+    WHERE id > %s
+    ORDER BY id
+"""
+
+SQL_PRODUTOS = "SELECT id, nome, categoria, preco, estoque FROM produtos ORDER BY id"
+
+# Ids relidos antes do último carregado (commits fora da ordem dos ids)
+JANELA_RELEITURA = int(os.getenv('RELATORIOS_JANELA_RELEITURA', 1000))
+# Segundos entre recargas completas; 0 desliga
+INTERVALO_RECARGA_COMPLETA = float(os.getenv('RELATORIOS_RECARGA_COMPLETA', 3600))
+
+
+def _timestamp(dt):
+    """Converte um datetime (sem fuso) para segundos desde 1970"""
+    return int((dt - datetime(1970, 1, 1)).total_seconds())
+
+
+def _data(ts):
+    return datetime(1970, 1, 1) + timedelta(seconds=int(ts))
+
+
+class _Vendas:
+    """Colunas imutáveis de um snapshot de vendas"""
+    __slots__ = ("ids", "produto_ids", "quantidades", "centavos", "timestamps")
+
+    def __init__(self, ids, produto_ids, quantidades, centavos, timestamps):
+        self.ids = ids
+        self.produto_ids = produto_ids
+        self.quantidades = quantidades
+        self.centavos = centavos
+        self.timestamps = timestamps
+
+    @classmethod
+    def vazio(cls):
+        return cls(*(np.empty(0, dtype=np.int64) for _ in range(5)))
+
+    @classmethod
+    def de_linhas(cls, linhas):
+        if not linhas:
+            return cls.vazio()
+        ids, produto_ids, quantidades, valores, timestamps = zip(*linhas)
+        centavos = np.rint(np.array(valores, dtype=np.float64) * 100).astype(np.int64)
+        return cls(
+            np.array(ids, dtype=np.int64),
+            np.array([p if p is not None else -1 for p in produto_ids], dtype=np.int64),
+            np.array(quantidades, dtype=np.int64),
+            centavos,
+            np.array(timestamps, dtype=np.int64),
+        )
+
+    def concatenar(self, outro):
+        return _Vendas(*(np.concatenate((getattr(self, c), getattr(outro, c))) for c in self.__slots__))
+
+    def filtrar(self, mascara):
+        return _Vendas(*(getattr(self, c)[mascara] for c in self.__slots__))
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class _Produtos:
+    """Cópia colunar da tabela produtos com índice por id"""
+
+    def __init__(self, linhas):
+        self.ids = np.array([l[0] for l in linhas], dtype=np.int64)
+        self.nomes = [l[1] for l in linhas]
+        self.categorias_linha = [l[2] for l in linhas]
+        self.precos = np.array([float(l[3]) for l in linhas], dtype=np.float64)
+        self.estoques = np.array([l[4] or 0 for l in linhas], dtype=np.int64)
+
+        # Categorias codificadas como inteiros para o bincount
+        self.categorias, self.codigos_categoria = np.unique(
+            np.array([c or '' for c in self.categorias_linha], dtype=object), return_inverse=True
+        ) if linhas else (np.empty(0, dtype=object), np.empty(0, dtype=np.int64))
+
+        # Mapa id do produto -> posição no array (-1 quando não existe)
+        tamanho = int(self.ids.max()) + 1 if len(self.ids) else 1
+        self.posicao = np.full(tamanho, -1, dtype=np.int64)
+        self.posicao[self.ids] = np.arange(len(self.ids))
+
+    def posicoes(self, produto_ids):
+        """Posição de cada produto_id no array de produtos (-1 se removido)"""
+        dentro = (produto_ids >= 0) & (produto_ids < len(self.posicao))
+        resultado = np.full(len(produto_ids), -1, dtype=np.int64)
+        resultado[dentro] = self.posicao[produto_ids[dentro]]
+        return resultado
+
+    def __len__(self):
+        return len(self.ids)
+
+
+GRANULARIDADES = ("hora", "dia", "semana", "mes")
+
+
+def _periodos(horas, granularidade):
+    """
+    Converte horas desde 1970 no índice do período da granularidade.
+    Semanas começam na segunda-feira (1970-01-01 foi uma quinta).
+    """
+    if granularidade == "hora":
+        return horas
+    dias = horas // 24
+    if granularidade == "dia":
+        return dias
+    if granularidade == "semana":
+        return (dias + 3) // 7
+    return horas.astype("datetime64[h]").astype("datetime64[M]").astype(np.int64)
+
+
+def _rotulos(inicio, quantidade, granularidade):
+    """Rótulos legíveis para `quantidade` períodos a partir do índice `inicio`"""
+    indices = np.arange(inicio, inicio + quantidade)
+    if granularidade == "hora":
+        return [f"{str(h).replace('T', ' ')}:00" for h in indices.astype("datetime64[h]")]
+    if granularidade == "dia":
+        return [str(d) for d in indices.astype("datetime64[D]")]
+    if granularidade == "semana":
+        return [str(d) for d in (indices * 7 - 3).astype("datetime64[D]")]
+    return [str(m) for m in indices.astype("datetime64[M]")]
+
+
+def intervalo_periodos(inicio, fim, granularidade):
+    """Índice do primeiro período e quantidade de períodos entre as datas (inclusivas)"""
+    hora_inicio = np.array([_timestamp(datetime.combine(inicio, datetime.min.time())) // 3600])
+    hora_fim = np.array([_timestamp(datetime.combine(fim, datetime.min.time())) // 3600 + 23])
+    primeiro = int(_periodos(hora_inicio, granularidade)[0])
+    ultimo = int(_periodos(hora_fim, granularidade)[0])
+    return primeiro, ultimo - primeiro + 1
+
+
+def montar_serie(inicio, fim, granularidade, periodos, quantidades, centavos):
+    """
+    Agrega (periodo, quantidade, centavos) na série completa do intervalo,
+    preenchendo com zero os períodos sem venda.
+    """
+    primeiro, total = intervalo_periodos(inicio, fim, granularidade)
+    indices = np.asarray(periodos, dtype=np.int64) - primeiro
+    dentro = (indices >= 0) & (indices < total)
+
+    soma_quantidades = np.bincount(indices[dentro], weights=np.asarray(quantidades)[dentro], minlength=total)
+    soma_centavos = np.bincount(indices[dentro], weights=np.asarray(centavos)[dentro], minlength=total)
+
+    return [
+        {"periodo": rotulo, "quantidade": int(q), "receita": round(float(c) / 100, 2)}
+        for rotulo, q, c in zip(_rotulos(primeiro, total, granularidade), soma_quantidades, soma_centavos)
+    ]
+
+
+def serie_de_linhas(inicio, fim, granularidade, linhas):
+    """Monta a série a partir das tuplas (hora, quantidade, receita) de VendaRepo.serie_por_periodo"""
+    if not linhas:
+        return montar_serie(inicio, fim, granularidade, [], [], [])
+    horas, quantidades, receitas = zip(*linhas)
+    centavos = np.rint(np.array(receitas, dtype=np.float64) * 100)
+    return montar_serie(
+        inicio, fim, granularidade,
+        _periodos(np.array(horas, dtype=np.int64), granularidade),
+        np.array(quantidades, dtype=np.float64), centavos
+    )
+
+
+class _Baldes:
+    """
+    Vendas pré-agregadas por (hora, produto), ordenadas pela chave.
+    Uma série de qualquer tamanho de histórico lê apenas os baldes do
+    intervalo pedido (busca binária na chave) em vez de todas as vendas.
+    """
+    __slots__ = ("chaves", "quantidades", "centavos")
+
+    _BITS_PRODUTO = 32
+
+    def __init__(self, chaves, quantidades, centavos):
+        self.chaves = chaves
+        self.quantidades = quantidades
+        self.centavos = centavos
+
+    @classmethod
+    def vazio(cls):
+        return cls(*(np.empty(0, dtype=np.int64) for _ in range(3)))
+
+    @classmethod
+    def _agregar(cls, chaves, quantidades, centavos):
+        if len(chaves) == 0:
+            return cls.vazio()
+        unicas, inverso = np.unique(chaves, return_inverse=True)
+        return cls(
+            unicas,
+            np.bincount(inverso, weights=quantidades).astype(np.int64),
+            np.bincount(inverso, weights=centavos).astype(np.int64),
+        )
+
+    @classmethod
+    def de_vendas(cls, vendas):
+        horas = vendas.timestamps // 3600
+        chaves = (horas << cls._BITS_PRODUTO) | (vendas.produto_ids & 0xFFFFFFFF)
+        return cls._agregar(chaves, vendas.quantidades, vendas.centavos)
+
+    def mesclar(self, outro):
+        if len(outro.chaves) == 0:
+            return self
+        return _Baldes._agregar(
+            np.concatenate((self.chaves, outro.chaves)),
+            np.concatenate((self.quantidades, outro.quantidades)),
+            np.concatenate((self.centavos, outro.centavos)),
+        )
+
+    def intervalo(self, hora_inicio, hora_fim):
+        """Fatia dos baldes com hora_inicio <= hora <= hora_fim"""
+        esquerda = np.searchsorted(self.chaves, hora_inicio << self._BITS_PRODUTO, side="left")
+        direita = np.searchsorted(self.chaves, (hora_fim + 1) << self._BITS_PRODUTO, side="left")
+        chaves = self.chaves[esquerda:direita]
+        return (
+            chaves >> self._BITS_PRODUTO,
+            chaves & 0xFFFFFFFF,
+            self.quantidades[esquerda:direita],
+            self.centavos[esquerda:direita],
+        )
+
+
+class SnapshotVendas:
+    def __init__(self, intervalo_atualizacao=5.0, habilitado=True, recarga_completa=INTERVALO_RECARGA_COMPLETA,
+                 janela_releitura=JANELA_RELEITURA):
+        self.intervalo_atualizacao = intervalo_atualizacao
+        self.habilitado = habilitado
+        self.recarga_completa = recarga_completa
+        self.janela_releitura = janela_releitura
+        self._lock = threading.Lock()
+        # (vendas, produtos, baldes) trocados juntos numa única referência
+        self._estado = (_Vendas.vazio(), _Produtos([]), _Baldes.vazio())
+        # Último id carregado de cada shard
+        self.ultimos_ids = {}
+        self.atualizado_em = None
+        self.recarregado_em = None
+
+    @property
+    def ultimo_id(self):
+        return max(self.ultimos_ids.values(), default=0)
+
+    @staticmethod
+    def _ler_shard(shard, ultimo_id):
+        """Vendas novas do shard e, no principal, os produtos (mesma conexão)"""
+        conn = None
+        try:
+            conn = get_connection(leitura=True) if shard.principal else shard.conectar(leitura=True)
+
+            cursor = executar(conn, SQL_VENDAS, (ultimo_id,))
+            vendas = _Vendas.de_linhas(cursor.fetchall())
+
+            produtos = None
+            if shard.principal:
+                cursor = executar(conn, SQL_PRODUTOS)
+                produtos = _Produtos(cursor.fetchall())
+            return shard.nome, vendas, produtos
+        finally:
+            if conn:
+                conn.close()
+
+    def atualizar(self, completo=False):
+        """Busca as vendas novas (ou tudo, se completo=True) e recarrega os produtos"""
+        with self._lock:
+            return self._atualizar(completo)
+
+    def _atualizar(self, completo):
+        """Corpo de atualizar(); quem chama segura self._lock"""
+        completo = completo or self.recarregado_em is None
+        ultimos = {} if completo else self.ultimos_ids
+        partes = roteador_shards.espalhar(lambda shard: self._ler_shard(
+            shard, max(0, ultimos.get(shard.nome, 0) - self.janela_releitura) if ultimos else 0
+        ))
+
+        novas = _Vendas.vazio()
+        ultimos_ids = {}
+        for nome, vendas_shard, produtos_shard in partes:
+            novas = novas.concatenar(vendas_shard)
+            ultimo = int(vendas_shard.ids[-1]) if len(vendas_shard) else 0
+            ultimos_ids[nome] = max(ultimo, ultimos.get(nome, 0))
+            if produtos_shard is not None:
+                produtos = produtos_shard
+
+        vendas_atuais, _, baldes_atuais = self._estado
+        if not completo and len(novas) and len(vendas_atuais):
+            # A janela relida traz de volta vendas já carregadas
+            ids_recentes = vendas_atuais.ids[vendas_atuais.ids >= novas.ids.min()]
+            novas = novas.filtrar(~np.isin(novas.ids, ids_recentes))
+
+        if completo:
+            vendas, baldes = novas, _Baldes.de_vendas(novas)
+        else:
+            vendas = vendas_atuais.concatenar(novas)
+            baldes = baldes_atuais.mesclar(_Baldes.de_vendas(novas))
+
+        # Troca a referência de uma vez; leitores concorrentes usam o
+        # snapshot anterior até aqui
+        self._estado = (vendas, produtos, baldes)
+        self.ultimos_ids = ultimos_ids
+        self.atualizado_em = time.time()
+        if completo:
+            self.recarregado_em = self.atualizado_em
+        return len(novas)
+
+    def invalidar(self):
+        """Força a atualização no próximo acesso (escrita vista em outro processo)"""
+        self.atualizado_em = None
+
+    def _pendente(self):
+        """'completa', 'incremental' ou None, conforme a idade do snapshot"""
+        agora = time.time()
+        if self.recarregado_em is not None and 0 < self.recarga_completa <= agora - self.recarregado_em:
+            return 'completa'
+        if self.atualizado_em is None or agora - self.atualizado_em >= self.intervalo_atualizacao:
+            return 'incremental'
+        return None
+
+    def atualizar_se_necessario(self):
+        if self._pendente() is None:
+            return 0
+        with self._lock:
+            # Quem esperou pelo lock refaz a conta: a thread da frente pode ter
+            # acabado de atualizar (ou de fazer a recarga completa)
+            pendente = self._pendente()
+            if pendente is None:
+                return 0
+            return self._atualizar(completo=pendente == 'completa')
+
+    def _dados(self):
+        self.atualizar_se_necessario()
+        vendas, produtos, _ = self._estado
+        return vendas, produtos
+
+    # ==================== RELATÓRIOS ====================
+
+    def receita_por_categoria(self, dias=30, agora=None):
+        """Quantidade e receita por categoria nos últimos `dias` (queries.sql #3)"""
+        vendas, produtos = self._dados()
+        agora = agora or datetime.now()
+
+        filtro = vendas.timestamps >= _timestamp(agora - timedelta(days=dias))
+        posicoes = produtos.posicoes(vendas.produto_ids[filtro])
+        validas = posicoes >= 0
+        codigos = produtos.codigos_categoria[posicoes[validas]]
+
+        total_categorias = len(produtos.categorias)
+        quantidades = np.bincount(codigos, weights=vendas.quantidades[filtro][validas], minlength=total_categorias)
+        centavos = np.bincount(codigos, weights=vendas.centavos[filtro][validas], minlength=total_categorias)
+
+        ordem = np.argsort(-centavos, kind='stable')
+        return [
+            {
+                "categoria": produtos.categorias[i] or None,
+                "total_quantidade": int(quantidades[i]),
+                "receita_total": round(float(centavos[i]) / 100, 2),
+            }
+            for i in ordem if quantidades[i] > 0
+        ]
+
+    def top_produtos(self, limite=5):
+        """Produtos mais vendidos por quantidade (queries.sql #4)"""
+        vendas, produtos = self._dados()
+
+        posicoes = produtos.posicoes(vendas.produto_ids)
+        validas = posicoes >= 0
+        totais = np.bincount(posicoes[validas], weights=vendas.quantidades[validas], minlength=len(produtos))
+
+        ordem = np.argsort(-totais, kind='stable')[:limite]
+        return [
+            {"id": int(produtos.ids[i]), "nome": produtos.nomes[i], "total_vendido": int(totais[i])}
+            for i in ordem if totais[i] > 0
+        ]
+
+    def produtos_criticos(self, estoque_minimo=3):
+        """Produtos nunca vendidos ou com estoque abaixo do mínimo (queries.sql #5)"""
+        vendas, produtos = self._dados()
+
+        posicoes = produtos.posicoes(vendas.produto_ids)
+        validas = posicoes >= 0
+        vendidos = np.bincount(posicoes[validas], weights=vendas.quantidades[validas], minlength=len(produtos))
+
+        criticos = np.flatnonzero((vendidos == 0) | (produtos.estoques < estoque_minimo))
+        return [
+            {
+                "id": int(produtos.ids[i]),
+                "nome": produtos.nomes[i],
+                "categoria": produtos.categorias_linha[i],
+                "preco": float(produtos.precos[i]),
+                "estoque": int(produtos.estoques[i]),
+                "total_vendido": int(vendidos[i]),
+                "nunca_vendido": bool(vendidos[i] == 0),
+            }
+            for i in criticos
+        ]
+
+    def receita_diaria(self, dias=30, agora=None):
+        """Receita e quantidade por dia, com os dias sem venda preenchidos com zero"""
+        vendas, _ = self._dados()
+        agora = agora or datetime.now()
+
+        dia_final = _timestamp(agora) // SEGUNDOS_DIA
+        dia_inicial = dia_final - dias + 1
+
+        dias_venda = vendas.timestamps // SEGUNDOS_DIA
+        filtro = (dias_venda >= dia_inicial) & (dias_venda <= dia_final)
+        indices = dias_venda[filtro] - dia_inicial
+
+        centavos = np.bincount(indices, weights=vendas.centavos[filtro], minlength=dias)
+        quantidades = np.bincount(indices, weights=vendas.quantidades[filtro], minlength=dias)
+        return dia_inicial, centavos / 100, quantidades
+
+    def media_movel(self, janela=7, dias=30, agora=None):
+        """Média móvel da receita diária com janela de `janela` dias"""
+        # Carrega dias extras para que o primeiro ponto já tenha a janela completa
+        dia_inicial, receita, quantidades = self.receita_diaria(dias + janela - 1, agora)
+
+        pesos = np.ones(janela) / janela
+        medias = np.convolve(receita, pesos, mode='valid')
+
+        return [
+            {
+                "data": _data((dia_inicial + janela - 1 + i) * SEGUNDOS_DIA).strftime('%Y-%m-%d'),
+                "receita": round(float(receita[janela - 1 + i]), 2),
+                "media_movel": round(float(medias[i]), 2),
+            }
+            for i in range(len(medias))
+        ]
+
+    def percentis(self, percentis=(50, 90, 99), dias=None, agora=None):
+        """Percentis do valor e da quantidade por venda"""
+        vendas, _ = self._dados()
+
+        filtro = slice(None)
+        if dias:
+            agora = agora or datetime.now()
+            filtro = vendas.timestamps >= _timestamp(agora - timedelta(days=dias))
+
+        valores = vendas.centavos[filtro] / 100
+        quantidades = vendas.quantidades[filtro]
+        if len(valores) == 0:
+            return {"total_vendas": 0, "valor_total": {}, "quantidade": {}}
+
+        rotulos = [f"p{p:g}" for p in percentis]
+        return {
+            "total_vendas": int(len(valores)),
+            "valor_total": dict(zip(rotulos, np.round(np.percentile(valores, percentis), 2).tolist())),
+            "quantidade": dict(zip(rotulos, np.round(np.percentile(quantidades, percentis), 2).tolist())),
+        }
+
+    def serie(self, granularidade, inicio, fim, categoria=None):
+        """
+        Série de quantidade e receita por período entre as datas (inclusivas),
+        calculada a partir dos baldes pré-agregados por hora.
+        """
+        self.atualizar_se_necessario()
+        _, produtos, baldes = self._estado
+
+        hora_inicio = _timestamp(datetime.combine(inicio, datetime.min.time())) // 3600
+        hora_fim = _timestamp(datetime.combine(fim, datetime.min.time())) // 3600 + 23
+        horas, produto_ids, quantidades, centavos = baldes.intervalo(hora_inicio, hora_fim)
+
+        if categoria is not None:
+            posicoes = produtos.posicoes(produto_ids)
+            codigo = np.flatnonzero(produtos.categorias == categoria)
+            if len(codigo):
+                filtro = (posicoes >= 0) & (produtos.codigos_categoria[np.maximum(posicoes, 0)] == codigo[0])
+            else:
+                filtro = np.zeros(len(horas), dtype=bool)
+            horas, quantidades, centavos = horas[filtro], quantidades[filtro], centavos[filtro]
+
+        return montar_serie(inicio, fim, granularidade, _periodos(horas, granularidade), quantidades, centavos)
+
+
+snapshot_vendas = SnapshotVendas(
+    intervalo_atualizacao=float(os.getenv('RELATORIOS_INTERVALO_ATUALIZACAO', 5)),
+    habilitado=os.getenv('RELATORIOS_EM_MEMORIA', '1').lower() in ('1', 'true', 'sim'),
+)
@@ -0,0 +1,135 @@
+"""
+Novas tentativas de transações em erros transitórios do MySQL
+
+Deadlock (1213) e lock wait timeout (1205) não indicam erro de lógica: a
+transação foi escolhida como vítima e pode ser refeita do zero. Aqui a
+unidade de trabalho inteira é desfeita e repetida com backoff exponencial
+com jitter ("full jitter"), sem passar do prazo da requisição. Esgotadas as
+tentativas, TransacaoIndisponivelError vira 503 + Retry-After na API, em vez
+de um 500 genérico que faz o cliente repetir na hora.
+
+O prazo também vale para cada tentativa: antes dela, o
+innodb_lock_wait_timeout da conexão (a da sessão ou `conexao`) passa a ser o
+tempo que resta, em vez dos 50s padrão do servidor, e volta ao padrão no fim.
+
+    com_retentativa(lambda: repo.registrar_venda(1, 2, sessao=sessao),
+                    'registrar_venda', sessao=sessao)
+"""
+import math
+import os
+import random
+import time
+from contextvars import ContextVar
+
+from mysql.connector import Error
+
+from exceptions import TransacaoIndisponivelError
+from metricas import metricas
+from preparados import executar
+
+
+ERROS_TRANSITORIOS = {
+    1213: 'deadlock',
+    1205: 'lock_wait_timeout',
+}
+
+TENTATIVAS = int(os.getenv('DB_RETRY_TENTATIVAS', 4))
+ESPERA_BASE = float(os.getenv('DB_RETRY_BASE', 0.05))
+ESPERA_MAXIMA = float(os.getenv('DB_RETRY_TETO', 1.0))
+# Tempo total de uma requisição, usado quando nenhum prazo foi definido
+PRAZO_REQUISICAO = float(os.getenv('PRAZO_REQUISICAO', 5.0))
+
+SQL_ESPERA_LOCK = 'SET SESSION innodb_lock_wait_timeout = %s'
+SQL_ESPERA_LOCK_PADRAO = 'SET SESSION innodb_lock_wait_timeout = DEFAULT'
+
+# Instante (time.monotonic) até o qual a requisição atual pode esperar
+_prazo = ContextVar('prazo_requisicao', default=None)
+
+
+def definir_prazo(segundos=PRAZO_REQUISICAO):
+    _prazo.set(time.monotonic() + segundos)
+
+
+def tempo_restante():
+    prazo = _prazo.get()
+    if prazo is None:
+        return None
+    return prazo - time.monotonic()
+
+
+def classificar(erro):
+    """Nome do erro transitório ou None se a transação não deve ser repetida"""
+    if isinstance(erro, Error):
+        return ERROS_TRANSITORIOS.get(erro.errno)
+    return None
+
+
+def espera(tentativa, base=ESPERA_BASE, maxima=ESPERA_MAXIMA):
+    """Full jitter: aleatório entre 0 e base * 2^tentativa, limitado a maxima"""
+    return random.uniform(0, min(maxima, base * (2 ** tentativa)))
+
+
+def _limitar_espera_lock(conexao, segundos):
+    """Espera por lock da conexão em segundos inteiros (mínimo de 1, o do MySQL)"""
+    executar(conexao, SQL_ESPERA_LOCK, (max(1, math.ceil(segundos)),))
+
+
+def _restaurar_espera_lock(conexao):
+    # A conexão volta ao pool com a variável de sessão alterada
+    try:
+        executar(conexao, SQL_ESPERA_LOCK_PADRAO)
+    except Exception as e:
+        print(f"Erro ao restaurar innodb_lock_wait_timeout: {e}")
+
+
+def com_retentativa(funcao, operacao, sessao=None, desfazer=None, tentativas=TENTATIVAS, conexao=None):
+    """
+    Executa funcao() repetindo em deadlock/lock wait timeout. Antes de cada
+    nova tentativa a transação é desfeita: sessao.reiniciar() para a sessão
+    da requisição ou desfazer() para uma conexão própria (`conexao`, que tem
+    a espera por lock limitada ao prazo como a da sessão).
+    """
+    inicio = time.monotonic()
+    restante = tempo_restante()
+    prazo = inicio + (PRAZO_REQUISICAO if restante is None else restante)
+    if conexao is None and sessao is not None:
+        conexao = sessao.conexao()
+
+    try:
+        return _tentar(funcao, operacao, sessao, desfazer, tentativas, conexao, prazo)
+    finally:
+        if conexao is not None:
+            _restaurar_espera_lock(conexao)
+
+
+def _tentar(funcao, operacao, sessao, desfazer, tentativas, conexao, prazo):
+    tentativa = 0
+
+    while True:
+        try:
+            if conexao is not None:
+                _limitar_espera_lock(conexao, prazo - time.monotonic())
+            return funcao()
+        except Exception as e:
+            tipo = classificar(e)
+            if tipo is None:
+                raise
+
+            tentativa += 1
+            pausa = espera(tentativa - 1)
+            if tentativa >= tentativas or time.monotonic() + pausa > prazo:
+                metricas.incrementar('db_retentativas_esgotadas_total', operacao=operacao, erro=tipo)
+                print(f"Transação {operacao} desistiu após {tentativa} tentativa(s): {e}")
+                raise TransacaoIndisponivelError(
+                    f"Conflito no banco de dados ({tipo}), tente novamente",
+                    tentar_apos=max(1, round(ESPERA_MAXIMA))
+                ) from e
+
+            if sessao is not None:
+                sessao.reiniciar()
+            elif desfazer is not None:
+                desfazer()
+
+            metricas.incrementar('db_retentativas_total', operacao=operacao, erro=tipo)
+            metricas.incrementar('db_retentativas_espera_segundos_total', pausa, operacao=operacao)
+            time.sleep(pausa)
@@ -0,0 +1,80 @@
+"""
+Serialização rápida das linhas retornadas pelos repositórios
+
+O caminho padrão do FastAPI valida cada linha contra o response_model
+(ProdutoResponse/VendaResponse) e só depois codifica o JSON. Para listas
+grandes vindas do banco, que já têm o formato certo, esse trabalho é
+redundante. Este módulo converte as linhas direto para bytes JSON usando
+orjson (com fallback para o json da biblioteca padrão).
+
+O caminho rápido é opcional e ativado com SERIALIZACAO_RAPIDA=1. Nele os
+repositórios devolvem linhas compactas (registros.py), convertidas em
+objetos JSON aqui, uma de cada vez.
+"""
+import json
+import os
+from datetime import date, datetime
+from decimal import Decimal
+
+from fastapi.responses import Response
+
+from registros import Registro, como_dicts
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depende do ambiente
+    orjson = None
+
+
+def ativa():
+    """Indica se o caminho rápido está habilitado"""
+    return os.getenv('SERIALIZACAO_RAPIDA', '0').lower() in ('1', 'true', 'sim')
+
+
+def _converter(valor):
+    """Converte os tipos do MySQL que o encoder não conhece"""
+    if isinstance(valor, Registro):
+        return valor.como_dict()
+    if isinstance(valor, Decimal):
+        return float(valor)
+    if isinstance(valor, datetime):
+        # Mesmo formato usado por VendaRepo para data_venda
+        return valor.isoformat(sep=' ', timespec='seconds')
+    if isinstance(valor, date):
+        return valor.isoformat()
+    raise TypeError(f"Tipo não serializável: {type(valor).__name__}")
+
+
+if orjson is not None:
+    _OPCOES = orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps(conteudo):
+        """Serializa o conteúdo para bytes JSON"""
+        return orjson.dumps(conteudo, default=_converter, option=_OPCOES)
+else:
+    def dumps(conteudo):
+        """Serializa o conteúdo para bytes JSON"""
+        if isinstance(conteudo, list):
+            # O json da biblioteca padrão escreveria as tuplas como listas
+            conteudo = como_dicts(conteudo)
+        return json.dumps(
+            conteudo, default=_converter, ensure_ascii=False, separators=(",", ":")
+        ).encode("utf-8")
+
+
+class JSONRapidoResponse(Response):
+    """Resposta JSON que não passa pela validação do response_model"""
+    media_type = "application/json"
+
+    def render(self, content):
+        return dumps(content)
+
+
+def resposta(linhas):
+    """
+    Retorna as linhas como JSONRapidoResponse quando o caminho rápido está
+    ativo. Caso contrário devolve as linhas para o FastAPI validar normalmente.
+    """
+    if ativa():
+        return JSONRapidoResponse(linhas)
+    return linhas
@@ -0,0 +1,165 @@
+"""
+Unidade de trabalho por requisição: uma conexão e uma transação
+
+A API cria uma Sessao por requisição (dependência sessao_requisicao em
+api.py) e a repassa aos repositórios. A conexão só é aberta no primeiro uso
+e é compartilhada por todas as chamadas da requisição; os commits feitos
+pelos repositórios são adiados e a transação é confirmada uma única vez no
+fim (ou desfeita, se a requisição falhar). Invalidação de cache e eventos
+registrados com apos_commit só rodam depois da confirmação.
+
+limitar_commit marca o instante até o qual a transação precisa confirmar
+(os feeds de feed.py contam com isso); passado esse instante, confirmar()
+desfaz tudo e levanta TransacaoIndisponivelError.
+
+Sem sessão (sessao=None, caso dos scripts e testes) os repositórios abrem e
+confirmam a própria conexão, como antes.
+"""
+import time
+
+from exceptions import TransacaoIndisponivelError
+from metricas import metricas
+from rastreamento import span
+
+
+class ConexaoSessao:
+    """
+    Conexão entregue aos repositórios dentro da sessão: commit() e close()
+    não fazem nada (a sessão decide no fim); rollback() desfaz de verdade e
+    marca a sessão para não confirmar mais nada.
+    """
+
+    def __init__(self, conexao, sessao):
+        object.__setattr__(self, '_conexao', conexao)
+        object.__setattr__(self, '_sessao', sessao)
+
+    @property
+    def conexao_fisica(self):
+        # Mesmo cache de prepared statements da conexão do pool
+        conexao = self._conexao
+        if hasattr(type(conexao), 'conexao_fisica'):
+            return conexao.conexao_fisica
+        return conexao
+
+    def __getattr__(self, nome):
+        return getattr(self._conexao, nome)
+
+    def __setattr__(self, nome, valor):
+        setattr(self._conexao, nome, valor)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        self._sessao.desfeita = True
+        self._conexao.rollback()
+
+    def close(self):
+        pass
+
+
+class Sessao:
+    def __init__(self, obter_conexao, leitura=False):
+        # obter_conexao(leitura=...) -> conexão (database.get_connection)
+        self._obter_conexao = obter_conexao
+        self.leitura = leitura
+        self._conexao = None
+        self._apos_commit = []
+        self.desfeita = False
+        # Instante (time.monotonic) até o qual o commit precisa acontecer
+        self.confirmar_ate = None
+
+    def conexao(self, leitura=False):
+        if self._conexao is None:
+            conexao = self._obter_conexao(leitura=self.leitura)
+            conexao.autocommit = False
+            self._conexao = ConexaoSessao(conexao, self)
+        elif self.leitura and not leitura:
+            raise RuntimeError("Escrita numa sessão somente leitura")
+        return self._conexao
+
+    def apos_commit(self, funcao):
+        self._apos_commit.append(funcao)
+
+    def limitar_commit(self, segundos):
+        limite = time.monotonic() + segundos
+        if self.confirmar_ate is None or limite < self.confirmar_ate:
+            self.confirmar_ate = limite
+
+    def confirmar(self):
+        if self.confirmar_ate is not None and time.monotonic() > self.confirmar_ate:
+            atraso = time.monotonic() - self.confirmar_ate
+            self.desfazer()
+            self.desfeita = True
+            metricas.incrementar('sessao_commit_atrasado_total')
+            print(f"Sessão desfeita: commit {atraso:.2f}s depois do limite")
+            raise TransacaoIndisponivelError("Transação demorou demais para confirmar, tente novamente")
+        if self._conexao is not None and not self.desfeita:
+            with span('db.commit'):
+                self._conexao._conexao.commit()
+        self.confirmar_ate = None
+        funcoes, self._apos_commit = self._apos_commit, []
+        for funcao in funcoes:
+            try:
+                funcao()
+            except Exception as e:
+                print(f"Erro após o commit da sessão: {e}")
+
+    def desfazer(self):
+        self._apos_commit = []
+        self.confirmar_ate = None
+        if self._conexao is not None:
+            try:
+                self._conexao._conexao.rollback()
+            except Exception as e:
+                print(f"Erro ao desfazer a sessão: {e}")
+
+    def reiniciar(self):
+        """Desfaz tudo para repetir a unidade de trabalho (retry.com_retentativa)"""
+        self.desfazer()
+        self.desfeita = False
+
+    def fechar(self):
+        if self._conexao is not None:
+            conexao = self._conexao._conexao
+            self._conexao = None
+            conexao.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valor, traceback):
+        try:
+            if tipo is None and not self.desfeita:
+                self.confirmar()
+            else:
+                self.desfazer()
+        finally:
+            self.fechar()
+        return False
+
+
+def abrir(sessao, get_connection, leitura=False):
+    """Conexão da sessão da requisição ou, sem sessão, uma nova via get_connection"""
+    if sessao is not None:
+        return sessao.conexao(leitura)
+    if leitura:
+        return get_connection(leitura=True)
+    return get_connection()
+
+
+def limitar_commit(sessao, segundos):
+    """
+    Dentro de uma sessão, exige o commit em até `segundos`. Sem sessão o
+    repositório confirma logo em seguida e não há o que limitar.
+    """
+    if sessao is not None:
+        sessao.limitar_commit(segundos)
+
+
+def apos_commit(sessao, funcao):
+    """Executa funcao() agora ou, dentro de uma sessão, depois do commit dela"""
+    if sessao is not None:
+        sessao.apos_commit(funcao)
+    else:
+        funcao()
@@ -0,0 +1,180 @@
+"""
+Vendas fragmentadas (sharding) por loja
+
+Com muitas lojas, um único MySQL não absorve todas as escritas em vendas.
+Cada loja (vendas.loja_id) pertence a um shard: o banco principal
+(database.config_db), que guarda também o catálogo, ou um dos bancos de
+DB_SHARDS. O mapa loja -> shard vem de DB_SHARD_LOJAS (faixas de lojas);
+lojas fora do mapa ficam no principal. Mudar uma loja de shard exige copiar
+as vendas dela antes de alterar o mapa.
+
+  venda nova          gravada no shard da loja; o estoque é baixado no
+                      catálogo (VendaRepo.registrar_venda)
+  leitura por loja    só no shard da loja
+  leitura geral       espalhada por todos os shards em paralelo; as listas
+                      são intercaladas e os agregados parciais somados
+
+Cada shard recebe o schema.sql completo. A tabela produtos dos outros
+shards é uma cópia do catálogo (replicação do principal filtrada por
+tabela), usada só nos JOINs das consultas; escritas no catálogo vão sempre
+ao principal. Os ids das vendas precisam ser únicos entre os shards:
+configure auto_increment_increment/auto_increment_offset em cada servidor.
+
+Sem DB_SHARDS só existe o principal e tudo funciona como antes.
+"""
+import contextvars
+import os
+import threading
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+
+import mysql.connector
+
+from database import PoolConexoes, config_db, get_connection
+from disjuntor import Disjuntor, disjuntor_banco
+from rastreamento import span
+
+
+PRINCIPAL = 'principal'
+
+# Loja das vendas gravadas sem loja_id (e das vendas anteriores ao sharding)
+LOJA_PADRAO = int(os.getenv('LOJA_PADRAO', 1))
+
+# Threads das consultas espalhadas, compartilhadas por todas as requisições
+PARALELISMO = int(os.getenv('DB_SHARDS_PARALELISMO', 8))
+
+
+def _config_shards(texto):
+    """{nome: config} a partir de 'nome=host[:porta][/banco],...'"""
+    configs = {}
+    for item in filter(None, (s.strip() for s in texto.split(','))):
+        nome, separador, endereco = (parte.strip() for parte in item.partition('='))
+        if not separador or not nome or not endereco:
+            raise ValueError(f"Shard inválido: {item!r} (use nome=host[:porta][/banco])")
+        endereco, _, banco = endereco.partition('/')
+        host, _, porta = endereco.partition(':')
+        config = dict(config_db, host=host)
+        if porta:
+            config['port'] = int(porta)
+        if banco:
+            config['database'] = banco
+        configs[nome] = config
+    return configs
+
+
+def _faixas_lojas(texto):
+    """[(primeira, ultima, shard)] a partir de '1-100=sul,101=norte,...'"""
+    faixas = []
+    for item in filter(None, (s.strip() for s in texto.split(','))):
+        lojas, separador, shard = (parte.strip() for parte in item.partition('='))
+        if not separador or not lojas or not shard:
+            raise ValueError(f"Faixa de lojas inválida: {item!r} (use inicio-fim=shard)")
+        primeira, _, ultima = lojas.partition('-')
+        faixas.append((int(primeira), int(ultima or primeira), shard))
+    return faixas
+
+
+class Shard:
+    def __init__(self, nome, config=None):
+        # Sem config é o principal, acessado por database.get_connection
+        self.nome = nome
+        self.config = config
+        self.principal = config is None
+        if not self.principal:
+            # Um shard fora do ar não abre o disjuntor dos demais: a conexão
+            # e o SQL executado nela (preparados.executar) contam só aqui
+            self.disjuntor = Disjuntor(
+                f'shard-{nome}', disjuntor_banco.limite_falhas, disjuntor_banco.limite_lentas,
+                disjuntor_banco.latencia_lenta, disjuntor_banco.minimo_chamadas, disjuntor_banco.janela,
+                disjuntor_banco.tempo_aberto, disjuntor_banco.sondas, disjuntor_banco.habilitado
+            )
+            self.pool = PoolConexoes(config, disjuntor=self.disjuntor)
+
+    def conectar(self, leitura=False):
+        """Conexão com o banco do shard (no principal pode ir para uma réplica)"""
+        if self.principal:
+            return get_connection(leitura=leitura)
+
+        self.disjuntor.permitir()
+        with self.disjuntor.medir():
+            conexao = self.pool.retirar()
+            if conexao is not None:
+                return conexao
+            try:
+                return self.pool.embrulhar(mysql.connector.connect(**self.config))
+            except mysql.connector.Error as e:
+                print(f"Erro ao conectar no shard {self.nome}: {e}")
+                raise
+
+
+class RoteadorShards:
+    """Mapa loja -> shard e execução de uma consulta em todos os shards"""
+
+    def __init__(self, configs=None, faixas=(), paralelismo=PARALELISMO):
+        self.shards = {PRINCIPAL: Shard(PRINCIPAL)}
+        for nome, config in (configs or {}).items():
+            if nome == PRINCIPAL:
+                raise ValueError(f"'{PRINCIPAL}' é o nome reservado do banco principal")
+            self.shards[nome] = Shard(nome, config)
+
+        self.faixas = sorted(faixas)
+        for i, (primeira, ultima, nome) in enumerate(self.faixas):
+            if nome not in self.shards:
+                raise ValueError(f"Shard desconhecido no mapa de lojas: {nome}")
+            if ultima < primeira or (i and primeira <= self.faixas[i - 1][1]):
+                raise ValueError(f"Faixa de lojas inválida ou sobreposta: {primeira}-{ultima}")
+        self._inicios = [primeira for primeira, _, _ in self.faixas]
+
+        self.paralelismo = paralelismo
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def fragmentado(self):
+        return len(self.shards) > 1
+
+    def shard_da_loja(self, loja_id):
+        i = bisect_right(self._inicios, loja_id) - 1
+        if i >= 0 and loja_id <= self.faixas[i][1]:
+            return self.shards[self.faixas[i][2]]
+        return self.shards[PRINCIPAL]
+
+    def _obter_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.paralelismo, thread_name_prefix='shards')
+            return self._executor
+
+    def espalhar(self, funcao):
+        """
+        Executa funcao(shard) em todos os shards ao mesmo tempo e retorna os
+        resultados na ordem dos shards; a primeira falha é relançada. Com um
+        único shard roda na própria thread.
+        """
+        shards = list(self.shards.values())
+        if len(shards) == 1:
+            return [funcao(shards[0])]
+
+        def no_shard(shard):
+            with span('db.shard', shard=shard.nome):
+                return funcao(shard)
+
+        executor = self._obter_executor()
+        # Cópia do contexto: rastreamento e leitura fixada no primário
+        futuros = [executor.submit(contextvars.copy_context().run, no_shard, shard) for shard in shards]
+        return [futuro.result() for futuro in futuros]
+
+    def encerrar(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+        for shard in self.shards.values():
+            if not shard.principal:
+                shard.pool.limpar()
+
+
+roteador_shards = RoteadorShards(
+    _config_shards(os.getenv('DB_SHARDS', '')),
+    _faixas_lojas(os.getenv('DB_SHARD_LOJAS', '')),
+)
@@ -0,0 +1,356 @@
+"""
+Fila de tarefas em segundo plano para relatórios pesados e exportações
+
+POST /api/relatorios/jobs só registra a tarefa e devolve o id; o cálculo roda
+num pool de processos (TAREFAS_PROCESSOS, padrão 2) fora do worker do
+uvicorn, e o resultado vai para um arquivo em TAREFAS_DIR. O cliente consulta
+GET /api/relatorios/jobs/{id} até o estado "concluida" e baixa o resultado.
+
+Tipos de tarefa:
+
+    consulta        um relatório de database/queries.sql ({"numero": 1..5})
+    exportacao      todas as vendas, opcionalmente por período
+                    ({"data_inicio", "data_fim", "incluir_arquivo", "loja_id"})
+    resumo_periodo  série por período ({"data_inicio", "data_fim",
+                    "granularidade", "categoria", "incluir_arquivo", "loja_id"})
+
+O estado de cada tarefa é um arquivo JSON no mesmo diretório, gravado de
+forma atômica. Ao iniciar, o processo retoma as tarefas pendentes ou em
+execução cujo dono (pid) não existe mais, então um restart não perde a fila.
+Os processos filhos usam "spawn": não herdam as conexões abertas do pai.
+"""
+import csv
+import fcntl
+import json
+import multiprocessing
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date
+from functools import lru_cache
+from pathlib import Path
+
+from metricas import metricas
+
+
+DIRETORIO = Path(os.getenv('TAREFAS_DIR', Path(__file__).resolve().parent.parent / 'dados' / 'tarefas'))
+PROCESSOS = int(os.getenv('TAREFAS_PROCESSOS', 2))
+FILA_MAXIMA = int(os.getenv('TAREFAS_FILA', 100))
+RETENCAO_HORAS = float(os.getenv('TAREFAS_RETENCAO_HORAS', 24))
+
+CONSULTAS_SQL = Path(__file__).resolve().parent.parent / 'database' / 'queries.sql'
+FORMATOS = {'json': 'application/json', 'csv': 'text/csv'}
+GRANULARIDADES = ('hora', 'dia', 'semana', 'mes')
+ESTADOS_ABERTOS = ('pendente', 'executando')
+
+
+class FilaCheiaError(Exception):
+    """Tarefas demais aguardando; o cliente deve tentar mais tarde"""
+
+
+# ==================== EXECUÇÃO (PROCESSO FILHO) ====================
+
+@lru_cache(maxsize=1)
+def consultas_sql():
+    """Consultas numeradas de queries.sql ("-- 3. ..." até o próximo ';')"""
+    texto = CONSULTAS_SQL.read_text(encoding='utf-8')
+    consultas = {}
+    for numero, corpo in re.findall(r'^--\s*(\d+)\.[^\n]*\n(.*?);', texto, flags=re.M | re.S):
+        consultas[int(numero)] = corpo.strip()
+    return consultas
+
+
+def _data(valor):
+    return date.fromisoformat(valor) if isinstance(valor, str) else valor
+
+
+def _consulta(numero):
+    from database import get_connection
+
+    conn = get_connection(leitura=True)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(consultas_sql()[numero])
+        return list(cursor.column_names), cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def _exportacao(data_inicio=None, data_fim=None, incluir_arquivo=False, loja_id=None):
+    from venda import VendaRepo
+
+    return VendaRepo().listar_vendas_colunar(data_inicio, data_fim, incluir_arquivo, loja_id=loja_id)
+
+
+def _resumo_periodo(data_inicio, data_fim, granularidade='dia', categoria=None, incluir_arquivo=False,
+                    loja_id=None):
+    from relatorios import serie_de_linhas
+    from venda import VendaRepo
+
+    inicio, fim = _data(data_inicio), _data(data_fim)
+    linhas = VendaRepo().serie_por_periodo(granularidade, inicio, fim, categoria, incluir_arquivo,
+                                           loja_id=loja_id)
+    serie = serie_de_linhas(inicio, fim, granularidade, linhas)
+    return ['periodo', 'quantidade', 'receita'], [(p['periodo'], p['quantidade'], p['receita']) for p in serie]
+
+
+EXECUTORES = {
+    'consulta': _consulta,
+    'exportacao': _exportacao,
+    'resumo_periodo': _resumo_periodo,
+}
+
+
+def _gravar_resultado(caminho, formato, colunas, linhas):
+    temporario = caminho.with_suffix(caminho.suffix + '.tmp')
+    if formato == 'csv':
+        with open(temporario, 'w', newline='', encoding='utf-8') as arquivo:
+            escritor = csv.writer(arquivo)
+            escritor.writerow(colunas)
+            escritor.writerows(linhas)
+    else:
+        import serializacao
+        from registros import tipo_registro
+        montar = tipo_registro(tuple(colunas))._make
+        with open(temporario, 'wb') as arquivo:
+            arquivo.write(serializacao.dumps([montar(l) for l in linhas]))
+    os.replace(temporario, caminho)
+
+
+def _marcar_inicio(caminho_estado):
+    # Único momento em que o filho grava o estado: o pai só volta a gravar
+    # quando a tarefa termina
+    caminho = Path(caminho_estado)
+    tarefa = json.loads(caminho.read_text(encoding='utf-8'))
+    tarefa.update(estado='executando', iniciada_em=time.time(), processo=os.getpid())
+    temporario = caminho.with_suffix('.json.tmp')
+    temporario.write_text(json.dumps(tarefa, ensure_ascii=False), encoding='utf-8')
+    os.replace(temporario, caminho)
+
+
+def executar_tarefa(tipo, parametros, formato, caminho, caminho_estado=None):
+    """Roda no processo filho: calcula e grava o resultado; retorna o número de linhas"""
+    if caminho_estado is not None:
+        _marcar_inicio(caminho_estado)
+    colunas, linhas = EXECUTORES[tipo](**parametros)
+    _gravar_resultado(Path(caminho), formato, colunas, linhas)
+    return len(linhas)
+
+
+# ==================== VALIDAÇÃO ====================
+
+def _validar_periodo(parametros, obrigatorio):
+    inicio, fim = parametros.get('data_inicio'), parametros.get('data_fim')
+    if obrigatorio or inicio or fim:
+        if not (inicio and fim):
+            raise ValueError("Informe data_inicio e data_fim (YYYY-MM-DD)")
+        if date.fromisoformat(inicio) > date.fromisoformat(fim):
+            raise ValueError("A data inicial deve ser anterior à final")
+
+
+def validar(tipo, parametros, formato):
+    """Parâmetros normalizados da tarefa; ValueError se forem inválidos"""
+    if tipo not in EXECUTORES:
+        raise ValueError(f"Tipo de tarefa inválido: {tipo}. Use {', '.join(EXECUTORES)}")
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato inválido: {formato}. Use {', '.join(FORMATOS)}")
+
+    permitidos = {
+        'consulta': {'numero'},
+        'exportacao': {'data_inicio', 'data_fim', 'incluir_arquivo', 'loja_id'},
+        'resumo_periodo': {'data_inicio', 'data_fim', 'granularidade', 'categoria', 'incluir_arquivo', 'loja_id'},
+    }[tipo]
+    desconhecidos = set(parametros) - permitidos
+    if desconhecidos:
+        raise ValueError(f"Parâmetros não suportados para {tipo}: {', '.join(sorted(desconhecidos))}")
+
+    parametros = dict(parametros)
+    try:
+        if tipo == 'consulta':
+            if parametros.get('numero') not in consultas_sql():
+                raise ValueError(f"Consulta inexistente. Use um de {sorted(consultas_sql())}")
+        else:
+            _validar_periodo(parametros, obrigatorio=(tipo == 'resumo_periodo'))
+            parametros['incluir_arquivo'] = bool(parametros.get('incluir_arquivo', False))
+            loja_id = parametros.get('loja_id')
+            if loja_id is not None and (type(loja_id) is not int or loja_id < 1):
+                raise ValueError("loja_id deve ser um inteiro positivo")
+        if tipo == 'resumo_periodo':
+            parametros.setdefault('granularidade', 'dia')
+            if parametros['granularidade'] not in GRANULARIDADES:
+                raise ValueError(f"Granularidade inválida: {parametros['granularidade']}")
+    except TypeError:
+        raise ValueError("Parâmetros inválidos: datas no formato YYYY-MM-DD e numero inteiro")
+    return parametros
+
+
+# ==================== GERENCIADOR (PROCESSO DA API) ====================
+
+def _processo_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class GerenciadorTarefas:
+    def __init__(self, diretorio=DIRETORIO, processos=PROCESSOS, fila_maxima=FILA_MAXIMA,
+                 retencao_horas=RETENCAO_HORAS):
+        self.diretorio = Path(diretorio)
+        self.processos = processos
+        self.fila_maxima = fila_maxima
+        self.retencao_horas = retencao_horas
+        self._executor = None
+        self._lock = threading.Lock()
+        self._abertas = 0
+
+        metricas.definir_funcao('tarefas_abertas', lambda: self._abertas)
+
+    # ----- estado em disco -----
+
+    def _caminho_estado(self, tarefa_id):
+        return self.diretorio / f"{tarefa_id}.json"
+
+    def caminho_resultado(self, tarefa):
+        return self.diretorio / f"{tarefa['id']}.resultado.{tarefa['formato']}"
+
+    def _salvar(self, tarefa):
+        caminho = self._caminho_estado(tarefa['id'])
+        temporario = caminho.with_suffix('.json.tmp')
+        temporario.write_text(json.dumps(tarefa, ensure_ascii=False), encoding='utf-8')
+        os.replace(temporario, caminho)
+
+    def obter(self, tarefa_id):
+        """Estado da tarefa ou None (lido do disco: vale para qualquer worker)"""
+        if not re.fullmatch(r'[0-9a-f]{32}', tarefa_id or ''):
+            return None
+        try:
+            return json.loads(self._caminho_estado(tarefa_id).read_text(encoding='utf-8'))
+        except FileNotFoundError:
+            return None
+
+    def _listar(self):
+        for caminho in self.diretorio.glob('*.json'):
+            try:
+                yield json.loads(caminho.read_text(encoding='utf-8'))
+            except (OSError, ValueError):
+                continue
+
+    # ----- execução -----
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.processos, mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._executor
+
+    def _enfileirar(self, tarefa):
+        with self._lock:
+            self._abertas += 1
+        futuro = self._pool().submit(
+            executar_tarefa, tarefa['tipo'], tarefa['parametros'], tarefa['formato'],
+            str(self.caminho_resultado(tarefa)), str(self._caminho_estado(tarefa['id']))
+        )
+        futuro.add_done_callback(lambda f: self._concluir(tarefa['id'], f))
+
+    def _atualizar(self, tarefa_id, **campos):
+        tarefa = self.obter(tarefa_id)
+        if tarefa is None:
+            return None
+        tarefa.update(campos)
+        self._salvar(tarefa)
+        return tarefa
+
+    def _concluir(self, tarefa_id, futuro):
+        with self._lock:
+            self._abertas -= 1
+        if futuro.cancelled():
+            # Encerramento do processo: continua pendente e é retomada no próximo início
+            return
+        erro = futuro.exception()
+        if isinstance(erro, BrokenProcessPool):
+            # Um filho morreu (ex.: falta de memória): o pool não aceita mais
+            # tarefas e é recriado na próxima
+            with self._lock:
+                self._executor = None
+        if erro is not None:
+            print(f"Tarefa {tarefa_id} falhou: {erro}")
+            metricas.incrementar('tarefas_total', estado='erro')
+            self._atualizar(tarefa_id, estado='erro', erro=str(erro), concluida_em=time.time())
+        else:
+            metricas.incrementar('tarefas_total', estado='concluida')
+            self._atualizar(tarefa_id, estado='concluida', linhas=futuro.result(), concluida_em=time.time())
+
+    def criar(self, tipo, parametros=None, formato='json'):
+        """Valida, grava e enfileira a tarefa; retorna o estado inicial"""
+        parametros = validar(tipo, parametros or {}, formato)
+        if self._abertas >= self.fila_maxima:
+            raise FilaCheiaError(f"{self._abertas} tarefas na fila, tente novamente mais tarde")
+
+        tarefa = {
+            'id': uuid.uuid4().hex,
+            'tipo': tipo,
+            'parametros': parametros,
+            'formato': formato,
+            'estado': 'pendente',
+            'criada_em': time.time(),
+            'iniciada_em': None,
+            'concluida_em': None,
+            'linhas': None,
+            'erro': None,
+            'dono': os.getpid(),
+        }
+        self._salvar(tarefa)
+        self._enfileirar(tarefa)
+        return tarefa
+
+    # ----- ciclo de vida -----
+
+    def iniciar(self):
+        """Cria o diretório, apaga tarefas vencidas e retoma as órfãs"""
+        self.diretorio.mkdir(parents=True, exist_ok=True)
+        limite = time.time() - self.retencao_horas * 3600
+        retomadas = 0
+
+        # Com vários workers subindo juntos, só um retoma cada tarefa órfã
+        with open(self.diretorio / '.lock', 'w') as trava:
+            fcntl.flock(trava, fcntl.LOCK_EX)
+            for tarefa in list(self._listar()):
+                if tarefa['estado'] in ESTADOS_ABERTOS:
+                    dono = tarefa.get('dono')
+                    if dono and dono != os.getpid() and _processo_vivo(dono):
+                        continue
+                    tarefa.update(estado='pendente', dono=os.getpid(), iniciada_em=None)
+                    self._salvar(tarefa)
+                    self._enfileirar(tarefa)
+                    retomadas += 1
+                elif (tarefa.get('concluida_em') or 0) < limite:
+                    self._remover(tarefa)
+
+        if retomadas:
+            print(f"Tarefas retomadas após reinício: {retomadas}")
+        return retomadas
+
+    def _remover(self, tarefa):
+        for caminho in (self._caminho_estado(tarefa['id']), self.caminho_resultado(tarefa)):
+            try:
+                caminho.unlink()
+            except FileNotFoundError:
+                pass
+
+    def encerrar(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+gerenciador_tarefas = GerenciadorTarefas()
@@ -1,18 +1,56 @@
+import asyncio
+import contextvars
+import json
+import sqlite3
+import tempfile
+import time
 import unittest
-from unittest.mock import Mock, patch, MagicMock
-from datetime import datetime, timedelta
+from unittest.mock import Mock, patch, MagicMock, AsyncMock, call
+from datetime import date, datetime, timedelta
 from decimal import Decimal
 import sys
 import os
 
 # Adiciona o diretório pai ao path para importar os módulos
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# Os testes não publicam invalidações no banco (o padrão liga o barramento)
+os.environ.setdefault('CACHE_INVALIDACAO_INTERVALO', '0')
 
 # Importa os módulos do projeto
 try:
     from database import get_connection, config_db
+    import database
     from produto import ProdutoRepo
     from venda import VendaRepo
+    from eventos import BarramentoEventos
+    import preparados
+    from produto import _sql_atualizacao, _sql_lote, INICIO_FEED, CAMPOS_PRODUTO
+    import serializacao
+    import colunar
+    from relatorios import SnapshotVendas, _timestamp, serie_de_linhas
+    from cache import CacheTTL, CacheSWR
+    import inicializacao
+    from invalidacao import BarramentoInvalidacao
+    import invalidacao
+    from metricas import Metricas, metricas
+    import manutencao
+    from sessao import Sessao
+    import retry
+    import limitador
+    import rastreamento
+    import perfil
+    import registros
+    import tarefas
+    import feed
+    from campos import selecionar_campos
+    import dashboard
+    import disjuntor
+    import shards
+    from venda import _somar_series
+    from cache import ReservaCatalogo
+    from exceptions import BancoIndisponivelError, EstoqueInsuficienteError
+    from exceptions import TransacaoIndisponivelError
+    from mysql.connector import errors as mysql_errors
 except ImportError as e:
     print(f"Erro ao importar módulos: {e}")
     print("Certifique-se de que os arquivos database.py, produto.py e venda.py estão no mesmo diretório")
@@ -341,6 +379,198 @@ class TestDatabase(unittest.TestCase):
             get_connection()
 
 
+class TestRoteamentoLeitura(unittest.TestCase):
+    """Testes do roteamento de leituras para réplicas"""
+
+    def setUp(self):
+        self.roteador = database.RoteadorLeitura(
+            [dict(config_db, host='replica1'), dict(config_db, host='replica2')],
+            max_atraso=2, intervalo_checagem=0
+        )
+        patcher = patch('database.roteador_leitura', self.roteador)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_config_replicas(self):
+        """Testa a leitura de DB_READ_HOSTS"""
+        replicas = database._config_replicas('r1, r2:3307,')
+
+        self.assertEqual([r['host'] for r in replicas], ['r1', 'r2'])
+        self.assertEqual(replicas[1]['port'], 3307)
+        self.assertEqual(replicas[0]['database'], config_db['database'])
+
+    @patch('mysql.connector.connect')
+    def test_leitura_em_rodizio_nas_replicas(self, mock_connect):
+        """Testa que as leituras alternam entre as réplicas"""
+        get_connection(leitura=True)
+        get_connection(leitura=True)
+
+        hosts = [c.kwargs['host'] for c in mock_connect.call_args_list]
+        self.assertEqual(sorted(hosts), ['replica1', 'replica2'])
+
+    @patch('mysql.connector.connect')
+    def test_escrita_vai_para_o_primario(self, mock_connect):
+        """Testa que conexões de escrita nunca usam réplica"""
+        get_connection()
+
+        mock_connect.assert_called_once_with(**config_db)
+
+    @patch('mysql.connector.connect')
+    def test_leitura_apos_escrita_fixada_no_primario(self, mock_connect):
+        """Testa que, dentro da janela após escrita, a leitura vai para o primário"""
+        def executar():
+            database.fixar_primario()
+            get_connection(leitura=True)
+
+        contextvars.copy_context().run(executar)
+
+        mock_connect.assert_called_once_with(**config_db)
+
+    def test_fixar_primario_limita_valor_do_cliente(self):
+        """Testa que um instante vindo do cliente não fixa o primário além da janela"""
+        def fixar(valor):
+            return database.fixar_primario(valor)
+
+        ate = contextvars.copy_context().run(fixar, time.time() + 10 ** 9)
+        self.assertLessEqual(ate, time.time() + database.JANELA_LEITURA_PRIMARIO)
+        for valor in (float('inf'), float('nan')):
+            with self.assertRaises(ValueError):
+                contextvars.copy_context().run(fixar, valor)
+
+    @patch('mysql.connector.connect')
+    def test_replica_atrasada_sai_do_rodizio(self, mock_connect):
+        """Testa que a checagem tira réplicas com atraso acima do limite"""
+        mock_cursor = Mock()
+        mock_cursor.fetchone.side_effect = [
+            {'Seconds_Behind_Source': 0},
+            {'Seconds_Behind_Source': 30},
+        ]
+        mock_connect.return_value.cursor.return_value = mock_cursor
+
+        self.roteador.checar_replicas()
+        mock_connect.reset_mock()
+        get_connection(leitura=True)
+        get_connection(leitura=True)
+
+        hosts = [c.kwargs['host'] for c in mock_connect.call_args_list]
+        self.assertEqual(hosts, ['replica1', 'replica1'])
+
+    @patch('mysql.connector.connect')
+    def test_sem_replica_saudavel_usa_primario(self, mock_connect):
+        """Testa o fallback para o primário quando nenhuma réplica está saudável"""
+        for replica in self.roteador.replicas:
+            self.roteador.descartar(replica)
+
+        get_connection(leitura=True)
+
+        mock_connect.assert_called_once_with(**config_db)
+
+
+class TestPoolConexoes(unittest.TestCase):
+    """Testes do pool de conexões"""
+
+    def setUp(self):
+        self.pool = database.PoolConexoes(config_db, tamanho=1)
+
+    def test_close_devolve_ao_pool(self):
+        """Testa que close() devolve a conexão e ela é reaproveitada"""
+        fisica = Mock()
+        fisica.in_transaction = True
+
+        conn = self.pool.embrulhar(fisica)
+        conn.close()
+        reaproveitada = self.pool.retirar()
+
+        fisica.rollback.assert_called_once()
+        fisica.close.assert_not_called()
+        self.assertIs(reaproveitada.conexao_fisica, fisica)
+
+    def test_pool_cheio_fecha_conexao(self):
+        """Testa que conexões acima do tamanho do pool são fechadas"""
+        primeira, segunda = Mock(in_transaction=False), Mock(in_transaction=False)
+
+        self.pool.embrulhar(primeira).close()
+        self.pool.embrulhar(segunda).close()
+
+        self.assertEqual(len(self.pool), 1)
+        segunda.close.assert_called_once()
+
+    def test_atributos_repassados(self):
+        """Testa que atribuições chegam na conexão física"""
+        fisica = Mock()
+        conn = self.pool.embrulhar(fisica)
+
+        conn.autocommit = False
+
+        self.assertFalse(fisica.autocommit)
+
+    @patch('mysql.connector.connect')
+    def test_get_connection_reaproveita(self, mock_connect):
+        """Testa que get_connection usa a conexão ociosa sem reconectar"""
+        mock_connect.return_value.in_transaction = False
+        with patch('database.pool_primario', self.pool):
+            get_connection().close()
+            get_connection()
+
+        mock_connect.assert_called_once_with(**config_db)
+
+
+class TestPreparados(unittest.TestCase):
+    """Testes do cache de prepared statements"""
+
+    def setUp(self):
+        self.conn = Mock()
+        self.conn.connection_id = 10
+        self.conn.cursor.side_effect = lambda **kwargs: Mock()
+
+    def test_reaproveita_cursor_preparado(self):
+        """Testa que o mesmo SQL é preparado uma única vez por conexão"""
+        sql = 'SELECT * FROM produtos WHERE id = %s'
+
+        primeiro = preparados.executar(self.conn, sql, (1,), dictionary=True)
+        segundo = preparados.executar(self.conn, ''.join(['SELECT * FROM produtos ', 'WHERE id = %s']), (2,), dictionary=True)
+
+        self.assertIs(primeiro, segundo)
+        self.conn.cursor.assert_called_once_with(prepared=True, dictionary=True)
+        # Executa sempre com o objeto str guardado no cache
+        self.assertIs(segundo.execute.call_args[0][0], sql)
+
+    def test_lru_fecha_o_mais_antigo(self):
+        """Testa o limite do cache"""
+        cache = preparados.CachePreparados(self.conn, tamanho=2)
+
+        _, antigo = cache.obter('SELECT 1')
+        cache.obter('SELECT 2')
+        cache.obter('SELECT 3')
+
+        self.assertEqual(len(cache), 2)
+        antigo.close.assert_called_once()
+
+    def test_reconexao_descarta_cache(self):
+        """Testa que um novo connection_id recria o cache"""
+        preparados.executar(self.conn, 'SELECT 1')
+        self.conn.connection_id = 11
+        preparados.executar(self.conn, 'SELECT 1')
+
+        self.assertEqual(self.conn.cursor.call_count, 2)
+
+    def test_drena_resultado_pendente(self):
+        """Testa que o resultado não lido do cursor anterior é consumido"""
+        anterior = preparados.executar(self.conn, 'SELECT * FROM produtos WHERE id = %s', (1,))
+        self.conn._unread_result = True
+
+        preparados.executar(self.conn, 'SELECT 2')
+
+        anterior.fetchall.assert_called_once()
+
+    def test_sql_atualizacao_memorizado(self):
+        """Testa que o UPDATE parcial é o mesmo objeto para a mesma combinação"""
+        sql = _sql_atualizacao(('nome', 'preco'))
+
+        self.assertEqual(sql, 'UPDATE produtos SET nome = %s, preco = %s WHERE id = %s')
+        self.assertIs(sql, _sql_atualizacao(('nome', 'preco')))
+
+
 class TestValidacoes(unittest.TestCase):
     """Testes de validações e regras de negócio"""
     
@@ -373,6 +603,1897 @@ class TestValidacoes(unittest.TestCase):
         # Em uma venda real, isso deveria lançar exceção
 
 
+class TestEventos(unittest.IsolatedAsyncioTestCase):
+    """Testes do barramento de eventos usado pelo stream SSE"""
+
+    async def test_publicar_entrega_para_assinante(self):
+        """Testa que o evento publicado chega na fila do assinante"""
+        barramento = BarramentoEventos()
+        assinante, pendentes = barramento.assinar()
+
+        barramento.publicar('venda_criada', {'venda_id': 1, 'valor_total': Decimal('10.50')})
+        evento = await asyncio.wait_for(assinante.fila.get(), timeout=1)
+
+        self.assertEqual(pendentes, [])
+        self.assertEqual(evento.id, 1)
+        self.assertIn(b'event: venda_criada', evento.frame)
+        self.assertIn(b'"valor_total":10.5', evento.frame)
+
+    async def test_retomar_com_last_event_id(self):
+        """Testa que o assinante recebe os eventos perdidos a partir do histórico"""
+        barramento = BarramentoEventos()
+        for i in range(5):
+            barramento.publicar('estoque_alterado', {'produto_id': i, 'estoque': i})
+
+        _, pendentes = barramento.assinar(ultimo_id_recebido=3)
+
+        self.assertEqual([e.id for e in pendentes], [4, 5])
+
+    async def test_retomar_fora_do_historico(self):
+        """Testa que pede recarga quando o histórico já foi descartado"""
+        barramento = BarramentoEventos(tamanho_historico=2)
+        for i in range(5):
+            barramento.publicar('estoque_alterado', {'produto_id': i, 'estoque': i})
+
+        _, pendentes = barramento.assinar(ultimo_id_recebido=1)
+
+        self.assertIsNone(pendentes)
+
+    async def test_cliente_lento_desconectado(self):
+        """Testa que um cliente com buffer cheio é desconectado"""
+        barramento = BarramentoEventos(tamanho_buffer=2)
+        assinante, _ = barramento.assinar()
+
+        for i in range(3):
+            barramento.publicar('estoque_alterado', {'produto_id': i, 'estoque': i})
+        await asyncio.sleep(0)
+
+        self.assertTrue(assinante.desconectado)
+        self.assertIsNone(await assinante.fila.get())
+
+    async def test_limite_de_assinantes(self):
+        """Testa que novos clientes são recusados acima do limite"""
+        barramento = BarramentoEventos(max_assinantes=1)
+        barramento.assinar()
+
+        assinante, _ = barramento.assinar()
+
+        self.assertIsNone(assinante)
+
+    @patch('venda.publicar')
+    @patch('venda.get_connection')
+    async def test_registrar_venda_publica_eventos(self, mock_get_conn, mock_publicar):
+        """Testa que a venda publica os deltas de venda e estoque após o commit"""
+        mock_cursor = Mock()
+        mock_cursor.fetchone.return_value = {
+            'id': 1, 'nome': 'Notebook', 'preco': Decimal('2500.00'), 'estoque': 10
+        }
+        mock_cursor.lastrowid = 7
+
+        mock_conn = Mock()
+        mock_conn.cursor.return_value = mock_cursor
+        mock_get_conn.return_value = mock_conn
+
+        VendaRepo().registrar_venda(1, 2)
+
+        tipos = [c.args[0] for c in mock_publicar.call_args_list]
+        self.assertEqual(tipos, ['venda_criada', 'estoque_alterado'])
+        self.assertEqual(mock_publicar.call_args_list[1].args[1]['estoque'], 8)
+
+
+class TestSerializacao(unittest.TestCase):
+    """Testes do caminho rápido de serialização"""
+
+    def test_dumps_decimal_e_datetime(self):
+        """Testa conversão de Decimal e datetime vindos do MySQL"""
+        linhas = [{'id': 1, 'preco': Decimal('2500.50'),
+                   'created_at': datetime(2024, 3, 1, 10, 30, 15, 123)}]
+
+        resultado = json.loads(serializacao.dumps(linhas))
+
+        self.assertEqual(resultado[0]['preco'], 2500.5)
+        self.assertEqual(resultado[0]['created_at'], '2024-03-01 10:30:15')
+
+    @patch.dict(os.environ, {'SERIALIZACAO_RAPIDA': '0'})
+    def test_resposta_desativada_devolve_linhas(self):
+        """Testa que sem a flag as linhas seguem para o response_model"""
+        linhas = [{'id': 1}]
+
+        self.assertIs(serializacao.resposta(linhas), linhas)
+
+    @patch.dict(os.environ, {'SERIALIZACAO_RAPIDA': '1'})
+    def test_resposta_ativada(self):
+        """Testa que com a flag a resposta já sai em bytes JSON"""
+        resposta = serializacao.resposta([{'id': 1, 'preco': Decimal('9.90')}])
+
+        self.assertIsInstance(resposta, serializacao.JSONRapidoResponse)
+        self.assertEqual(json.loads(resposta.body), [{'id': 1, 'preco': 9.9}])
+
+
+class TestColunar(unittest.TestCase):
+    """Testes do formato colunar de vendas"""
+
+    def setUp(self):
+        self.colunas = ['venda_id', 'valor_total', 'data_venda']
+        self.linhas = [
+            (1, Decimal('79.80'), datetime(2024, 3, 1, 10, 0, 0)),
+            (2, Decimal('129.90'), datetime(2024, 3, 2, 11, 30, 0)),
+        ]
+
+    def test_para_colunas(self):
+        """Testa a transposição das tuplas em colunas"""
+        resultado = colunar.para_colunas(self.colunas, self.linhas)
+
+        self.assertEqual(resultado['total'], 2)
+        self.assertEqual(resultado['dados']['venda_id'], [1, 2])
+        self.assertEqual(resultado['dados']['valor_total'], [79.8, 129.9])
+        self.assertEqual(resultado['dados']['data_venda'][0], '2024-03-01 10:00:00')
+
+    def test_para_colunas_vazio(self):
+        """Testa resultado vazio mantendo as colunas"""
+        resultado = colunar.para_colunas(self.colunas, [])
+
+        self.assertEqual(resultado['dados'], {'venda_id': [], 'valor_total': [], 'data_venda': []})
+
+    def test_negociar(self):
+        """Testa a escolha do formato pelo Accept e pelo parâmetro formato"""
+        self.assertIsNone(colunar.negociar('application/json'))
+        self.assertEqual(colunar.negociar(None, 'colunar'), colunar.MEDIA_JSON_COLUNAR)
+        self.assertEqual(
+            colunar.negociar('text/html, application/vnd.apache.arrow.stream;q=0.9'),
+            colunar.MEDIA_ARROW
+        )
+
+    @unittest.skipUnless(colunar.arrow_disponivel(), "pyarrow não instalado")
+    def test_para_arrow(self):
+        """Testa que o stream Arrow pode ser lido de volta"""
+        import pyarrow.ipc
+
+        tabela = pyarrow.ipc.open_stream(colunar.para_arrow(self.colunas, self.linhas)).read_all()
+
+        self.assertEqual(tabela.column_names, self.colunas)
+        self.assertEqual(tabela.column('venda_id').to_pylist(), [1, 2])
+
+    @patch('venda.get_connection')
+    def test_listar_vendas_colunar_usa_tuplas(self, mock_get_conn):
+        """Testa que o repositório usa cursor de tuplas e filtra por período"""
+        mock_cursor = Mock()
+        mock_cursor.fetchall.return_value = self.linhas
+        mock_cursor.column_names = tuple(self.colunas)
+
+        mock_conn = Mock()
+        mock_conn.cursor.return_value = mock_cursor
+        mock_get_conn.return_value = mock_conn
+
+        colunas, linhas = VendaRepo().listar_vendas_colunar('2024-03-01', '2024-03-31')
+
+        mock_conn.cursor.assert_called_once_with(prepared=True, dictionary=False)
+        self.assertEqual(colunas, self.colunas)
+        self.assertIs(linhas, self.linhas)
+        self.assertEqual(mock_cursor.execute.call_args[0][1], ('2024-03-01', '2024-03-31'))
+        mock_conn.close.assert_called_once()
+
+
+class TestRelatorios(unittest.TestCase):
+    """Testes do motor de relatórios em memória (NumPy)"""
+
+    def setUp(self):
+        self.agora = datetime(2024, 3, 20)
+        self.vendas = [
+            (1, 1, 2, Decimal('79.80'), _timestamp(datetime(2024, 3, 18, 10, 0))),
+            (2, 2, 1, Decimal('129.90'), _timestamp(datetime(2024, 3, 19, 9, 30))),
+            (3, 1, 1, Decimal('39.90'), _timestamp(datetime(2024, 1, 1, 12, 0))),
+        ]
+        self.produtos = [
+            (1, 'Camiseta Básica', 'Roupas', Decimal('39.90'), 20),
+            (2, 'Fone Bluetooth', 'Eletrônicos', Decimal('129.90'), 2),
+            (3, 'Caneca Cerâmica', 'Casa', Decimal('29.90'), 50),
+        ]
+
+        self.mock_cursor = Mock()
+        self.mock_cursor.fetchall.side_effect = [self.vendas, self.produtos]
+        mock_conn = Mock()
+        mock_conn.cursor.return_value = self.mock_cursor
+
+        patcher = patch('relatorios.get_connection', return_value=mock_conn)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.snapshot = SnapshotVendas(intervalo_atualizacao=3600, janela_releitura=0)
+        self.snapshot.atualizar()
+
+    def test_atualizacao_incremental(self):
+        """Testa que a segunda carga busca apenas vendas com id maior"""
+        self.mock_cursor.fetchall.side_effect = [
+            [(4, 3, 5, Decimal('149.50'), _timestamp(datetime(2024, 3, 19)))],
+            self.produtos
+        ]
+
+        novas = self.snapshot.atualizar()
+
+        self.assertEqual(novas, 1)
+        self.assertEqual(self.snapshot.ultimo_id, 4)
+        self.assertEqual(self.mock_cursor.execute.call_args_list[-2][0][1], (3,))
+
+    def test_releitura_pega_commit_fora_de_ordem(self):
+        """Testa que a janela relida traz a venda de id menor confirmada depois, sem duplicar"""
+        snapshot = SnapshotVendas(intervalo_atualizacao=3600, janela_releitura=2)
+        venda = lambda id_: (id_, 1, 1, Decimal('10.00'), _timestamp(datetime(2024, 3, 19)))
+        self.mock_cursor.fetchall.side_effect = [[venda(1), venda(2), venda(4)], self.produtos,
+                                                 [venda(2), venda(3), venda(4), venda(5)], self.produtos]
+        snapshot.atualizar()
+
+        novas = snapshot.atualizar()
+
+        self.assertEqual(novas, 2)
+        self.assertEqual(self.mock_cursor.execute.call_args_list[-2][0][1], (2,))
+        self.assertEqual(snapshot.percentis((50,))['total_vendas'], 5)
+
+    def test_recarga_completa_periodica(self):
+        """Testa que, passado o intervalo, a atualização recarrega tudo (tira vendas arquivadas)"""
+        snapshot = SnapshotVendas(intervalo_atualizacao=3600, recarga_completa=60)
+        self.mock_cursor.fetchall.side_effect = [self.vendas, self.produtos, self.vendas[:1], self.produtos]
+        snapshot.atualizar()
+        snapshot.recarregado_em -= 61
+
+        snapshot.atualizar_se_necessario()
+
+        self.assertEqual(self.mock_cursor.execute.call_args_list[-2][0][1], (0,))
+        self.assertEqual(snapshot.percentis((50,))['total_vendas'], 1)
+
+    def test_espera_do_lock_nao_repete_recarga(self):
+        """Testa que quem esperou o lock não recarrega de novo o que outra thread já recarregou"""
+        import time as tempo
+        snapshot = self.snapshot
+        snapshot.recarga_completa = 60
+        snapshot.recarregado_em -= 61
+        chamadas = self.mock_cursor.execute.call_count
+
+        class LockDaOutraThread:
+            def __enter__(self):
+                # Enquanto esta thread esperava, a da frente fez a recarga
+                snapshot.recarregado_em = snapshot.atualizado_em = tempo.time()
+
+            def __exit__(self, *args):
+                return False
+
+        snapshot._lock = LockDaOutraThread()
+
+        self.assertEqual(snapshot.atualizar_se_necessario(), 0)
+        self.assertEqual(self.mock_cursor.execute.call_count, chamadas)
+
+    def test_receita_por_categoria(self):
+        """Testa receita por categoria apenas na janela de dias"""
+        resultado = self.snapshot.receita_por_categoria(30, agora=self.agora)
+
+        self.assertEqual(resultado, [
+            {'categoria': 'Eletrônicos', 'total_quantidade': 1, 'receita_total': 129.9},
+            {'categoria': 'Roupas', 'total_quantidade': 2, 'receita_total': 79.8},
+        ])
+
+    def test_top_produtos(self):
+        """Testa ranking por quantidade vendida"""
+        resultado = self.snapshot.top_produtos(5)
+
+        self.assertEqual([p['id'] for p in resultado], [1, 2])
+        self.assertEqual(resultado[0]['total_vendido'], 3)
+
+    def test_produtos_criticos(self):
+        """Testa produtos nunca vendidos ou com estoque crítico"""
+        resultado = self.snapshot.produtos_criticos(3)
+
+        self.assertEqual([p['id'] for p in resultado], [2, 3])
+        self.assertTrue(resultado[1]['nunca_vendido'])
+
+    def test_media_movel(self):
+        """Testa média móvel com dias sem venda preenchidos com zero"""
+        resultado = self.snapshot.media_movel(janela=2, dias=3, agora=self.agora)
+
+        self.assertEqual([d['data'] for d in resultado], ['2024-03-18', '2024-03-19', '2024-03-20'])
+        self.assertEqual([d['media_movel'] for d in resultado], [39.9, 104.85, 64.95])
+
+    def test_percentis(self):
+        """Testa percentis do valor por venda"""
+        resultado = self.snapshot.percentis((50,))
+
+        self.assertEqual(resultado['total_vendas'], 3)
+        self.assertEqual(resultado['valor_total'], {'p50': 79.8})
+
+    def test_serie_diaria_preenche_lacunas(self):
+        """Testa série por dia a partir dos baldes pré-agregados"""
+        resultado = self.snapshot.serie('dia', date(2024, 3, 17), date(2024, 3, 19))
+
+        self.assertEqual(resultado, [
+            {'periodo': '2024-03-17', 'quantidade': 0, 'receita': 0.0},
+            {'periodo': '2024-03-18', 'quantidade': 2, 'receita': 79.8},
+            {'periodo': '2024-03-19', 'quantidade': 1, 'receita': 129.9},
+        ])
+
+    def test_serie_mensal_por_categoria(self):
+        """Testa série mensal filtrada por categoria"""
+        resultado = self.snapshot.serie('mes', date(2024, 1, 1), date(2024, 3, 31), categoria='Roupas')
+
+        self.assertEqual([p['periodo'] for p in resultado], ['2024-01', '2024-02', '2024-03'])
+        self.assertEqual([p['quantidade'] for p in resultado], [1, 0, 2])
+
+    def test_serie_de_linhas_semanal(self):
+        """Testa a série montada a partir do resultado agregado no banco"""
+        hora_segunda = _timestamp(datetime(2024, 3, 4)) // 3600
+        linhas = [(hora_segunda, 3, Decimal('9.90'))]
+
+        resultado = serie_de_linhas(date(2024, 2, 28), date(2024, 3, 5), 'semana', linhas)
+
+        self.assertEqual(resultado, [
+            {'periodo': '2024-02-26', 'quantidade': 0, 'receita': 0.0},
+            {'periodo': '2024-03-04', 'quantidade': 3, 'receita': 9.9},
+        ])
+
+    @patch('venda.get_connection')
+    def test_serie_por_periodo_intervalo_sargable(self, mock_get_conn):
+        """Testa que a série no banco filtra data_venda por intervalo, sem função na coluna"""
+        mock_cursor = Mock()
+        mock_cursor.fetchall.return_value = []
+        mock_conn = Mock()
+        mock_conn.cursor.return_value = mock_cursor
+        mock_get_conn.return_value = mock_conn
+
+        VendaRepo().serie_por_periodo('dia', date(2024, 3, 1), date(2024, 3, 31))
+
+        sql, params = mock_cursor.execute.call_args[0]
+        self.assertIn('v.data_venda >= %s AND v.data_venda < %s', sql)
+        self.assertNotIn('JOIN', sql)
+        self.assertEqual(params, (date(2024, 3, 1), date(2024, 4, 1)))
+
+
+class TestInicializacao(unittest.IsolatedAsyncioTestCase):
+    """Testes do cache do catálogo e do aquecimento na inicialização"""
+
+    def test_cache_ttl_reaproveita_e_invalida(self):
+        """Testa que o valor é carregado uma vez até ser invalidado"""
+        cache = CacheTTL(ttl=60)
+        carregar = Mock(return_value=[1, 2])
+
+        cache.obter('todos', carregar)
+        cache.obter('todos', carregar)
+        self.assertEqual(carregar.call_count, 1)
+
+        cache.invalidar()
+        cache.obter('todos', carregar)
+        self.assertEqual(carregar.call_count, 2)
+
+    def test_cache_ttl_descarta_carga_anterior_a_invalidacao(self):
+        """Testa que uma carga concorrente com uma escrita não fica em cache"""
+        cache = CacheTTL(ttl=60)
+
+        def carregar_com_escrita():
+            cache.invalidar()
+            return ['antigo']
+
+        self.assertEqual(cache.obter('todos', carregar_com_escrita), ['antigo'])
+        self.assertEqual(len(cache), 0)
+
+    def test_cache_ttl_descarta_expiradas_e_excedentes(self):
+        """Testa que entradas expiradas saem do cache e o tamanho é limitado"""
+        cache = CacheTTL(ttl=60, maximo=2)
+        for categoria in ('a', 'b', 'c'):
+            cache.obter(('categoria', categoria), lambda: [categoria])
+
+        self.assertEqual(list(cache._dados), [('categoria', 'b'), ('categoria', 'c')])
+
+        expirado = CacheTTL(ttl=0)
+        expirado.obter('todos', lambda: ['a'])
+        expirado.obter(('categoria', 'b'), lambda: ['b'])
+
+        self.assertEqual(len(expirado), 0)
+
+    @patch('produto.get_connection')
+    def test_produto_repo_usa_cache(self, mock_get_conn):
+        """Testa que listar_todos só vai ao banco uma vez com o cache ligado"""
+        mock_cursor = Mock()
+        mock_cursor.fetchall.return_value = [{'id': 1, 'nome': 'Mouse'}]
+        mock_conn = Mock()
+        mock_conn.cursor.return_value = mock_cursor
+        mock_get_conn.return_value = mock_conn
+
+        repo = ProdutoRepo(cache=CacheTTL(ttl=60))
+        repo.listar_todos()
+        resultado = repo.listar_todos()
+
+        self.assertEqual(resultado, [{'id': 1, 'nome': 'Mouse'}])
+        self.assertEqual(mock_get_conn.call_count, 1)
+
+    @patch('produto.get_connection')
+    def test_leitura_fixada_no_primario_ignora_cache(self, mock_get_conn):
+        """Testa que, logo após uma escrita, listar_todos vai ao banco mesmo com cache"""
+        mock_cursor = Mock()
+        mock_cursor.fetchall.return_value = [{'id': 1, 'nome': 'Mouse'}]
+        mock_get_conn.return_value.cursor.return_value = mock_cursor
+        repo = ProdutoRepo(cache=CacheTTL(ttl=60))
+        repo.cache.obter('todos', lambda: ['antigo'])
+
+        def listar():
+            database.fixar_primario()
+            return repo.listar_todos()
+
+        resultado = contextvars.copy_context().run(listar)
+
+        self.assertEqual(resultado, [{'id': 1, 'nome': 'Mouse'}])
+        mock_get_conn.assert_called_once_with(leitura=True)
+        self.assertEqual(repo.listar_todos(), ['antigo'])
+
+    async def test_etapa_opcional_com_timeout(self):
+        """Testa que uma etapa opcional lenta não bloqueia a inicialização"""
+        relatorio = await inicializacao.executar_etapas([
+            inicializacao.Etapa("rapida", lambda: None, timeout=1),
+            inicializacao.Etapa("lenta", lambda: __import__('time').sleep(0.5), timeout=0.05),
+        ])
+
+        self.assertEqual(relatorio["rapida"]["status"], "ok")
+        self.assertEqual(relatorio["lenta"]["status"], "timeout")
+
+    async def test_etapa_obrigatoria_com_erro(self):
+        """Testa que a falha de uma etapa obrigatória interrompe a inicialização"""
+        opcional = Mock()
+
+        def falhar():
+            raise ConnectionError("sem banco")
+
+        with self.assertRaises(RuntimeError):
+            await inicializacao.executar_etapas([
+                inicializacao.Etapa("pool", falhar, obrigatoria=True),
+                inicializacao.Etapa("catalogo", opcional),
+            ])
+        opcional.assert_not_called()
+
+    @patch('inicializacao.executar')
+    @patch('inicializacao.get_connection')
+    def test_aquecer_pool_devolve_conexoes(self, mock_get_conn, mock_executar):
+        """Testa que o aquecimento abre e devolve as conexões"""
+        conexoes = [Mock(), Mock()]
+        mock_get_conn.side_effect = conexoes
+
+        inicializacao.aquecer_pool(2)
+
+        self.assertEqual(mock_executar.call_count, 2)
+        for conn in conexoes:
+            conn.close.assert_called_once()
+
+
+class TestInvalidacao(unittest.TestCase):
+    """Testes da invalidação de caches entre processos"""
+
+    def setUp(self):
+        self.barramento = BarramentoInvalidacao(intervalo=1.0, limite_falhas=0)
+        self.invalidar = Mock()
+        self.barramento.registrar('catalogo', self.invalidar)
+
+    def _versoes(self, mock_executar, linhas):
+        mock_executar.return_value.fetchall.return_value = linhas
+
+    @patch('invalidacao.get_connection')
+    @patch('invalidacao.executar')
+    def test_invalida_quando_versao_muda(self, mock_executar, mock_get_conn):
+        """Testa que só uma versão diferente da anterior limpa o cache"""
+        self._versoes(mock_executar, [('catalogo', 3, 1000)])
+        self.barramento.sincronizar()
+        self.barramento.sincronizar()
+        self.invalidar.assert_not_called()
+
+        self._versoes(mock_executar, [('catalogo', 4, 250000)])
+        self.barramento.sincronizar()
+
+        self.invalidar.assert_called_once()
+        self.assertEqual(metricas.valor('cache_invalidacao_atraso_segundos', cache='catalogo'), 0.25)
+
+    @patch('invalidacao.get_connection')
+    def test_falha_na_leitura_limpa_caches(self, mock_get_conn):
+        """Testa que sem acesso às versões os caches não ficam defasados"""
+        mock_get_conn.side_effect = Exception("Erro de conexão")
+
+        self.barramento.sincronizar()
+
+        self.invalidar.assert_called_once()
+
+    @patch('invalidacao.get_connection')
+    def test_falhas_seguidas_limpam_uma_vez_e_espacam(self, mock_get_conn):
+        """Testa que, com a tabela inacessível, os caches não são limpos a cada rodada"""
+        mock_get_conn.side_effect = Exception("Table 'loja.cache_versoes' doesn't exist")
+
+        for _ in range(4):
+            self.barramento.sincronizar()
+
+        self.invalidar.assert_called_once()
+        self.assertEqual(self.barramento.espera, 16.0)
+
+    @patch('invalidacao.get_connection')
+    @patch('invalidacao.executar')
+    def test_leitura_volta_e_restaura_espera(self, mock_executar, mock_get_conn):
+        """Testa que a leitura bem-sucedida volta ao intervalo normal"""
+        mock_get_conn.side_effect = [Exception("Erro de conexão"), Mock()]
+        self._versoes(mock_executar, [('catalogo', 3, 1000)])
+
+        self.barramento.sincronizar()
+        self.barramento.sincronizar()
+
+        self.assertEqual(self.barramento.espera, 1.0)
+
+    @patch('invalidacao.get_connection')
+    @patch('invalidacao.executar')
+    def test_notificar_incrementa_versoes(self, mock_executar, mock_get_conn):
+        """Testa o incremento das versões, agrupado por rodada, depois das escritas"""
+        self.barramento.notificar('catalogo', 'vendas')
+        self.barramento.notificar('vendas')
+        mock_get_conn.assert_not_called()
+
+        self.barramento.publicar_pendentes()
+        self.barramento.publicar_pendentes()
+
+        sql, params = mock_executar.call_args[0][1:]
+        self.assertIn('ON DUPLICATE KEY UPDATE versao = versao + 1', sql)
+        self.assertEqual(params, ('catalogo', 'vendas'))
+        mock_get_conn.return_value.commit.assert_called_once()
+
+    @patch('invalidacao.get_connection')
+    def test_desabilitado_nao_acessa_banco(self, mock_get_conn):
+        """Testa que com intervalo=0 nada é enviado ao banco, mas os caches locais são limpos"""
+        barramento = BarramentoInvalidacao(intervalo=0)
+        barramento.registrar('vendas', self.invalidar)
+        barramento.notificar('vendas')
+        mock_get_conn.assert_not_called()
+        self.invalidar.assert_called_once()
+
+    def test_intervalo_padrao_liga_com_cache(self):
+        """Testa que sem a variável o barramento só liga com vários workers e cache ligado"""
+        with patch.dict(os.environ, {'CACHE_INVALIDACAO_INTERVALO': '', 'WEB_CONCURRENCY': '1'}):
+            self.assertEqual(invalidacao._intervalo_padrao(), 0.0)
+        with patch.dict(os.environ, {'CACHE_INVALIDACAO_INTERVALO': '', 'WEB_CONCURRENCY': '4'}):
+            self.assertEqual(invalidacao._intervalo_padrao(), 1.0)
+            with patch.object(invalidacao.cache_catalogo, 'ttl', 0), \
+                    patch.object(invalidacao.cache_relatorios, 'ttl_fresco', 0), \
+                    patch.object(invalidacao.cache_dashboard, 'ttl_fresco', 0):
+                self.assertEqual(invalidacao._intervalo_padrao(), 0.0)
+        with patch.dict(os.environ, {'CACHE_INVALIDACAO_INTERVALO': '0'}):
+            self.assertEqual(invalidacao._intervalo_padrao(), 0.0)
+
+    def test_metricas_formato_prometheus(self):
+        """Testa o texto exportado em /metrics"""
+        registro = Metricas()
+        registro.incrementar('cache_invalidacoes_total', cache='catalogo')
+        registro.incrementar('cache_invalidacoes_total', cache='catalogo')
+        registro.definir_funcao('idade_segundos', lambda: 1.5)
+
+        texto = registro.texto()
+
+        self.assertIn('# TYPE cache_invalidacoes_total counter', texto)
+        self.assertIn('cache_invalidacoes_total{cache="catalogo"} 2.0', texto)
+        self.assertIn('idade_segundos 1.5', texto)
+
+
+class TestManutencao(unittest.TestCase):
+    """Testes do particionamento mensal e do arquivamento de vendas"""
+
+    def test_definicao_particao_mensal(self):
+        """Testa nome e limite superior da partição de um mês"""
+        self.assertEqual(
+            manutencao.definicao_particao(date(2024, 12, 1)),
+            "PARTITION p202412 VALUES LESS THAN (UNIX_TIMESTAMP('2025-01-01 00:00:00'))"
+        )
+
+    def test_particoes_faltantes(self):
+        """Testa que só os meses após a última partição são criados"""
+        existentes = ['p202401', 'p202402', 'pmax']
+
+        meses = manutencao.particoes_faltantes(existentes, date(2024, 2, 15), meses_futuros=2)
+
+        self.assertEqual(meses, [date(2024, 3, 1), date(2024, 4, 1)])
+        sql = manutencao.sql_reorganizar(meses)
+        self.assertIn('REORGANIZE PARTITION pmax INTO', sql)
+        self.assertIn('PARTITION pmax VALUES LESS THAN MAXVALUE', sql)
+
+    def test_particoes_para_arquivar(self):
+        """Testa que só meses inteiros fora da retenção são arquivados"""
+        existentes = ['p202301', 'p202302', 'p202303', 'pmax']
+
+        nomes = manutencao.particoes_para_arquivar(existentes, date(2024, 3, 10), retencao_meses=12)
+
+        self.assertEqual(nomes, ['p202301', 'p202302'])
+
+    @patch('manutencao.notificar')
+    @patch('manutencao.get_connection')
+    def test_arquivar_copia_e_remove_particao(self, mock_get_conn, mock_notificar):
+        """Testa a cópia para vendas_arquivo antes do DROP PARTITION"""
+        mock_cursor = Mock()
+        mock_cursor.fetchall.return_value = [('p202301',), ('p202402',), ('pmax',)]
+        mock_get_conn.return_value.cursor.return_value = mock_cursor
+
+        arquivadas = manutencao.arquivar(retencao_meses=12, hoje=date(2024, 3, 10))
+
+        self.assertEqual(arquivadas, ['p202301'])
+        comandos = [c[0][0] for c in mock_cursor.execute.call_args_list[1:]]
+        self.assertIn('INSERT IGNORE INTO vendas_arquivo', comandos[0])
+        self.assertIn('PARTITION (p202301)', comandos[0])
+        self.assertEqual(comandos[1], 'ALTER TABLE vendas DROP PARTITION p202301')
+        mock_notificar.assert_called_once_with('vendas')
+
+    @patch('venda.get_connection')
+    def test_periodo_sargavel_e_arquivo(self, mock_get_conn):
+        """Testa que o filtro de período não aplica função sobre data_venda"""
+        mock_cursor = Mock()
+        mock_cursor.fetchall.return_value = []
+        mock_get_conn.return_value.cursor.return_value = mock_cursor
+
+        VendaRepo().buscar_por_periodo('2024-03-01', '2024-03-31', incluir_arquivo=True)
+
+        sql = mock_cursor.execute.call_args[0][0]
+        self.assertNotIn('DATE(v.data_venda)', sql)
+        self.assertIn('v.data_venda >= DATE(%s)', sql)
+        self.assertIn('FROM vendas_todas v', sql)
+
+
+class TestProdutoLote(unittest.TestCase):
+    """Testes da atualização de produtos em lote"""
+
+    def setUp(self):
+        self.cache = CacheTTL(ttl=60)
+        self.produto_repo = ProdutoRepo(cache=self.cache)
+        self.mock_cursor = Mock()
+        self.mock_conn = Mock()
+        self.mock_conn.cursor.return_value = self.mock_cursor
+
+    @patch('produto.publicar')
+    @patch('produto.get_connection')
+    def test_atualizar_em_lote_por_partes(self, mock_get_conn, mock_publicar):
+        """Testa lotes com uma transação cada e o status de cada id"""
+        mock_get_conn.return_value = self.mock_conn
+        # Ids existentes de cada lote (SELECT ... FOR UPDATE)
+        self.mock_cursor.fetchall.side_effect = [[(1,), (2,)], [(3,)]]
+        self.cache.obter('todos', lambda: ['antigo'])
+
+        resultados = self.produto_repo.atualizar_em_lote([
+            {'id': 1, 'preco': 9.9},
+            {'id': 2, 'estoque': 5},
+            {'id': 3, 'nome': 'Teclado'},
+            {'id': 4, 'preco': 1.0},
+        ], tamanho_lote=2)
+
+        self.assertEqual([r['status'] for r in resultados],
+                         ['atualizado', 'atualizado', 'atualizado', 'nao_encontrado'])
+        self.assertEqual(self.mock_conn.commit.call_count, 2)
+        mock_get_conn.assert_called_once()
+        # Uma invalidação e um evento para o lote inteiro
+        self.assertEqual(len(self.cache), 0)
+        mock_publicar.assert_called_once_with('produtos_atualizados', {'ids': [1, 2, 3], 'total': 3})
+
+        # Sem os SET innodb_lock_wait_timeout de retry.com_retentativa
+        comandos = [c[0] for c in self.mock_cursor.execute.call_args_list if not c[0][0].startswith('SET ')]
+        sql, valores = comandos[1]
+        self.assertIs(sql, _sql_lote(2))
+        self.assertEqual(valores, (1, None, None, 9.9, None, 2, None, None, None, 5))
+
+    @patch('produto.publicar')
+    @patch('produto.get_connection')
+    def test_erro_em_um_lote_nao_afeta_os_outros(self, mock_get_conn, mock_publicar):
+        """Testa que a falha de um lote é desfeita e reportada por id"""
+        mock_get_conn.return_value = self.mock_conn
+        self.mock_cursor.fetchall.side_effect = [Exception("Deadlock"), [(2,)]]
+
+        resultados = self.produto_repo.atualizar_em_lote(
+            [{'id': 1, 'preco': 2.0}, {'id': 2, 'preco': 3.0}], tamanho_lote=1
+        )
+
+        self.assertEqual(resultados[0], {'id': 1, 'status': 'erro', 'erro': 'Deadlock'})
+        self.assertEqual(resultados[1], {'id': 2, 'status': 'atualizado'})
+        self.mock_conn.rollback.assert_called_once()
+
+    @patch('produto.publicar')
+    @patch('produto.get_connection')
+    def test_regra_de_preco_por_faixas(self, mock_get_conn, mock_publicar):
+        """Testa a regra por categoria percorrendo faixas de id"""
+        mock_get_conn.return_value = self.mock_conn
+        self.mock_cursor.fetchall.side_effect = [[(1,), (5,)], [(9,)], []]
+
+        ids = self.produto_repo.atualizar_preco_por_categoria('Eletrônicos', 0.9, tamanho_lote=2)
+
+        self.assertEqual(ids, [1, 5, 9])
+        updates = [c[0][1] for c in self.mock_cursor.execute.call_args_list if c[0][0].startswith('UPDATE')]
+        self.assertEqual(updates, [(0.9, 'Eletrônicos', 1, 5), (0.9, 'Eletrônicos', 9, 9)])
+        mock_publicar.assert_called_once_with('produtos_atualizados', {'ids': [1, 5, 9], 'total': 3})
+
+
+class TestSessao(unittest.TestCase):
+    """Testes da unidade de trabalho por requisição"""
+
+    def setUp(self):
+        self.mock_cursor = Mock()
+        self.mock_cursor.lastrowid = 7
+        self.mock_conn = Mock()
+        self.mock_conn.cursor.return_value = self.mock_cursor
+        self.obter_conexao = Mock(return_value=self.mock_conn)
+
+    @patch('produto.publicar')
+    @patch('produto.get_connection')
+    def test_uma_conexao_e_um_commit_por_requisicao(self, mock_get_conn, mock_publicar):
+        """Testa que os repositórios compartilham a conexão e o commit fica para o fim"""
+        cache = CacheTTL(ttl=60)
+        repo = ProdutoRepo(cache=cache)
+        cache.obter('todos', lambda: ['antigo'])
+
+        with Sessao(self.obter_conexao) as sessao:
+            repo.criar_produto('Mouse', 50.0, 'Acessórios', 3, sessao=sessao)
+            repo.buscar_por_id(7, sessao=sessao)
+
+            self.mock_conn.commit.assert_not_called()
+            mock_publicar.assert_not_called()
+            self.assertEqual(len(cache), 1)
+
+        mock_get_conn.assert_not_called()
+        self.obter_conexao.assert_called_once_with(leitura=False)
+        self.mock_conn.commit.assert_called_once()
+        self.mock_conn.close.assert_called_once()
+        # Invalidação e evento só depois do commit
+        self.assertEqual(len(cache), 0)
+        mock_publicar.assert_called_once()
+
+    @patch('venda.publicar')
+    def test_erro_desfaz_a_requisicao_inteira(self, mock_publicar):
+        """Testa o rollback no fim da requisição e o descarte dos eventos"""
+        self.mock_cursor.fetchone.return_value = {'id': 1, 'nome': 'Mouse', 'preco': Decimal('50.00'), 'estoque': 10}
+
+        with self.assertRaises(RuntimeError):
+            with Sessao(self.obter_conexao) as sessao:
+                VendaRepo().registrar_venda(1, 2, sessao=sessao)
+                raise RuntimeError("falha depois da venda")
+
+        self.mock_conn.commit.assert_not_called()
+        self.mock_conn.rollback.assert_called_once()
+        self.mock_conn.close.assert_called_once()
+        mock_publicar.assert_not_called()
+
+    def test_sessao_sem_uso_nao_abre_conexao(self):
+        """Testa que a conexão só é aberta no primeiro uso"""
+        with Sessao(self.obter_conexao, leitura=True):
+            pass
+
+        self.obter_conexao.assert_not_called()
+
+    def test_sessao_de_leitura_recusa_escrita(self):
+        """Testa que uma requisição de leitura (réplica) não faz escritas"""
+        with Sessao(self.obter_conexao, leitura=True) as sessao:
+            sessao.conexao(leitura=True)
+            with self.assertRaises(RuntimeError):
+                sessao.conexao()
+
+    @patch('venda.publicar')
+    def test_commit_depois_do_limite_desfaz(self, mock_publicar):
+        """Testa que a venda que passaria da margem do feed é desfeita em vez de confirmada"""
+        self.mock_cursor.fetchone.return_value = {'id': 1, 'nome': 'Mouse', 'preco': Decimal('50.00'), 'estoque': 10}
+        sessao = Sessao(self.obter_conexao)
+        VendaRepo().registrar_venda(1, 2, sessao=sessao)
+        self.assertIsNotNone(sessao.confirmar_ate)
+
+        sessao.confirmar_ate -= feed.MARGEM_FEED + 1
+        with self.assertRaises(TransacaoIndisponivelError):
+            sessao.confirmar()
+
+        self.mock_conn.commit.assert_not_called()
+        self.mock_conn.rollback.assert_called_once()
+        mock_publicar.assert_not_called()
+
+
+class TestRetry(unittest.TestCase):
+    """Testes das novas tentativas em deadlock e lock wait timeout"""
+
+    def deadlock(self):
+        return mysql_errors.DatabaseError(msg="Deadlock found when trying to get lock", errno=1213)
+
+    @patch('retry.time.sleep')
+    def test_repete_a_sessao_em_deadlock(self, mock_sleep):
+        """Testa que a unidade de trabalho é desfeita e repetida"""
+        funcao = Mock(side_effect=[self.deadlock(), self.deadlock(), 'ok'])
+        sessao = Mock()
+        antes = metricas.valor('db_retentativas_total', operacao='teste_sessao', erro='deadlock') or 0
+
+        resultado = retry.com_retentativa(funcao, 'teste_sessao', sessao=sessao)
+
+        self.assertEqual(resultado, 'ok')
+        self.assertEqual(funcao.call_count, 3)
+        self.assertEqual(sessao.reiniciar.call_count, 2)
+        self.assertEqual(mock_sleep.call_count, 2)
+        self.assertEqual(metricas.valor('db_retentativas_total', operacao='teste_sessao', erro='deadlock'), antes + 2)
+
+    def test_erro_nao_transitorio_nao_repete(self):
+        """Testa que erros de negócio sobem na primeira tentativa"""
+        funcao = Mock(side_effect=ValueError("quantidade"))
+
+        with self.assertRaises(ValueError):
+            retry.com_retentativa(funcao, 'teste')
+        funcao.assert_called_once()
+
+    @patch('retry.time.sleep')
+    def test_esgota_tentativas(self, mock_sleep):
+        """Testa a exceção para a API responder 503 em vez de 500"""
+        lock_wait = mysql_errors.DatabaseError(msg="Lock wait timeout exceeded", errno=1205)
+        funcao = Mock(side_effect=lock_wait)
+
+        with self.assertRaises(TransacaoIndisponivelError):
+            retry.com_retentativa(funcao, 'teste_esgotado', tentativas=3)
+        self.assertEqual(funcao.call_count, 3)
+
+    def test_respeita_prazo_da_requisicao(self):
+        """Testa que não espera além do prazo restante da requisição"""
+        funcao = Mock(side_effect=self.deadlock())
+
+        def sem_prazo():
+            retry.definir_prazo(0)
+            return retry.com_retentativa(funcao, 'teste_prazo')
+
+        with self.assertRaises(TransacaoIndisponivelError):
+            contextvars.copy_context().run(sem_prazo)
+        funcao.assert_called_once()
+
+    def test_limita_espera_por_lock_ao_prazo(self):
+        """Testa que cada tentativa espera por lock só o que resta do prazo, e o padrão volta no fim"""
+        conexao = Mock()
+        cursor = conexao.cursor.return_value
+
+        def com_prazo():
+            retry.definir_prazo(2.5)
+            return retry.com_retentativa(Mock(return_value='ok'), 'teste_espera_lock', conexao=conexao)
+
+        self.assertEqual(contextvars.copy_context().run(com_prazo), 'ok')
+        self.assertEqual(cursor.execute.call_args_list, [
+            call(retry.SQL_ESPERA_LOCK, (3,)),
+            call(retry.SQL_ESPERA_LOCK_PADRAO),
+        ])
+
+    @patch('retry.time.sleep')
+    @patch('venda.publicar')
+    @patch('venda.get_connection')
+    def test_registrar_venda_sem_sessao_repete(self, mock_get_conn, mock_publicar, mock_sleep):
+        """Testa que registrar_venda refaz a própria transação após um deadlock"""
+        mock_cursor = Mock()
+        mock_cursor.fetchone.side_effect = [
+            self.deadlock(),
+            {'id': 1, 'nome': 'Mouse', 'preco': Decimal('50.00'), 'estoque': 10},
+        ]
+        mock_cursor.lastrowid = 3
+        mock_conn = Mock()
+        mock_conn.cursor.return_value = mock_cursor
+        mock_get_conn.return_value = mock_conn
+
+        venda_id, valor_total = VendaRepo().registrar_venda(1, 2)
+
+        self.assertEqual(venda_id, 3)
+        self.assertEqual(mock_get_conn.call_count, 2)
+        mock_conn.rollback.assert_called_once()
+        mock_conn.commit.assert_called_once()
+
+
+class TestCacheRelatorios(unittest.TestCase):
+    """Testes do cache stale-while-revalidate dos relatórios"""
+
+    def test_fresco_nao_recalcula(self):
+        """Testa que dentro do TTL o resultado vem do cache com a idade"""
+        cache = CacheSWR('teste_fresco', ttl_fresco=60, ttl_maximo=120)
+        carregar = Mock(return_value={'total': 1})
+
+        self.assertEqual(cache.obter('resumo', carregar)[2], 'novo')
+        valor, idade, estado = cache.obter('resumo', carregar)
+
+        self.assertEqual(valor, {'total': 1})
+        self.assertEqual(estado, 'fresco')
+        self.assertGreaterEqual(idade, 0)
+        carregar.assert_called_once()
+
+    def test_antigo_serve_e_atualiza_em_segundo_plano(self):
+        """Testa que depois do TTL curto o valor antigo é servido e recalculado"""
+        cache = CacheSWR('teste_antigo', ttl_fresco=0, ttl_maximo=120)
+        carregar = Mock(side_effect=['v1', 'v2'])
+        cache.obter('resumo', carregar)
+
+        valor, _, estado = cache.obter('resumo', carregar)
+        cache._executor.shutdown(wait=True)
+
+        self.assertEqual((valor, estado), ('v1', 'antigo'))
+        self.assertEqual(carregar.call_count, 2)
+        self.assertEqual(cache._dados['resumo'][2], 'v2')
+
+    def test_invalidar_marca_como_antigo(self):
+        """Testa que a invalidação não descarta o valor, só força a atualização"""
+        cache = CacheSWR('teste_invalidar', ttl_fresco=60, ttl_maximo=120)
+        carregar = Mock(side_effect=['v1', 'v2'])
+        cache.obter('resumo', carregar)
+
+        cache.invalidar()
+        self.assertEqual(cache.obter('resumo', carregar)[0], 'v1')
+        cache._executor.shutdown(wait=True)
+        self.assertEqual(cache.obter('resumo', carregar)[::2], ('v2', 'fresco'))
+
+    def test_descartar_recalcula_na_hora(self):
+        """Testa que, depois de descartar, o próximo acesso já traz o valor novo"""
+        cache = CacheSWR('teste_descartar', ttl_fresco=60, ttl_maximo=120)
+        carregar = Mock(side_effect=['v1', 'v2'])
+        cache.obter('painel', carregar)
+
+        cache.descartar()
+
+        self.assertEqual(cache.obter('painel', carregar)[::2], ('v2', 'novo'))
+
+    def test_ttl_maximo_recalcula_na_hora(self):
+        """Testa que um valor além do TTL máximo não é servido"""
+        cache = CacheSWR('teste_maximo', ttl_fresco=0, ttl_maximo=0)
+        carregar = Mock(side_effect=['v1', 'v2'])
+        cache.obter('resumo', carregar)
+
+        self.assertEqual(cache.obter('resumo', carregar)[::2], ('v2', 'novo'))
+
+    def test_descarta_entradas_vencidas_e_excedentes(self):
+        """Testa que entradas além do TTL máximo saem do cache e o tamanho é limitado"""
+        cache = CacheSWR('teste_limite', ttl_fresco=60, ttl_maximo=120, maximo=2)
+        for limite in (10, 20, 30):
+            cache.obter(('top', limite), lambda: limite)
+
+        self.assertEqual(list(cache._dados), [('top', 20), ('top', 30)])
+
+        cache.ttl_maximo = 0
+        cache.obter(('top', 40), lambda: 40)
+
+        self.assertEqual(len(cache), 0)
+
+    def test_single_flight(self):
+        """Testa que requisições simultâneas disparam um único cálculo"""
+        import threading
+        import time as tempo
+        cache = CacheSWR('teste_single_flight', ttl_fresco=60, ttl_maximo=120)
+        chamadas = []
+
+        def carregar():
+            chamadas.append(1)
+            tempo.sleep(0.05)
+            return 'valor'
+
+        resultados = []
+        threads = [
+            threading.Thread(target=lambda: resultados.append(cache.obter('resumo', carregar)[0]))
+            for _ in range(5)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(chamadas), 1)
+        self.assertEqual(resultados, ['valor'] * 5)
+
+
+class TestLimitador(unittest.IsolatedAsyncioTestCase):
+    """Testes do limite adaptativo de concorrência"""
+
+    def test_classificar_rotas(self):
+        """Testa a classe de limite de cada rota"""
+        self.assertEqual(limitador._classificar('POST', '/api/vendas'), 'escrita')
+        self.assertEqual(limitador._classificar('GET', '/api/produtos/1'), 'leitura')
+        self.assertEqual(limitador._classificar('GET', '/api/relatorios/vendas-serie'), 'relatorio')
+        self.assertIsNone(limitador._classificar('GET', '/api/eventos'))
+        self.assertIsNone(limitador._classificar('GET', '/health'))
+
+    def test_aimd(self):
+        """Testa que o limite sobe com latência estável e cai com lentidão ou erro"""
+        limite = limitador.LimiteAdaptativo('teste_aimd', inicial=4, maximo=8)
+        for _ in range(20):
+            limite.em_uso += 1
+            limite.sair(0.01)
+        self.assertGreater(limite.limite, 4)
+
+        antes = limite.limite
+        limite.em_uso += 1
+        limite.sair(0.5)
+        self.assertAlmostEqual(limite.limite, antes * 0.9)
+
+        erro = limitador.LimiteAdaptativo('teste_aimd_erro', inicial=4)
+        erro.em_uso += 1
+        erro.sair(0.01, erro=True)
+        self.assertAlmostEqual(erro.limite, 4 * 0.9)
+
+    def test_referencia_por_rota(self):
+        """Testa que rotas lentas e rápidas da mesma classe não derrubam o limite"""
+        limite = limitador.LimiteAdaptativo('teste_rotas', inicial=4, maximo=8)
+        for _ in range(20):
+            for rota, latencia in (('GET /api/produtos/{id}', 0.005), ('GET /api/produtos', 0.05)):
+                limite.em_uso += 1
+                limite.sair(latencia, rota=rota)
+
+        self.assertGreater(limite.limite, 4)
+        self.assertEqual(limitador._rota('GET', '/api/produtos/12'), 'GET /api/produtos/{id}')
+
+    def test_uma_reducao_por_rtt(self):
+        """Testa que respostas lentas iniciadas antes da última redução não reduzem de novo"""
+        limite = limitador.LimiteAdaptativo('teste_rtt', inicial=10)
+        limite.em_uso += 1
+        limite.sair(0.01)
+        antes = limite.limite
+        for _ in range(5):
+            limite.em_uso += 1
+            limite.sair(0.5)
+
+        self.assertAlmostEqual(limite.limite, antes * 0.9)
+
+    async def test_fila_e_descarte(self):
+        """Testa a espera na fila, o descarte com fila cheia e o timeout"""
+        limite = limitador.LimiteAdaptativo('teste_fila', inicial=1, maximo=1, fila_maxima=1, espera_maxima=0.05)
+        self.assertTrue(await limite.entrar())
+
+        esperando = asyncio.create_task(limite.entrar())
+        await asyncio.sleep(0)
+        self.assertFalse(await limite.entrar())
+        self.assertEqual(metricas.valor('limitador_rejeicoes_total', classe='teste_fila', motivo='fila_cheia'), 1)
+
+        limite.sair(0.01)
+        self.assertTrue(await esperando)
+        self.assertEqual(limite.em_uso, 1)
+
+        self.assertFalse(await limite.entrar())
+        self.assertEqual(metricas.valor('limitador_rejeicoes_total', classe='teste_fila', motivo='espera'), 1)
+        self.assertEqual(metricas.valor('limitador_fila', classe='teste_fila'), 0)
+
+    async def test_middleware_responde_503(self):
+        """Testa o 503 com Retry-After sem chamar a aplicação"""
+        aplicacao = AsyncMock()
+        limite = limitador.LimiteAdaptativo('teste_middleware', inicial=1, fila_maxima=0)
+        limite.em_uso = 1
+        middleware = limitador.LimitadorConcorrencia(aplicacao, limites={'escrita': limite}, habilitado=True)
+        enviadas = []
+
+        async def send(mensagem):
+            enviadas.append(mensagem)
+
+        await middleware({'type': 'http', 'method': 'POST', 'path': '/api/vendas'}, None, send)
+
+        aplicacao.assert_not_called()
+        self.assertEqual(enviadas[0]['status'], 503)
+        self.assertIn((b'retry-after', b'1'), enviadas[0]['headers'])
+
+
+class TestRastreamento(unittest.IsolatedAsyncioTestCase):
+    """Testes dos spans, do traceparent e da exportação dos traços"""
+
+    def test_span_fora_de_traco_nao_registra(self):
+        """Testa que sem requisição amostrada span() é só um bloco normal"""
+        with rastreamento.span('sql') as s:
+            self.assertIsNone(s)
+
+    def test_ler_traceparent(self):
+        """Testa o formato W3C do cabeçalho traceparent"""
+        trace_id, pai_id = 'a' * 32, 'b' * 16
+        self.assertEqual(rastreamento.ler_traceparent(f'00-{trace_id}-{pai_id}-01'), (trace_id, pai_id, True))
+        self.assertEqual(rastreamento.ler_traceparent(f'00-{trace_id}-{pai_id}-00'), (trace_id, pai_id, False))
+        self.assertIsNone(rastreamento.ler_traceparent('00-123-abc-01'))
+        self.assertIsNone(rastreamento.ler_traceparent(f'00-{"0" * 32}-{pai_id}-01'))
+
+    async def test_middleware_monta_arvore_e_exporta(self):
+        """Testa a árvore requisição -> repositório -> SQL e o arquivo JSONL"""
+        import tempfile
+        with tempfile.TemporaryDirectory() as pasta:
+            coletor = rastreamento.ColetorTracos(arquivo=os.path.join(pasta, 'tracos.jsonl'))
+
+            @rastreamento.rastreado('Repo.buscar')
+            def buscar():
+                with rastreamento.span('sql', sql='SELECT 1'):
+                    pass
+
+            async def aplicacao(scope, receive, send):
+                buscar()
+                await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+                await send({'type': 'http.response.body', 'body': b''})
+
+            enviadas = []
+
+            async def send(mensagem):
+                enviadas.append(mensagem)
+
+            middleware = rastreamento.MiddlewareRastreamento(aplicacao, taxa=0.0, coletor=coletor)
+            traceparent = f'00-{"c" * 32}-{"d" * 16}-01'.encode()
+            await middleware({'type': 'http', 'method': 'POST', 'path': '/api/vendas',
+                              'headers': [(b'traceparent', traceparent)]}, None, send)
+
+            cabecalhos = dict(enviadas[0]['headers'])
+            self.assertTrue(cabecalhos[b'traceparent'].startswith(b'00-' + b'c' * 32))
+
+            traco = rastreamento.arvore(coletor.mais_lentos(1)[0])
+            raiz = traco['spans'][0]
+            self.assertEqual(raiz['nome'], 'POST /api/vendas')
+            self.assertEqual(raiz['pai_id'], 'd' * 16)
+            self.assertEqual(raiz['filhos'][0]['nome'], 'Repo.buscar')
+            self.assertEqual(raiz['filhos'][0]['filhos'][0]['atributos'], {'sql': 'SELECT 1'})
+
+            self.assertTrue(coletor.esvaziar())
+            with open(coletor.arquivo, encoding='utf-8') as arquivo:
+                linhas = arquivo.readlines()
+            self.assertEqual(len(linhas), 1)
+            self.assertEqual(json.loads(linhas[0])['trace_id'], 'c' * 32)
+
+    async def test_nao_amostrada_nao_exporta(self):
+        """Testa que requisições fora da amostra não geram traço"""
+        coletor = rastreamento.ColetorTracos(arquivo='')
+        aplicacao = AsyncMock()
+        middleware = rastreamento.MiddlewareRastreamento(aplicacao, taxa=0.0, coletor=coletor)
+
+        await middleware({'type': 'http', 'method': 'GET', 'path': '/api/produtos', 'headers': []}, None, AsyncMock())
+
+        aplicacao.assert_awaited_once()
+        self.assertEqual(coletor.mais_lentos(), [])
+
+
+class TestPerfil(unittest.TestCase):
+    """Testes do perfil sob demanda dos workers"""
+
+    def test_cpu_ignora_threads_paradas(self):
+        """Testa que no modo cpu só aparecem threads que gastaram CPU"""
+        import threading
+        import time
+        parar = threading.Event()
+
+        def ocupada():
+            while not parar.is_set():
+                sum(range(1000))
+
+        threads = [
+            threading.Thread(target=ocupada, name='perfil-ocupada'),
+            threading.Thread(target=parar.wait, name='perfil-parada'),
+        ]
+        for t in threads:
+            t.start()
+        # A partida da thread também gasta CPU; só a espera deve ficar de fora
+        time.sleep(0.05)
+        try:
+            texto = perfil.perfilar(0.3, 'cpu')
+        finally:
+            parar.set()
+            for t in threads:
+                t.join()
+
+        self.assertIn('thread perfil-ocupada;', texto)
+        self.assertNotIn('perfil-parada', texto)
+        _, peso = texto.splitlines()[0].rsplit(' ', 1)
+        self.assertGreater(int(peso), 0)
+
+    def test_alloc_agrupa_por_pilha(self):
+        """Testa que as alocações do período aparecem com o peso em bytes"""
+        import threading
+        guardado = []
+        alocar = threading.Timer(0.05, lambda: guardado.append([bytearray(1024) for _ in range(100)]))
+        alocar.start()
+
+        texto = perfil.perfilar(0.2, 'alloc')
+        alocar.join()
+
+        self.assertIn('tests.py:', texto)
+
+    def test_um_perfil_por_vez(self):
+        """Testa a proteção contra perfis simultâneos"""
+        with perfil._em_execucao:
+            with self.assertRaises(perfil.PerfilEmAndamentoError):
+                perfil.perfilar(0.1, 'wall')
+        with self.assertRaises(ValueError):
+            perfil.perfilar(0.1, 'io')
+
+
+class TestRegistros(unittest.TestCase):
+    """Testes das linhas compactas dos repositórios"""
+
+    colunas = ('venda_id', 'produto_id', 'quantidade', 'valor_total', 'data_venda', 'produto_nome', 'produto_preco')
+
+    def linha(self):
+        # Objetos novos a cada linha, como o conector devolve
+        return (7, 3, 2, Decimal('59.80'), datetime(2024, 3, 5, 14, 30, 0), ''.join(['Mou', 'se']), Decimal('29.90'))
+
+    def test_acesso_por_nome_e_posicao(self):
+        """Testa que a linha compacta aceita o acesso usado com dicts"""
+        venda = registros.tipo_registro(self.colunas)._make(self.linha())
+
+        self.assertEqual(venda['venda_id'], 7)
+        self.assertEqual(venda.produto_nome, 'Mouse')
+        self.assertEqual(venda[0], 7)
+        self.assertEqual(venda.get('data_venda'), datetime(2024, 3, 5, 14, 30, 0))
+        self.assertIsNone(venda.get('inexistente'))
+        self.assertIs(registros.tipo_registro(self.colunas), type(venda))
+        self.assertLess(sys.getsizeof(venda), sys.getsizeof(venda.como_dict()))
+
+    def test_serializa_com_data_formatada(self):
+        """Testa que a data só é formatada na serialização, no formato de listar_vendas"""
+        venda = registros.tipo_registro(self.colunas)._make(self.linha())
+
+        dados = json.loads(serializacao.dumps([venda]))
+
+        self.assertEqual(dados[0]['data_venda'], '2024-03-05 14:30:00')
+        self.assertEqual(dados[0]['valor_total'], 59.8)
+        self.assertEqual(list(dados[0]), list(self.colunas))
+
+    @patch('venda.get_connection')
+    def test_listar_vendas_compacto_le_em_lotes(self, mock_get_conn):
+        """Testa que o repositório usa cursor de tuplas lido com fetchmany"""
+        mock_cursor = Mock()
+        mock_cursor.column_names = self.colunas
+        mock_cursor.fetchmany.side_effect = [[self.linha(), self.linha()], [self.linha()], []]
+
+        mock_conn = Mock()
+        mock_conn.cursor.return_value = mock_cursor
+        mock_get_conn.return_value = mock_conn
+
+        vendas = VendaRepo().listar_vendas(compacto=True)
+
+        mock_conn.cursor.assert_called_once_with(prepared=True, dictionary=False)
+        mock_cursor.fetchall.assert_not_called()
+        self.assertEqual(len(vendas), 3)
+        self.assertIsInstance(vendas[0], registros.Registro)
+        self.assertIsInstance(vendas[0]['data_venda'], datetime)
+        # Colunas do produto compartilhadas entre as vendas do mesmo produto
+        self.assertIs(vendas[0]['produto_nome'], vendas[2]['produto_nome'])
+        self.assertIs(vendas[0]['produto_preco'], vendas[1]['produto_preco'])
+
+
+class TestTarefas(unittest.TestCase):
+    """Testes da fila de tarefas em segundo plano"""
+
+    def setUp(self):
+        self.diretorio = tempfile.TemporaryDirectory()
+        self.addCleanup(self.diretorio.cleanup)
+        self.gerenciador = tarefas.GerenciadorTarefas(diretorio=self.diretorio.name)
+
+    def test_consultas_de_queries_sql(self):
+        """Testa que as cinco consultas numeradas são lidas de queries.sql"""
+        consultas = tarefas.consultas_sql()
+
+        self.assertEqual(sorted(consultas), [1, 2, 3, 4, 5])
+        self.assertTrue(all(sql.upper().startswith('SELECT') for sql in consultas.values()))
+
+    def test_validar_rejeita_parametros(self):
+        """Testa a validação de tipo, formato e parâmetros"""
+        with self.assertRaises(ValueError):
+            tarefas.validar('apagar_tudo', {}, 'json')
+        with self.assertRaises(ValueError):
+            tarefas.validar('consulta', {'numero': 9}, 'json')
+        with self.assertRaises(ValueError):
+            tarefas.validar('consulta', {'numero': 1, 'sql': 'DROP TABLE vendas'}, 'json')
+        with self.assertRaises(ValueError):
+            tarefas.validar('resumo_periodo', {'data_inicio': '2024-02-01', 'data_fim': '2024-01-01'}, 'csv')
+        with self.assertRaises(ValueError):
+            tarefas.validar('exportacao', {}, 'xml')
+
+        parametros = tarefas.validar('resumo_periodo', {'data_inicio': '2024-01-01', 'data_fim': '2024-01-31'}, 'csv')
+        self.assertEqual(parametros['granularidade'], 'dia')
+        self.assertFalse(parametros['incluir_arquivo'])
+
+    def test_executar_tarefa_grava_resultado(self):
+        """Testa que o filho marca a tarefa como em execução e grava CSV e JSON"""
+        executor = Mock(return_value=(['categoria', 'receita'], [('Eletrônicos', Decimal('10.50')), ('Livros', 3)]))
+        estado = os.path.join(self.diretorio.name, 'estado.json')
+        with open(estado, 'w') as arquivo:
+            json.dump({'id': 'x', 'estado': 'pendente'}, arquivo)
+
+        with patch.dict(tarefas.EXECUTORES, {'consulta': executor}):
+            csv_caminho = os.path.join(self.diretorio.name, 'r.csv')
+            json_caminho = os.path.join(self.diretorio.name, 'r.json')
+            self.assertEqual(tarefas.executar_tarefa('consulta', {'numero': 1}, 'csv', csv_caminho, estado), 2)
+            tarefas.executar_tarefa('consulta', {'numero': 1}, 'json', json_caminho)
+
+        executor.assert_called_with(numero=1)
+        with open(csv_caminho, encoding='utf-8') as arquivo:
+            self.assertEqual(arquivo.read().splitlines(), ['categoria,receita', 'Eletrônicos,10.50', 'Livros,3'])
+        with open(json_caminho, encoding='utf-8') as arquivo:
+            self.assertEqual(json.load(arquivo)[0], {'categoria': 'Eletrônicos', 'receita': 10.5})
+        with open(estado) as arquivo:
+            self.assertEqual(json.load(arquivo)['estado'], 'executando')
+
+    def test_conclusao_e_fila_cheia(self):
+        """Testa o estado final da tarefa e a recusa com a fila cheia"""
+        self.gerenciador.iniciar()
+        self.gerenciador.fila_maxima = 1
+        with patch.object(self.gerenciador, '_pool') as pool:
+            futuro = Mock()
+            pool.return_value.submit.return_value = futuro
+            tarefa = self.gerenciador.criar('consulta', {'numero': 2}, 'csv')
+
+            with self.assertRaises(tarefas.FilaCheiaError):
+                self.gerenciador.criar('consulta', {'numero': 2}, 'csv')
+
+        futuro.cancelled.return_value = False
+        futuro.exception.return_value = None
+        futuro.result.return_value = 12
+        concluir = futuro.add_done_callback.call_args[0][0]
+        concluir(futuro)
+
+        estado = self.gerenciador.obter(tarefa['id'])
+        self.assertEqual(estado['estado'], 'concluida')
+        self.assertEqual(estado['linhas'], 12)
+        self.assertIsNone(self.gerenciador.obter('../../etc/passwd'))
+
+    def test_iniciar_retoma_orfas_e_apaga_vencidas(self):
+        """Testa que tarefas de um processo morto são retomadas e as antigas apagadas"""
+        self.gerenciador.iniciar()
+        base = {'tipo': 'consulta', 'parametros': {'numero': 1}, 'formato': 'json', 'iniciada_em': None,
+                'linhas': None, 'erro': None}
+        orfa = dict(base, id='a' * 32, estado='executando', dono=999999, concluida_em=None)
+        viva = dict(base, id='b' * 32, estado='pendente', dono=os.getppid(), concluida_em=None)
+        vencida = dict(base, id='c' * 32, estado='concluida', dono=999999, concluida_em=1.0)
+        for tarefa in (orfa, viva, vencida):
+            self.gerenciador._salvar(tarefa)
+
+        with patch.object(self.gerenciador, '_enfileirar') as enfileirar, \
+                patch('tarefas._processo_vivo', side_effect=lambda pid: pid != 999999):
+            retomadas = self.gerenciador.iniciar()
+
+        self.assertEqual(retomadas, 1)
+        enfileirar.assert_called_once()
+        self.assertEqual(enfileirar.call_args[0][0]['id'], 'a' * 32)
+        self.assertEqual(self.gerenciador.obter('a' * 32)['dono'], os.getpid())
+        self.assertEqual(self.gerenciador.obter('b' * 32)['estado'], 'pendente')
+        self.assertIsNone(self.gerenciador.obter('c' * 32))
+
+
+class TestFeedAlteracoes(unittest.TestCase):
+    """Testes dos feeds incrementais de vendas e produtos"""
+
+    def conexao(self, linhas):
+        mock_cursor = Mock()
+        mock_cursor.fetchall.return_value = linhas
+        mock_conn = Mock()
+        mock_conn.cursor.return_value = mock_cursor
+        return mock_conn, mock_cursor
+
+    def venda(self, venda_id, recente=0):
+        return {'venda_id': venda_id, 'produto_id': 1, 'quantidade': 1, 'valor_total': Decimal('10.00'),
+                'data_venda': datetime(2024, 3, 5, 14, 30, 0), 'produto_nome': 'Mouse',
+                'produto_preco': Decimal('10.00'), 'recente': recente}
+
+    @patch('venda.get_connection')
+    def test_vendas_desde_usa_marca_e_limite(self, mock_get_conn):
+        """Testa a busca a partir do id com uma linha a mais para saber se há mais"""
+        mock_conn, mock_cursor = self.conexao([self.venda(11), self.venda(12), self.venda(13)])
+        mock_get_conn.return_value = mock_conn
+
+        vendas, ultimo_id, tem_mais = VendaRepo().vendas_desde(10, limite=2)
+
+        sql, params = mock_cursor.execute.call_args[0]
+        self.assertIn('WHERE v.id > %s', sql)
+        self.assertIn('ORDER BY v.id', sql)
+        self.assertEqual(params, (feed.MARGEM_FEED, 10, 3))
+        self.assertEqual([v['venda_id'] for v in vendas], [11, 12])
+        self.assertEqual(ultimo_id, 12)
+        self.assertTrue(tem_mais)
+        self.assertNotIn('recente', vendas[0])
+        self.assertEqual(vendas[0]['data_venda'], '2024-03-05 14:30:00')
+
+    @patch('venda.get_connection')
+    def test_vendas_desde_para_na_primeira_recente(self, mock_get_conn):
+        """Testa que a marca d'água não passa de uma venda ainda dentro da margem"""
+        mock_conn, _ = self.conexao([self.venda(11), self.venda(12, recente=1), self.venda(13)])
+        mock_get_conn.return_value = mock_conn
+
+        vendas, ultimo_id, tem_mais = VendaRepo().vendas_desde(10, limite=5)
+
+        self.assertEqual([v['venda_id'] for v in vendas], [11])
+        self.assertEqual(ultimo_id, 11)
+        self.assertFalse(tem_mais)
+
+    @patch('venda.get_connection')
+    def test_vendas_desde_sem_novidades_mantem_marca(self, mock_get_conn):
+        """Testa que sem vendas novas a marca d'água continua a mesma"""
+        mock_conn, _ = self.conexao([])
+        mock_get_conn.return_value = mock_conn
+
+        self.assertEqual(VendaRepo().vendas_desde(42), ([], 42, False))
+
+    @patch('produto.get_connection')
+    def test_produtos_desde_desempata_por_id(self, mock_get_conn):
+        """Testa o feed de produtos pela marca (updated_at, id)"""
+        alterado = datetime(2024, 3, 5, 14, 30, 0, 123456)
+        mock_conn, mock_cursor = self.conexao([
+            {'id': 3, 'nome': 'Mouse', 'updated_at': alterado, 'recente': 0},
+            {'id': 8, 'nome': 'Teclado', 'updated_at': alterado, 'recente': 0},
+        ])
+        mock_get_conn.return_value = mock_conn
+
+        produtos, marca, tem_mais = ProdutoRepo().produtos_desde(alterado, 2, limite=10)
+
+        sql, params = mock_cursor.execute.call_args[0]
+        self.assertIn('ORDER BY updated_at, id', sql)
+        self.assertEqual(params, (feed.MARGEM_FEED, alterado, alterado, 2, 11))
+        self.assertEqual(marca, (alterado, 8))
+        self.assertFalse(tem_mais)
+        self.assertEqual(len(produtos), 2)
+
+        mock_cursor.fetchall.return_value = []
+        _, marca, _ = ProdutoRepo().produtos_desde()
+        self.assertEqual(marca, (INICIO_FEED, 0))
+
+
+class TestCampos(unittest.TestCase):
+    """Testes da projeção de colunas (fields=)"""
+
+    def test_selecionar_campos(self):
+        """Testa a validação e a ordem canônica dos campos"""
+        self.assertIsNone(selecionar_campos(None, CAMPOS_PRODUTO))
+        self.assertIsNone(selecionar_campos(' , ', CAMPOS_PRODUTO))
+        self.assertEqual(selecionar_campos('estoque, id,estoque', CAMPOS_PRODUTO), ('id', 'estoque'))
+        with self.assertRaises(ValueError) as contexto:
+            selecionar_campos('id,senha', CAMPOS_PRODUTO)
+        self.assertIn('senha', str(contexto.exception))
+        with self.assertRaises(ValueError):
+            selecionar_campos('id FROM produtos; --', CAMPOS_PRODUTO)
+
+    @patch('produto.get_connection')
+    def test_listar_produtos_com_campos(self, mock_get_conn):
+        """Testa que os campos viram a lista de colunas do SELECT"""
+        mock_cursor = Mock()
+        mock_cursor.fetchall.return_value = [{'id': 1, 'estoque': 3}]
+        mock_conn = Mock()
+        mock_conn.cursor.return_value = mock_cursor
+        mock_get_conn.return_value = mock_conn
+
+        ProdutoRepo().filtrar_por_categoria('Livros', campos=('id', 'estoque'))
+
+        mock_cursor.execute.assert_called_once_with(
+            'SELECT id, estoque FROM produtos WHERE categoria = %s ORDER BY id', ('Livros',)
+        )
+
+    @patch('venda.get_connection')
+    def test_vendas_sem_campos_do_produto_nao_fazem_join(self, mock_get_conn):
+        """Testa que o JOIN com produtos só entra com produto_nome/produto_preco"""
+        mock_cursor = Mock()
+        mock_cursor.fetchall.return_value = [{'venda_id': 1, 'valor_total': Decimal('10.00')}]
+        mock_conn = Mock()
+        mock_conn.cursor.return_value = mock_cursor
+        mock_get_conn.return_value = mock_conn
+
+        vendas = VendaRepo().listar_vendas(campos=('venda_id', 'valor_total'))
+        sql = mock_cursor.execute.call_args[0][0]
+        self.assertNotIn('JOIN', sql)
+        self.assertNotIn('data_venda', sql)
+        self.assertEqual(vendas, [{'venda_id': 1, 'valor_total': Decimal('10.00')}])
+
+        VendaRepo().buscar_por_periodo('2024-01-01', '2024-01-31', campos=('venda_id', 'produto_nome'))
+        sql = mock_cursor.execute.call_args[0][0]
+        self.assertIn('JOIN produtos p', sql)
+        self.assertIn('p.nome AS produto_nome', sql)
+        self.assertNotIn('valor_total', sql)
+
+    def test_cache_separado_por_campos(self):
+        """Testa que cada combinação de campos tem sua entrada no cache do catálogo"""
+        repo = ProdutoRepo(cache=CacheTTL(ttl=60))
+        with patch.object(repo, '_consultar_todos', side_effect=lambda s, c, campos: [campos]) as consultar:
+            self.assertEqual(repo.listar_todos(), [None])
+            self.assertEqual(repo.listar_todos(campos=('id',)), [('id',)])
+            self.assertEqual(repo.listar_todos(campos=('id',)), [('id',)])
+
+        self.assertEqual(consultar.call_count, 2)
+
+
+class TestDashboard(unittest.TestCase):
+    """Testes do painel agregado da página inicial"""
+
+    def test_consultas_num_unico_snapshot(self):
+        """Testa que as quatro consultas usam uma só conexão, depois do START TRANSACTION"""
+        mock_cursor = Mock()
+        mock_cursor.fetchone.return_value = (4, Decimal('1'), Decimal('2'), 10, Decimal('99.50'))
+        mock_cursor.fetchall.side_effect = [
+            [{'id': 2, 'nome': 'Mouse', 'categoria': 'Periféricos', 'estoque': 0, 'preco': Decimal('29.90')}],
+            [(5, 'Teclado', Decimal('7'))],
+            [{'venda_id': 10, 'produto_id': 5, 'quantidade': 1, 'valor_total': Decimal('89.90'),
+              'data_venda': datetime(2024, 3, 5, 14, 30, 0), 'produto_nome': 'Teclado',
+              'produto_preco': Decimal('89.90')}],
+        ]
+        mock_conn = Mock()
+        mock_conn.cursor.return_value = mock_cursor
+        obter_conexao = Mock(return_value=mock_conn)
+
+        with patch('venda.get_connection') as mock_get_conn:
+            painel = dashboard.montar_dashboard(limite_estoque=3, top=5, recentes=10, obter_conexao=obter_conexao)
+
+        obter_conexao.assert_called_once_with(leitura=True)
+        mock_get_conn.assert_not_called()
+        comandos = [c[0][0] for c in mock_cursor.execute.call_args_list]
+        self.assertEqual(comandos[0], dashboard.SQL_INICIO)
+        self.assertEqual(len(comandos), 5)
+        self.assertIn('LIMIT %s', comandos[-1])
+        mock_conn.commit.assert_called_once()
+        mock_conn.close.assert_called_once()
+
+        self.assertEqual(painel['resumo']['produtos'], {'total': 4, 'sem_estoque': 1, 'com_estoque': 3, 'estoque_baixo': 2})
+        self.assertEqual(painel['resumo']['vendas'], {'total': 10, 'valor_total': 99.5})
+        self.assertEqual(painel['estoque_baixo']['produtos'][0]['preco'], 29.9)
+        self.assertEqual(painel['top_produtos'], [{'id': 5, 'nome': 'Teclado', 'total_vendido': 7}])
+        self.assertEqual(painel['vendas_recentes'][0]['data_venda'], '2024-03-05 14:30:00')
+
+    def test_falha_desfaz_a_sessao(self):
+        """Testa que um erro no meio do painel desfaz a transação e devolve a conexão"""
+        mock_cursor = Mock()
+        mock_cursor.fetchone.side_effect = Exception('Erro de conexão')
+        mock_conn = Mock()
+        mock_conn.cursor.return_value = mock_cursor
+
+        with self.assertRaises(Exception):
+            dashboard.montar_dashboard(obter_conexao=Mock(return_value=mock_conn))
+
+        mock_conn.rollback.assert_called_once()
+        mock_conn.commit.assert_not_called()
+        mock_conn.close.assert_called_once()
+
+
+class TestDisjuntor(unittest.TestCase):
+    """Testes do disjuntor do banco e da reserva do catálogo"""
+
+    def erro_conexao(self):
+        return mysql_errors.DatabaseError(msg="Can't connect to MySQL server", errno=2003)
+
+    def novo(self, **kwargs):
+        opcoes = dict(minimo_chamadas=4, janela=10, tempo_aberto=0.05, sondas=2, latencia_lenta=0.5)
+        opcoes.update(kwargs)
+        return disjuntor.Disjuntor('teste', **opcoes)
+
+    def test_abre_com_falhas_e_rejeita_na_hora(self):
+        """Testa a abertura pela taxa de falhas e a rejeição sem chamar o banco"""
+        d = self.novo()
+        d.registrar(0.01)
+        d.registrar(0.01, mysql_errors.DatabaseError(msg="Duplicate entry", errno=1062))
+        d.registrar(0.01, self.erro_conexao())
+        self.assertEqual(d.estado, disjuntor.FECHADO)
+        d.registrar(1.0, self.erro_conexao())
+
+        self.assertEqual(d.estado, disjuntor.ABERTO)
+        with self.assertRaises(BancoIndisponivelError) as contexto:
+            d.permitir()
+        self.assertGreaterEqual(contexto.exception.tentar_apos, 1)
+
+    def test_abre_com_latencia(self):
+        """Testa a abertura quando as chamadas ficam lentas, mesmo sem erros"""
+        d = self.novo(limite_lentas=0.75)
+        for _ in range(4):
+            d.registrar(0.6)
+        self.assertEqual(d.estado, disjuntor.ABERTO)
+
+    def test_sql_lento_nao_abre(self):
+        """Testa que SQL demorado sem erro (executar) não conta como lentidão"""
+        d = self.novo(limite_lentas=0.75)
+        for _ in range(4):
+            d.registrar(0.6, contar_lenta=False)
+        self.assertEqual(d.estado, disjuntor.FECHADO)
+
+        for _ in range(4):
+            d.registrar(0.6, TimeoutError(), contar_lenta=False)
+        self.assertEqual(d.estado, disjuntor.ABERTO)
+
+    def test_meio_aberto_com_sondas(self):
+        """Testa que só as sondas passam no meio aberto e que elas fecham ou reabrem"""
+        d = self.novo()
+        for _ in range(4):
+            d.registrar(0.01, self.erro_conexao())
+        time.sleep(0.06)
+
+        d.permitir()
+        d.permitir()
+        self.assertEqual(d.estado, disjuntor.MEIO_ABERTO)
+        with self.assertRaises(BancoIndisponivelError):
+            d.permitir()
+
+        d.registrar(0.01, self.erro_conexao())
+        self.assertEqual(d.estado, disjuntor.ABERTO)
+
+        time.sleep(0.06)
+        d.permitir()
+        d.registrar(0.01)
+        d.permitir()
+        d.registrar(0.01)
+        self.assertEqual(d.estado, disjuntor.FECHADO)
+        d.permitir()
+
+    def test_catalogo_servido_da_reserva(self):
+        """Testa que o catálogo sai da última leitura boa, marcado como antigo"""
+        repo = ProdutoRepo(reserva=ReservaCatalogo())
+        produtos = [{'id': 1, 'nome': 'Mouse', 'estoque': 3}]
+        with patch.object(repo, '_consultar_todos', return_value=produtos):
+            repo.listar_todos()
+
+        anotacoes = disjuntor.acompanhar_dados_antigos()
+        with patch('produto.get_connection', side_effect=BancoIndisponivelError()), \
+                patch.object(repo, '_consultar_todos', side_effect=BancoIndisponivelError()):
+            self.assertEqual(repo.listar_todos(), produtos)
+            self.assertEqual(repo.buscar_por_id(1), produtos[0])
+            self.assertIsNone(repo.buscar_por_id(2))
+            with self.assertRaises(BancoIndisponivelError):
+                repo.filtrar_por_categoria('Livros')
+        self.assertIn('idade', anotacoes)
+
+    def test_reserva_limitada(self):
+        """Testa que a reserva descarta a chave usada há mais tempo ao passar do máximo"""
+        reserva = ReservaCatalogo(maximo=2)
+        reserva.guardar('todos', ['a'])
+        reserva.guardar(('categoria', 'x'), ['b'])
+        reserva.obter('todos')
+        reserva.guardar(('categoria', 'y'), ['c'])
+
+        self.assertEqual(len(reserva), 2)
+        self.assertIsNone(reserva.obter(('categoria', 'x')))
+        self.assertEqual(reserva.obter('todos')[0], ['a'])
+
+    @patch('produto.get_connection')
+    def test_outros_erros_mantem_comportamento(self, mock_get_conn):
+        """Testa que erros que não são de disponibilidade continuam devolvendo vazio"""
+        mock_get_conn.side_effect = Exception("Erro de SQL")
+        repo = ProdutoRepo(reserva=ReservaCatalogo())
+
+        self.assertEqual(repo.listar_todos(), [])
+        self.assertIsNone(repo.buscar_por_id(1))
+
+
+class BancoLocal:
+    """
+    Banco SQLite em memória no lugar do MySQL de um shard, com as tabelas e
+    a sintaxe que as vendas usam (%s vira ?, FOR UPDATE é ignorado)
+    """
+
+    def __init__(self, primeiro_id=1):
+        self.banco = sqlite3.connect(':memory:', check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+        self.banco.executescript("""
+            CREATE TABLE produtos (id INTEGER PRIMARY KEY, nome TEXT, preco REAL, categoria TEXT, estoque INT);
+            CREATE TABLE vendas (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, produto_id INT, quantidade INT, valor_total REAL,
+                data_venda TIMESTAMP DEFAULT CURRENT_TIMESTAMP, loja_id INT NOT NULL DEFAULT 1
+            );
+            CREATE TABLE vendas_pendentes (
+                chave TEXT PRIMARY KEY, shard TEXT, produto_id INT, quantidade INT, valor_total REAL,
+                loja_id INT, criada_em TIMESTAMP
+            );
+            CREATE TABLE vendas_chaves (chave TEXT PRIMARY KEY, venda_id INT, criada_em TIMESTAMP);
+            INSERT INTO produtos VALUES (1, 'Mouse', 10.0, 'Eletrônicos', 10), (2, 'Caneca', 5.0, 'Casa', 3);
+        """)
+        # Como o auto_increment_offset de cada servidor: ids distintos entre shards
+        self.banco.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('vendas', ?)", (primeiro_id - 1,))
+        self.banco.commit()
+        self.autocommit = False
+        # Chaves de vendas_pendentes travadas por "outro processo"
+        self.travadas = set()
+
+    def cursor(self, prepared=False, dictionary=False):
+        return CursorLocal(self.banco, dictionary, self.travadas)
+
+    def commit(self):
+        self.banco.commit()
+
+    def rollback(self):
+        self.banco.rollback()
+
+    def close(self):
+        pass
+
+    def consultar(self, sql):
+        return self.banco.execute(sql).fetchall()
+
+
+class CursorLocal:
+    def __init__(self, banco, dictionary, travadas=()):
+        self.banco = banco
+        self.dictionary = dictionary
+        self.travadas = travadas
+        self._linhas = []
+
+    def execute(self, sql, params=()):
+        if ' SKIP LOCKED' in sql and params and params[0] in self.travadas:
+            # Linha travada por outra conexão: SKIP LOCKED não a retorna
+            self._linhas = []
+            return
+        cursor = self.banco.execute(
+            sql.replace('%s', '?').replace(' FOR UPDATE', '').replace(' SKIP LOCKED', ''), params
+        )
+        self.lastrowid = cursor.lastrowid
+        self.column_names = tuple(coluna[0] for coluna in cursor.description or ())
+        self._linhas = cursor.fetchall()
+
+    def fetchall(self):
+        linhas, self._linhas = self._linhas, []
+        if self.dictionary:
+            return [dict(zip(self.column_names, linha)) for linha in linhas]
+        return linhas
+
+    def fetchone(self):
+        linhas = self.fetchall()
+        return linhas[0] if linhas else None
+
+    def fetchmany(self, tamanho):
+        linhas, self._linhas = self._linhas[:tamanho], self._linhas[tamanho:]
+        return linhas
+
+
+class TestShards(unittest.TestCase):
+    """Testes das vendas fragmentadas por loja, com um banco local por shard"""
+
+    def setUp(self):
+        self.roteador = shards.RoteadorShards(
+            {'sul': {'host': 'sul'}, 'norte': {'host': 'norte'}},
+            [(201, 300, 'norte'), (101, 200, 'sul')]
+        )
+        self.addCleanup(self.roteador.encerrar)
+        self.bancos = {'principal': BancoLocal(1), 'sul': BancoLocal(1001), 'norte': BancoLocal(2001)}
+
+        self.conectar = {}
+        for nome in ('sul', 'norte'):
+            patcher = patch.object(self.roteador.shards[nome], 'conectar', return_value=self.bancos[nome])
+            self.conectar[nome] = patcher.start()
+            self.addCleanup(patcher.stop)
+        for alvo, valor in (('venda.get_connection', self.bancos['principal']), ('venda.publicar', None),
+                            ('venda.notificar', None)):
+            patcher = patch(alvo, return_value=valor)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.repo = VendaRepo(roteador=self.roteador)
+
+    def estoque(self, produto_id):
+        return self.bancos['principal'].consultar(f"SELECT estoque FROM produtos WHERE id = {produto_id}")[0][0]
+
+    def test_mapa_de_lojas(self):
+        """Testa o shard de cada loja e a validação da configuração"""
+        self.assertEqual(self.roteador.shard_da_loja(150).nome, 'sul')
+        self.assertEqual(self.roteador.shard_da_loja(201).nome, 'norte')
+        self.assertTrue(self.roteador.shard_da_loja(1).principal)
+        self.assertTrue(self.roteador.shard_da_loja(301).principal)
+
+        configs = shards._config_shards('sul=10.0.0.2, norte=db3:3307/loja_norte')
+        self.assertEqual(configs['norte']['port'], 3307)
+        self.assertEqual(configs['norte']['database'], 'loja_norte')
+        self.assertEqual(configs['sul']['host'], '10.0.0.2')
+        self.assertEqual(shards._faixas_lojas('1-100=sul,101=norte'), [(1, 100, 'sul'), (101, 101, 'norte')])
+
+        with self.assertRaises(ValueError):
+            shards.RoteadorShards({'sul': {}}, [(1, 100, 'sul'), (50, 150, 'sul')])
+        with self.assertRaises(ValueError):
+            shards.RoteadorShards({}, [(1, 100, 'leste')])
+
+    def test_venda_gravada_no_shard_da_loja(self):
+        """Testa que a venda vai para o shard da loja e o estoque baixa no catálogo"""
+        venda_sul, valor = self.repo.registrar_venda(1, 2, loja_id=150)
+        venda_principal, _ = self.repo.registrar_venda(1, 1)
+
+        self.assertEqual(valor, 20.0)
+        self.assertEqual(self.bancos['sul'].consultar("SELECT id, loja_id, quantidade FROM vendas"),
+                         [(venda_sul, 150, 2)])
+        self.assertEqual(self.bancos['principal'].consultar("SELECT id, loja_id FROM vendas"),
+                         [(venda_principal, shards.LOJA_PADRAO)])
+        self.assertEqual(self.bancos['norte'].consultar("SELECT COUNT(*) FROM vendas"), [(0,)])
+        self.assertEqual(self.estoque(1), 7)
+
+    def test_falha_no_shard_devolve_estoque(self):
+        """Testa que o estoque baixado volta quando a venda não é gravada no shard"""
+        self.conectar['norte'].side_effect = BancoIndisponivelError()
+
+        with self.assertRaises(BancoIndisponivelError):
+            self.repo.registrar_venda(2, 2, loja_id=250)
+        self.assertEqual(self.estoque(2), 3)
+
+        with self.assertRaises(EstoqueInsuficienteError):
+            self.repo.registrar_venda(2, 5, loja_id=150)
+        self.assertEqual(self.bancos['sul'].consultar("SELECT COUNT(*) FROM vendas"), [(0,)])
+
+    def test_commit_ambiguo_no_shard_nao_duplica(self):
+        """Testa que a venda confirmada no shard com erro na resposta não é desfeita nem repetida"""
+        banco = self.bancos['sul']
+        commit = banco.commit
+
+        def commit_perdido():
+            commit()
+            banco.commit = commit
+            raise mysql_errors.OperationalError(msg="Lost connection", errno=2013)
+        banco.commit = commit_perdido
+
+        venda_id, _ = self.repo.registrar_venda(1, 2, loja_id=150)
+
+        self.assertEqual(banco.consultar("SELECT id FROM vendas"), [(venda_id,)])
+        self.assertEqual(self.estoque(1), 8)
+        self.assertEqual(self.bancos['principal'].consultar("SELECT COUNT(*) FROM vendas_pendentes"), [(0,)])
+
+    def test_nova_tentativa_com_a_mesma_chave(self):
+        """Testa que a tentativa repetida pela requisição (mesma chave) não baixa o estoque de novo"""
+        sessao = Mock()
+        self.conectar['sul'].side_effect = [BancoIndisponivelError(), self.bancos['sul']]
+        with patch.object(self.repo, '_fechar_pendente', side_effect=Exception("Principal fora")):
+            with self.assertRaises(BancoIndisponivelError):
+                self.repo.registrar_venda(1, 2, sessao=sessao, loja_id=150, chave='chave-1')
+        self.assertEqual(self.estoque(1), 8)
+
+        venda_id, valor = self.repo.registrar_venda(1, 2, sessao=sessao, loja_id=150, chave='chave-1')
+
+        self.assertEqual(valor, 20.0)
+        self.assertEqual(self.estoque(1), 8)
+        self.assertEqual(self.bancos['sul'].consultar("SELECT venda_id FROM vendas_chaves"), [(venda_id,)])
+        self.assertEqual(self.bancos['principal'].consultar("SELECT COUNT(*) FROM vendas_pendentes"), [(0,)])
+
+    def test_reconciliar_vendas_pendentes(self):
+        """Testa que a inicialização conclui as vendas gravadas e devolve o estoque das outras"""
+        principal = self.bancos['principal']
+        antiga = datetime(2024, 3, 1)
+        for chave, produto_id in (('gravada', 1), ('perdida', 2)):
+            principal.banco.execute(
+                "INSERT INTO vendas_pendentes VALUES (?, 'sul', ?, 1, 10.0, 150, ?)", (chave, produto_id, antiga)
+            )
+        principal.banco.execute("INSERT INTO vendas_pendentes VALUES ('recente', 'sul', 1, 1, 10.0, 150, ?)",
+                                (datetime.now(),))
+        # Venda antiga ainda em andamento: o dono mantém a pendente travada
+        principal.banco.execute("INSERT INTO vendas_pendentes VALUES ('lenta', 'sul', 2, 1, 5.0, 150, ?)",
+                                (antiga,))
+        principal.travadas.add('lenta')
+        self.bancos['sul'].banco.execute("INSERT INTO vendas_chaves VALUES ('gravada', 1001, ?)", (antiga,))
+
+        resultado = self.repo.reconciliar_vendas_pendentes(idade=60)
+
+        self.assertEqual(resultado, {'concluidas': 1, 'devolvidas': 1, 'em_andamento': 1, 'erros': 0})
+        self.assertEqual(self.estoque(1), 10)
+        self.assertEqual(self.estoque(2), 4)
+        self.assertEqual(sorted(principal.consultar("SELECT chave FROM vendas_pendentes")),
+                         [('lenta',), ('recente',)])
+
+    def test_sql_no_shard_conta_no_disjuntor_dele(self):
+        """Testa que erros do SQL numa conexão do shard não contam no disjuntor do principal"""
+        shard = self.roteador.shards['sul']
+        fisica = MagicMock()
+        fisica.cursor.return_value.execute.side_effect = mysql_errors.OperationalError(
+            msg="Lost connection", errno=2013
+        )
+        conn = shard.pool.embrulhar(fisica)
+
+        with patch.object(shard.disjuntor, 'registrar') as no_shard, \
+                patch.object(disjuntor.disjuntor_banco, 'registrar') as no_principal:
+            with self.assertRaises(mysql_errors.OperationalError):
+                preparados.executar(conn, 'SELECT 1')
+
+        no_shard.assert_called_once()
+        no_principal.assert_not_called()
+
+    def test_leitura_por_loja_usa_um_shard(self):
+        """Testa que a leitura de uma loja só consulta o shard dela"""
+        self.repo.registrar_venda(1, 1, loja_id=150)
+        self.repo.registrar_venda(2, 1, loja_id=160)
+        self.repo.registrar_venda(1, 3, loja_id=250)
+        self.conectar['norte'].reset_mock()
+
+        vendas = self.repo.listar_vendas(loja_id=160)
+
+        self.assertEqual([(v['loja_id'], v['produto_nome']) for v in vendas], [(160, 'Caneca')])
+        self.conectar['norte'].assert_not_called()
+
+    def test_leitura_geral_intercala_os_shards(self):
+        """Testa a listagem de todas as lojas, na ordem de id, e os agregados somados"""
+        for loja_id in (1, 150, 250, 150, 1):
+            self.repo.registrar_venda(1, 1, loja_id=loja_id)
+
+        vendas = self.repo.listar_vendas()
+        compactas = self.repo.listar_vendas(compacto=True)
+        recentes = self.repo.listar_recentes(2)
+        valores = self.repo.listar_vendas(campos=('valor_total',))
+
+        self.assertEqual([v['venda_id'] for v in vendas], [2001, 1002, 1001, 2, 1])
+        self.assertEqual([v['venda_id'] for v in compactas], [2001, 1002, 1001, 2, 1])
+        self.assertEqual([v['venda_id'] for v in recentes], [2001, 1002])
+        self.assertEqual(sum(v['valor_total'] for v in valores), 50.0)
+        # Os ids só crescem dentro de cada shard: sem loja não há um since_id único
+        with self.assertRaises(ValueError):
+            self.repo.vendas_desde(0)
+
+    def test_soma_das_parciais(self):
+        """Testa a soma das séries e dos totais do dashboard vindos de cada shard"""
+        serie = _somar_series([
+            [(10, Decimal('2'), Decimal('20.00')), (12, Decimal('1'), Decimal('5.00'))],
+            [(11, Decimal('4'), Decimal('40.00')), (12, Decimal('1'), Decimal('10.00'))],
+        ])
+        self.assertEqual(serie, [(10, 2, Decimal('20.00')), (11, 4, Decimal('40.00')), (12, 2, Decimal('15.00'))])
+
+        vendas, top = dashboard._somar_vendas_dos_shards([
+            (3, Decimal('30.00'), [(1, 'Mouse', Decimal('3'))]),
+            (2, Decimal('15.00'), [(2, 'Caneca', Decimal('2')), (1, 'Mouse', Decimal('1'))]),
+        ], top=1)
+        self.assertEqual(vendas, (5, Decimal('45.00')))
+        self.assertEqual(top, [{"id": 1, "nome": "Mouse", "total_vendido": 4}])
+
+
 class TestIntegration(unittest.TestCase):
     """Testes de integração (requerem banco de dados real)"""
     
@@ -441,10 +2562,76 @@ def suite():
     
     # Adiciona testes de Database
     test_suite.addTests(loader.loadTestsFromTestCase(TestDatabase))
+    test_suite.addTests(loader.loadTestsFromTestCase(TestRoteamentoLeitura))
+    test_suite.addTests(loader.loadTestsFromTestCase(TestPoolConexoes))
+    test_suite.addTests(loader.loadTestsFromTestCase(TestPreparados))
     
     # Adiciona testes de Validações
     test_suite.addTests(loader.loadTestsFromTestCase(TestValidacoes))
     
+    # Adiciona testes do barramento de eventos
+    test_suite.addTests(loader.loadTestsFromTestCase(TestEventos))
+    
+    # Adiciona testes de serialização
+    test_suite.addTests(loader.loadTestsFromTestCase(TestSerializacao))
+    
+    # Adiciona testes do formato colunar
+    test_suite.addTests(loader.loadTestsFromTestCase(TestColunar))
+    
+    # Adiciona testes do motor de relatórios
+    test_suite.addTests(loader.loadTestsFromTestCase(TestRelatorios))
+    
+    # Adiciona testes de cache e inicialização
+    test_suite.addTests(loader.loadTestsFromTestCase(TestInicializacao))
+    
+    # Adiciona testes de invalidação entre processos
+    test_suite.addTests(loader.loadTestsFromTestCase(TestInvalidacao))
+    
+    # Adiciona testes de particionamento e arquivamento
+    test_suite.addTests(loader.loadTestsFromTestCase(TestManutencao))
+    
+    # Adiciona testes de atualização em lote
+    test_suite.addTests(loader.loadTestsFromTestCase(TestProdutoLote))
+    
+    # Adiciona testes da sessão por requisição
+    test_suite.addTests(loader.loadTestsFromTestCase(TestSessao))
+    
+    # Adiciona testes das novas tentativas de transação
+    test_suite.addTests(loader.loadTestsFromTestCase(TestRetry))
+    
+    # Adiciona testes do cache dos relatórios
+    test_suite.addTests(loader.loadTestsFromTestCase(TestCacheRelatorios))
+    
+    # Adiciona testes do limite adaptativo de concorrência
+    test_suite.addTests(loader.loadTestsFromTestCase(TestLimitador))
+    
+    # Adiciona testes do rastreamento das requisições
+    test_suite.addTests(loader.loadTestsFromTestCase(TestRastreamento))
+    
+    # Adiciona testes do perfil sob demanda
+    test_suite.addTests(loader.loadTestsFromTestCase(TestPerfil))
+    
+    # Adiciona testes das linhas compactas
+    test_suite.addTests(loader.loadTestsFromTestCase(TestRegistros))
+    
+    # Adiciona testes da fila de tarefas
+    test_suite.addTests(loader.loadTestsFromTestCase(TestTarefas))
+    
+    # Adiciona testes dos feeds de alterações
+    test_suite.addTests(loader.loadTestsFromTestCase(TestFeedAlteracoes))
+    
+    # Adiciona testes da projeção de colunas
+    test_suite.addTests(loader.loadTestsFromTestCase(TestCampos))
+    
+    # Adiciona testes do painel agregado
+    test_suite.addTests(loader.loadTestsFromTestCase(TestDashboard))
+    
+    # Adiciona testes do disjuntor do banco
+    test_suite.addTests(loader.loadTestsFromTestCase(TestDisjuntor))
+    
+    # Adiciona testes das vendas fragmentadas por loja
+    test_suite.addTests(loader.loadTestsFromTestCase(TestShards))
+    
     return test_suite
 
 
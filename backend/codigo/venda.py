@@ -1,92 +1,456 @@
 # venda.py (Versão corrigida para compatibilidade com API)
 from database import get_connection
 from exceptions import ProdutoNaoEncontradoError, EstoqueInsuficienteError
+from eventos import publicar
+from invalidacao import notificar
+from preparados import executar
+from sessao import abrir, apos_commit, limitar_commit
+from retry import com_retentativa
+from rastreamento import rastrear_classe
+from registros import ler_registros
+from feed import MARGEM_FEED, linhas_confirmadas
+from shards import LOJA_PADRAO, roteador_shards
+from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import chain
+from operator import itemgetter
+import heapq
+import os
+import uuid
 
+# Início do período de cada granularidade, usado no GROUP BY de serie_por_periodo
+INICIO_PERIODO = {
+    'hora': "DATE_FORMAT(v.data_venda, '%Y-%m-%d %H:00:00')",
+    'dia': "DATE(v.data_venda)",
+    'semana': "DATE(v.data_venda) - INTERVAL WEEKDAY(v.data_venda) DAY",
+    'mes': "DATE_FORMAT(v.data_venda, '%Y-%m-01')",
+}
+
+# Com incluir_arquivo=True as consultas leem a view vendas_todas, que junta
+# vendas e vendas_arquivo (partições antigas movidas por manutencao.py)
+TABELA_VENDAS = {False: 'vendas', True: 'vendas_todas'}
+
+# Intervalo aberto em data_venda: usa o índice e permite a poda de partições
+# (DATE(v.data_venda) BETWEEN ... obrigava a ler todas)
+FILTRO_PERIODO = " WHERE v.data_venda >= DATE(%s) AND v.data_venda < DATE(%s) + INTERVAL 1 DAY"
+
+# Leituras de uma loja só (índice idx_vendas_loja_data)
+FILTRO_LOJA = " v.loja_id = %s"
+
+
+# Colunas do JOIN com produtos, iguais em todas as vendas do mesmo produto
+COLUNAS_PRODUTO = ('produto_nome', 'produto_preco')
+
+
+# Expressão de cada campo que pode ser pedido em fields= (campos.py)
+COLUNAS_VENDA = {
+    'venda_id': 'v.id AS venda_id',
+    'produto_id': 'v.produto_id',
+    'quantidade': 'v.quantidade',
+    'valor_total': 'v.valor_total',
+    'data_venda': 'v.data_venda',
+    'loja_id': 'v.loja_id',
+    'produto_nome': 'p.nome AS produto_nome',
+    'produto_preco': 'p.preco AS produto_preco',
+}
+CAMPOS_VENDA = tuple(COLUNAS_VENDA)
+
+
+@lru_cache(maxsize=None)
+def _sql_vendas(por_periodo, incluir_arquivo=False, campos=None, por_loja=False):
+    """
+    SELECT das vendas com nome e preço do produto, com ou sem filtro de
+    período e de loja. Com `campos` (tupla de CAMPOS_VENDA) lê só essas
+    colunas, e sem produto_nome/produto_preco não faz o JOIN com produtos.
+    """
+    campos = campos or CAMPOS_VENDA
+    colunas = ',\n            '.join(COLUNAS_VENDA[campo] for campo in campos)
+    sql = f"""
+        SELECT 
+            {colunas}
+        FROM {TABELA_VENDAS[incluir_arquivo]} v
+    """
+    if any(campo in COLUNAS_PRODUTO for campo in campos):
+        sql += "    JOIN produtos p ON p.id = v.produto_id\n    "
+    if por_periodo:
+        sql += FILTRO_PERIODO
+    if por_loja:
+        sql += (" AND" if por_periodo else " WHERE") + FILTRO_LOJA
+    if por_periodo:
+        return sql + " ORDER BY v.data_venda DESC"
+    return sql + " ORDER BY v.id DESC"
+
+
+SQL_VENDAS_TODAS = _sql_vendas(False)
+SQL_VENDAS_PERIODO = _sql_vendas(True)
+SQL_VENDAS_RECENTES = SQL_VENDAS_TODAS + " LIMIT %s"
+SQL_VENDAS_RECENTES_LOJA = _sql_vendas(False, por_loja=True) + " LIMIT %s"
+SQL_VENDA_POR_ID = SQL_VENDAS_TODAS.replace(" ORDER BY v.id DESC", " WHERE v.id = %s")
+
+
+@lru_cache(maxsize=None)
+def _sql_serie(granularidade, por_categoria, incluir_arquivo=False, por_loja=False):
+    """SQL de serie_por_periodo, montado uma vez por combinação (reuso do prepared statement)"""
+    sql = f"""
+        SELECT 
+            TIMESTAMPDIFF(HOUR, '1970-01-01 00:00:00', {INICIO_PERIODO[granularidade]}) AS hora,
+            SUM(v.quantidade) AS quantidade,
+            SUM(v.valor_total) AS receita
+        FROM {TABELA_VENDAS[incluir_arquivo]} v
+    """
+    if por_categoria:
+        sql += " JOIN produtos p ON p.id = v.produto_id"
+    sql += " WHERE v.data_venda >= %s AND v.data_venda < %s"
+    if por_loja:
+        sql += " AND" + FILTRO_LOJA
+    if por_categoria:
+        sql += " AND p.categoria = %s"
+    return sql + " GROUP BY hora ORDER BY hora"
+
+
+# Feed incremental (GET /api/vendas/changes): busca pela chave primária a
+# partir do último id recebido, então o custo depende só das vendas novas.
+# LEFT JOIN para não pular vendas cujo produto não existe mais (sem FK depois
+# de manutencao.py particionar)
+SQL_VENDAS_DESDE = """
+    SELECT 
+        v.id AS venda_id,
+        v.produto_id,
+        v.quantidade,
+        v.valor_total,
+        v.data_venda,
+        v.loja_id,
+        p.nome AS produto_nome,
+        p.preco AS produto_preco,
+        v.data_venda >= NOW() - INTERVAL %s SECOND AS recente
+    FROM vendas v
+    LEFT JOIN produtos p ON p.id = v.produto_id
+    WHERE v.id > %s
+    ORDER BY v.id
+    LIMIT %s
+"""
+# Os ids só crescem dentro de um banco: com vários shards o feed é por loja
+SQL_VENDAS_DESDE_LOJA = SQL_VENDAS_DESDE.replace("WHERE v.id > %s", "WHERE v.id > %s AND" + FILTRO_LOJA)
+
+SQL_PRODUTO_VENDA = "SELECT id, nome, preco, estoque FROM produtos WHERE id = %s FOR UPDATE"
+
+SQL_INSERIR_VENDA = """
+    INSERT INTO vendas (produto_id, quantidade, valor_total, loja_id) 
+    VALUES (%s, %s, %s, %s)
+"""
+
+SQL_BAIXAR_ESTOQUE = """
+    UPDATE produtos SET estoque = estoque - %s WHERE id = %s
+"""
+
+SQL_DEVOLVER_ESTOQUE = "UPDATE produtos SET estoque = estoque + %s WHERE id = %s"
+
+# Vendas em shard (_registrar_venda_em_shard): a pendente fica no principal,
+# com a baixa do estoque, até a venda ser confirmada no shard; a chave vai
+# para vendas_chaves do shard na mesma transação da venda
+SQL_VENDA_PENDENTE = "SELECT valor_total FROM vendas_pendentes WHERE chave = %s FOR UPDATE"
+SQL_INSERIR_PENDENTE = """
+    INSERT INTO vendas_pendentes (chave, shard, produto_id, quantidade, valor_total, loja_id, criada_em)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+"""
+SQL_TRAVAR_PENDENTE_LIVRE = "SELECT chave FROM vendas_pendentes WHERE chave = %s FOR UPDATE SKIP LOCKED"
+SQL_REMOVER_PENDENTE = "DELETE FROM vendas_pendentes WHERE chave = %s"
+SQL_PENDENTES_ANTIGAS = """
+    SELECT chave, shard, produto_id, quantidade FROM vendas_pendentes
+    WHERE criada_em < %s ORDER BY criada_em
+"""
+SQL_VENDA_DA_CHAVE = "SELECT venda_id FROM vendas_chaves WHERE chave = %s"
+SQL_INSERIR_CHAVE = "INSERT INTO vendas_chaves (chave, venda_id, criada_em) VALUES (%s, %s, %s)"
+SQL_EXPIRAR_CHAVES = "DELETE FROM vendas_chaves WHERE criada_em < %s"
+
+# A reconciliação só olha pendentes mais antigas que isso; entre elas, pula
+# as travadas pelo processo que ainda está gravando a venda
+IDADE_VENDA_PENDENTE = int(os.getenv('VENDAS_PENDENTES_IDADE', 60))
+# Dias que as chaves ficam nos shards (bem mais que qualquer pendente)
+RETENCAO_CHAVES = int(os.getenv('VENDAS_CHAVES_RETENCAO_DIAS', 7))
+
+def _ler_vendas(conn, sql, params=None, compacto=False):
+    """
+    Dicts com data_venda já como texto ou, com compacto=True, linhas
+    compactas (registros.py) com data_venda datetime, formatada só na
+    serialização
+    """
+    if compacto:
+        return ler_registros(executar(conn, sql, params), repetidos=COLUNAS_PRODUTO)
+
+    vendas = executar(conn, sql, params, dictionary=True).fetchall()
+
+    # Converter datetime para string
+    for venda in vendas:
+        if venda.get('data_venda'):
+            venda['data_venda'] = venda['data_venda'].strftime('%Y-%m-%d %H:%M:%S')
+
+    return vendas
+
+
+def _mesclar(partes, chave):
+    """
+    Junta as listas de cada shard, todas em ordem decrescente de `chave`,
+    mantendo a ordem; sem a chave nas linhas (fields=) só concatena
+    """
+    partes = [parte for parte in partes if parte]
+    if len(partes) <= 1:
+        return partes[0] if partes else []
+    if chave not in partes[0][0].keys():
+        return list(chain.from_iterable(partes))
+    return list(heapq.merge(*partes, key=itemgetter(chave), reverse=True))
+
+
+def _mesclar_colunar(partes, chave):
+    """Como _mesclar, para os resultados (colunas, linhas) do formato colunar"""
+    if len(partes) == 1:
+        return partes[0]
+    colunas = partes[0][0]
+    linhas = [linhas for _, linhas in partes]
+    if chave not in colunas:
+        return colunas, list(chain.from_iterable(linhas))
+    return colunas, list(heapq.merge(*linhas, key=itemgetter(colunas.index(chave)), reverse=True))
+
+
+def _somar_series(partes):
+    """Soma por período as séries parciais (hora, quantidade, receita) de cada shard"""
+    if len(partes) == 1:
+        return partes[0]
+    totais = {}
+    for linhas in partes:
+        for hora, quantidade, receita in linhas:
+            quantidade_total, receita_total = totais.get(hora, (0, 0))
+            totais[hora] = (quantidade_total + quantidade, receita_total + receita)
+    return [(hora, quantidade, receita) for hora, (quantidade, receita) in sorted(totais.items())]
+
+
+def nova_chave_venda():
+    """Chave de idempotência de uma venda (uma por requisição, não por tentativa)"""
+    return uuid.uuid4().hex
+
+
+@rastrear_classe
 class VendaRepo:
+    def __init__(self, cache_catalogo=None, roteador=None):
+        # Cache do catálogo a invalidar quando uma venda muda o estoque
+        self.cache_catalogo = cache_catalogo
+        # Mapa loja -> shard (shards.py); sem DB_SHARDS só há o principal
+        self.roteador = roteador or roteador_shards
+
+    def _ler(self, sessao, ler, loja_id=None):
+        """
+        ler(conn) no shard da loja ou, sem loja, em todos os shards em
+        paralelo. Retorna os resultados parciais, um por shard.
+        """
+        if loja_id is not None:
+            return [self._ler_shard(self.roteador.shard_da_loja(loja_id), sessao, ler)]
+        return self.roteador.espalhar(lambda shard: self._ler_shard(shard, sessao, ler))
 
-    def listar_vendas(self):
+    def _ler_shard(self, shard, sessao, ler):
         conn = None
         try:
-            conn = get_connection()
-            cursor = conn.cursor(dictionary=True)
-
-            sql = """
-                SELECT 
-                    v.id AS venda_id,
-                    v.produto_id,
-                    v.quantidade,
-                    v.valor_total,
-                    v.data_venda,
-                    p.nome AS produto_nome,
-                    p.preco AS produto_preco
-                FROM vendas v
-                JOIN produtos p ON p.id = v.produto_id
-                ORDER BY v.id DESC
-            """
-
-            cursor.execute(sql)
-            vendas = cursor.fetchall()
-            
-            # Converter datetime para string
-            for venda in vendas:
-                if venda.get('data_venda'):
-                    venda['data_venda'] = venda['data_venda'].strftime('%Y-%m-%d %H:%M:%S')
-            
-            return vendas
+            # O principal usa a conexão da sessão da requisição
+            if shard.principal:
+                conn = abrir(sessao, get_connection, leitura=True)
+            else:
+                conn = shard.conectar(leitura=True)
+            return ler(conn)
+        finally:
+            if conn:
+                conn.close()
+
+    def listar_vendas(self, sessao=None, compacto=False, campos=None, loja_id=None):
+        """
+        Todas as vendas ou as da loja; `campos` (tupla de CAMPOS_VENDA)
+        limita as colunas lidas
+        """
+        try:
+            sql = _sql_vendas(False, campos=campos, por_loja=loja_id is not None)
+            params = None if loja_id is None else (loja_id,)
+            partes = self._ler(sessao, lambda conn: _ler_vendas(conn, sql, params, compacto), loja_id)
+            return _mesclar(partes, 'venda_id')
 
         except Exception as e:
             print("Erro ao listar vendas:", e)
             raise e
 
-        finally:
-            if conn:
-                conn.close()
+    def buscar_por_id(self, venda_id, sessao=None, loja_id=LOJA_PADRAO):
+        """A venda pelo id, no shard da loja, ou None"""
+        try:
+            partes = self._ler(sessao, lambda conn: _ler_vendas(conn, SQL_VENDA_POR_ID, (venda_id,)), loja_id)
+            return next(iter(partes[0]), None)
 
-    def buscar_por_periodo(self, data_inicio, data_fim):
-        """Busca vendas em um período específico"""
-        conn = None
+        except Exception as e:
+            print("Erro ao buscar venda:", e)
+            raise e
+
+    def listar_recentes(self, limite=10, sessao=None, loja_id=None):
+        """As `limite` vendas mais recentes (maiores ids)"""
         try:
-            conn = get_connection()
-            cursor = conn.cursor(dictionary=True)
-
-            sql = """
-                SELECT 
-                    v.id AS venda_id,
-                    v.produto_id,
-                    v.quantidade,
-                    v.valor_total,
-                    v.data_venda,
-                    p.nome AS produto_nome,
-                    p.preco AS produto_preco
-                FROM vendas v
-                JOIN produtos p ON p.id = v.produto_id
-                WHERE DATE(v.data_venda) BETWEEN %s AND %s
-                ORDER BY v.data_venda DESC
-            """
-
-            cursor.execute(sql, (data_inicio, data_fim))
-            vendas = cursor.fetchall()
-            
-            # Converter datetime para string
+            if loja_id is None:
+                sql, params = SQL_VENDAS_RECENTES, (limite,)
+            else:
+                sql, params = SQL_VENDAS_RECENTES_LOJA, (loja_id, limite)
+            partes = self._ler(sessao, lambda conn: _ler_vendas(conn, sql, params), loja_id)
+            return _mesclar(partes, 'venda_id')[:limite]
+
+        except Exception as e:
+            print("Erro ao listar vendas recentes:", e)
+            raise e
+
+    def buscar_por_periodo(self, data_inicio, data_fim, incluir_arquivo=False, sessao=None, compacto=False,
+                           campos=None, loja_id=None):
+        """Busca vendas em um período específico (datas inclusivas)"""
+        try:
+            sql = _sql_vendas(True, incluir_arquivo, campos, loja_id is not None)
+            params = (data_inicio, data_fim) if loja_id is None else (data_inicio, data_fim, loja_id)
+            partes = self._ler(sessao, lambda conn: _ler_vendas(conn, sql, params, compacto), loja_id)
+            return _mesclar(partes, 'data_venda')
+
+        except Exception as e:
+            print("Erro ao buscar vendas por período:", e)
+            raise e
+
+    def listar_vendas_colunar(self, data_inicio=None, data_fim=None, incluir_arquivo=False, sessao=None,
+                              campos=None, loja_id=None):
+        """
+        Retorna (colunas, linhas) com as linhas como tuplas, sem montar um
+        dict por linha. Usado pelo formato colunar de /api/vendas.
+        """
+        por_periodo = bool(data_inicio and data_fim)
+        sql = _sql_vendas(por_periodo, incluir_arquivo, campos, loja_id is not None)
+        params = (data_inicio, data_fim) if por_periodo else ()
+        if loja_id is not None:
+            params += (loja_id,)
+
+        def ler(conn):
+            cursor = executar(conn, sql, params or None)
+            linhas = cursor.fetchall()
+            return list(cursor.column_names), linhas
+
+        try:
+            partes = self._ler(sessao, ler, loja_id)
+            return _mesclar_colunar(partes, 'data_venda' if por_periodo else 'venda_id')
+
+        except Exception as e:
+            print("Erro ao listar vendas (colunar):", e)
+            raise e
+
+    def serie_por_periodo(self, granularidade, data_inicio, data_fim, categoria=None, incluir_arquivo=False,
+                          sessao=None, loja_id=None):
+        """
+        Agrega as vendas por período entre as datas (inclusivas).
+        Retorna tuplas (hora_inicio_periodo, quantidade, receita), com a hora
+        contada desde 1970. O filtro usa intervalo aberto em data_venda para
+        aproveitar o índice idx_vendas_data_venda. Sem loja, cada shard
+        agrega as próprias vendas e as séries parciais são somadas.
+        """
+        if granularidade not in INICIO_PERIODO:
+            raise ValueError(f"Granularidade inválida: {granularidade}")
+
+        sql = _sql_serie(granularidade, categoria is not None, incluir_arquivo, loja_id is not None)
+        params = (data_inicio, data_fim + timedelta(days=1))
+        if loja_id is not None:
+            params += (loja_id,)
+        if categoria is not None:
+            params += (categoria,)
+
+        try:
+            partes = self._ler(sessao, lambda conn: executar(conn, sql, params).fetchall(), loja_id)
+            return _somar_series(partes)
+
+        except Exception as e:
+            print("Erro ao agregar vendas por período:", e)
+            raise e
+
+    def vendas_desde(self, desde_id, limite=1000, sessao=None, loja_id=None):
+        """
+        Vendas com id maior que desde_id, em ordem de id. Retorna
+        (vendas, ultimo_id, tem_mais); ultimo_id é o desde_id da próxima chamada.
+        """
+        if loja_id is None and self.roteador.fragmentado:
+            raise ValueError("Com as vendas em vários shards o feed é por loja: informe loja_id")
+
+        if loja_id is None:
+            sql, params = SQL_VENDAS_DESDE, (MARGEM_FEED, desde_id, limite + 1)
+        else:
+            sql, params = SQL_VENDAS_DESDE_LOJA, (MARGEM_FEED, desde_id, loja_id, limite + 1)
+
+        try:
+            linhas, = self._ler(sessao, lambda conn: executar(conn, sql, params, dictionary=True).fetchall(), loja_id)
+            vendas, tem_mais = linhas_confirmadas(linhas, limite)
+
             for venda in vendas:
                 if venda.get('data_venda'):
                     venda['data_venda'] = venda['data_venda'].strftime('%Y-%m-%d %H:%M:%S')
-            
-            return vendas
+
+            ultimo_id = vendas[-1]['venda_id'] if vendas else desde_id
+            return vendas, ultimo_id, tem_mais
 
         except Exception as e:
-            print("Erro ao buscar vendas por período:", e)
+            print("Erro ao buscar vendas novas:", e)
             raise e
 
-        finally:
-            if conn:
-                conn.close()
-
-    def registrar_venda(self, produto_id, quantidade):
+    def registrar_venda(self, produto_id, quantidade, sessao=None, loja_id=None, chave=None):
         """
         Registra uma venda e retorna (venda_id, valor_total)
         IMPORTANTE: Retorna tupla para compatibilidade com api.py
+
+        Sem sessão, a transação é repetida em deadlock/lock wait timeout. Com
+        sessão, quem controla a requisição repete a unidade de trabalho inteira
+        e deve passar a mesma `chave` (nova_chave_venda) em todas as
+        tentativas, para a venda em shard não ser gravada duas vezes.
+        Vendas sem loja_id são da LOJA_PADRAO.
         """
+        loja_id = LOJA_PADRAO if loja_id is None else loja_id
+        shard = self.roteador.shard_da_loja(loja_id)
+        if shard.principal:
+            registrar = lambda: self._registrar_venda(produto_id, quantidade, sessao, loja_id)
+        else:
+            # Sem sessão as tentativas são repetidas aqui, todas com esta chave
+            chave = chave or nova_chave_venda()
+            registrar = lambda: self._registrar_venda_em_shard(produto_id, quantidade, loja_id, shard, chave)
+
+        if sessao is not None:
+            return registrar()
+        return com_retentativa(registrar, 'registrar_venda')
+
+    def _produto_para_venda(self, conn, produto_id, quantidade):
+        """Produto travado (FOR UPDATE) com estoque conferido"""
+        produto = executar(conn, SQL_PRODUTO_VENDA, (produto_id,), dictionary=True).fetchone()
+
+        if not produto:
+            raise ProdutoNaoEncontradoError(
+                f"Produto ID {produto_id} não encontrado."
+            )
+
+        if produto['estoque'] < quantidade:
+            raise EstoqueInsuficienteError(
+                f"Estoque insuficiente. Disponível: {produto['estoque']}, Solicitado: {quantidade}"
+            )
+        return produto
+
+    def _notificar_venda(self, venda_id, produto, quantidade, valor_total, loja_id):
+        """Invalida caches e notifica os clientes do stream de eventos"""
+        if self.cache_catalogo is not None:
+            self.cache_catalogo.invalidar()
+        notificar('catalogo', 'vendas')
+
+        publicar('venda_criada', {
+            'venda_id': venda_id,
+            'produto_id': produto['id'],
+            'produto_nome': produto.get('nome'),
+            'quantidade': quantidade,
+            'valor_total': valor_total,
+            'loja_id': loja_id,
+            'data_venda': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        })
+        publicar('estoque_alterado', {
+            'produto_id': produto['id'],
+            'estoque': produto['estoque'] - quantidade
+        })
+
+    def _registrar_venda(self, produto_id, quantidade, sessao=None, loja_id=LOJA_PADRAO):
         if quantidade <= 0:
             raise ValueError("A quantidade deve ser maior que zero.")
 
@@ -95,53 +459,40 @@ class VendaRepo:
         venda_id = None
         
         try:
-            conn = get_connection()
+            conn = abrir(sessao, get_connection)
             conn.autocommit = False 
-            cursor = conn.cursor(dictionary=True)
             
-            # 1. Buscar produto com lock
-            sql_produto = "SELECT id, preco, estoque FROM produtos WHERE id = %s FOR UPDATE"
-            cursor.execute(sql_produto, (produto_id,))
-            produto = cursor.fetchone()
-
-            if not produto:
-                raise ProdutoNaoEncontradoError(
-                    f"Produto ID {produto_id} não encontrado."
-                )
-            
-            # 2. Verificar estoque
-            if produto['estoque'] < quantidade:
-                raise EstoqueInsuficienteError(
-                    f"Estoque insuficiente. Disponível: {produto['estoque']}, Solicitado: {quantidade}"
-                )
+            # 1. Buscar produto com lock e verificar estoque
+            produto = self._produto_para_venda(conn, produto_id, quantidade)
 
-            # 3. Calcular valores
+            # 2. Calcular valores
             preco_unitario = produto['preco']
             valor_total_calculado = preco_unitario * quantidade
             
-            # 4. Inserir venda
-            sql_insert_venda = """
-                INSERT INTO vendas (produto_id, quantidade, valor_total) 
-                VALUES (%s, %s, %s)
-            """
-            cursor.execute(
-                sql_insert_venda, 
-                (produto_id, quantidade, valor_total_calculado)
+            # 3. Inserir venda. O id entra no feed (vendas_desde): daqui até o
+            # commit da sessão não podem passar mais de MARGEM_FEED segundos
+            limitar_commit(sessao, MARGEM_FEED)
+            cursor = executar(
+                conn,
+                SQL_INSERIR_VENDA, 
+                (produto_id, quantidade, valor_total_calculado, loja_id)
             )
             venda_id = cursor.lastrowid 
             
             if not venda_id:
                 raise Exception("Falha ao obter o ID da venda inserida.")
             
-            # 5. Atualizar estoque
-            sql_update_estoque = """
-                UPDATE produtos SET estoque = estoque - %s WHERE id = %s
-            """
-            cursor.execute(sql_update_estoque, (quantidade, produto_id))
+            # 4. Atualizar estoque
+            executar(conn, SQL_BAIXAR_ESTOQUE, (quantidade, produto_id))
 
-            # 6. Commit final
+            # 5. Commit final (numa sessão, só no fim da requisição)
             conn.commit()
 
+            # 6. Invalida caches e notifica os clientes do stream de eventos
+            apos_commit(sessao, lambda: self._notificar_venda(
+                venda_id, produto, quantidade, valor_total_calculado, loja_id
+            ))
+
             # CORRIGIDO: Retorna tupla (venda_id, valor_total)
             return (venda_id, valor_total_calculado)
 
@@ -153,4 +504,192 @@ class VendaRepo:
 
         finally:
             if conn:
-                conn.close()
\ No newline at end of file
+                conn.close()
+
+    def _registrar_venda_em_shard(self, produto_id, quantidade, loja_id, shard, chave):
+        """
+        Venda de uma loja fora do principal. Estoque (catálogo) e venda
+        (shard) ficam em bancos diferentes, sem transação comum:
+
+          1. no principal, a baixa do estoque e a venda pendente (chave)
+             são confirmadas juntas;
+          2. uma nova transação do principal trava a pendente;
+          3. no shard, a venda e a chave entram na mesma transação;
+          4. a transação do passo 2 apaga a pendente e confirma.
+
+        Se o passo 3 falhar, a chave é procurada no shard: sem ela o estoque
+        é devolvido no passo 4. Se nem isso for possível (ou o processo cair no meio), a
+        pendente fica para reconciliar_vendas_pendentes. Uma nova tentativa
+        com a mesma chave não repete a baixa nem a venda. Não usa a sessão
+        da requisição, que só cobre o principal.
+        """
+        if quantidade <= 0:
+            raise ValueError("A quantidade deve ser maior que zero.")
+
+        conn = None
+        try:
+            conn = get_connection()
+            conn.autocommit = False
+            pendente = executar(conn, SQL_VENDA_PENDENTE, (chave,), dictionary=True).fetchone()
+            if pendente is None:
+                produto = self._produto_para_venda(conn, produto_id, quantidade)
+                valor_total = produto['preco'] * quantidade
+                executar(conn, SQL_BAIXAR_ESTOQUE, (quantidade, produto_id))
+                executar(conn, SQL_INSERIR_PENDENTE, (
+                    chave, shard.nome, produto_id, quantidade, valor_total, loja_id, datetime.now()
+                ))
+            else:
+                # Tentativa anterior já baixou o estoque
+                produto = executar(conn, SQL_PRODUTO_VENDA, (produto_id,), dictionary=True).fetchone()
+                if not produto:
+                    raise ProdutoNaoEncontradoError(f"Produto ID {produto_id} não encontrado.")
+                produto = dict(produto, estoque=produto['estoque'] + quantidade)
+                valor_total = pendente['valor_total']
+            conn.commit()
+
+        except Exception as e:
+            if conn:
+                conn.rollback()
+            print("Erro ao baixar o estoque da venda:", e)
+            raise e
+
+        finally:
+            if conn:
+                conn.close()
+
+        # A pendente fica travada por uma transação do principal até o fim:
+        # a reconciliação (SKIP LOCKED) só a pega se este processo morrer e o
+        # MySQL soltar a trava
+        trava = conn = erro_shard = None
+        try:
+            trava = get_connection()
+            trava.autocommit = False
+            if executar(trava, SQL_VENDA_PENDENTE, (chave,)).fetchone() is None:
+                raise Exception(f"Venda pendente {chave} já foi reconciliada.")
+            try:
+                conn = shard.conectar()
+                conn.autocommit = False
+                venda_id = self._gravar_venda_no_shard(conn, chave, produto_id, quantidade, valor_total, loja_id)
+                conn.commit()
+            except Exception as e:
+                print(f"Erro ao gravar venda no shard {shard.nome}:", e)
+                erro_shard = e
+                # Sem conexão com o shard a venda com certeza não foi gravada;
+                # com ela, o commit pode ter falhado só na resposta
+                venda_id = self._venda_da_chave(shard, chave) if conn else None
+            self._fechar_pendente(trava, chave, produto_id, quantidade, venda_id)
+
+        except Exception as e:
+            print(f"Venda pendente {chave} fica para a reconciliação: {e}")
+            raise (erro_shard or e)
+
+        finally:
+            # close() desfaz o que não foi confirmado e solta a trava
+            if conn:
+                conn.close()
+            if trava:
+                trava.close()
+
+        if venda_id is None:
+            raise erro_shard
+        self._notificar_venda(venda_id, produto, quantidade, valor_total, loja_id)
+        return (venda_id, valor_total)
+
+    def _gravar_venda_no_shard(self, conn, chave, produto_id, quantidade, valor_total, loja_id):
+        """Venda e chave no shard; com a chave já gravada só retorna o id"""
+        registro = executar(conn, SQL_VENDA_DA_CHAVE, (chave,)).fetchone()
+        if registro is not None:
+            return registro[0]
+        venda_id = executar(conn, SQL_INSERIR_VENDA, (produto_id, quantidade, valor_total, loja_id)).lastrowid
+        if not venda_id:
+            raise Exception("Falha ao obter o ID da venda inserida.")
+        executar(conn, SQL_INSERIR_CHAVE, (chave, venda_id, datetime.now()))
+        return venda_id
+
+    def _venda_da_chave(self, shard, chave):
+        """Id da venda gravada no shard com a chave ou None"""
+        conn = shard.conectar()
+        try:
+            registro = executar(conn, SQL_VENDA_DA_CHAVE, (chave,)).fetchone()
+            return None if registro is None else registro[0]
+        finally:
+            conn.close()
+
+    def _fechar_pendente(self, conn, chave, produto_id, quantidade, venda_id):
+        """
+        Na transação que trava a pendente: sem venda no shard (venda_id None)
+        devolve o estoque; em qualquer caso apaga a pendente e confirma
+        """
+        try:
+            if venda_id is None:
+                executar(conn, SQL_DEVOLVER_ESTOQUE, (quantidade, produto_id))
+            executar(conn, SQL_REMOVER_PENDENTE, (chave,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def reconciliar_vendas_pendentes(self, idade=IDADE_VENDA_PENDENTE):
+        """
+        Fecha as vendas em shard pendentes há mais de `idade` segundos cujo
+        processo dono caiu no meio da venda (a pendente não está mais
+        travada): as que estão no shard são concluídas, as outras têm o
+        estoque devolvido. Pendentes ainda travadas são de vendas em
+        andamento e ficam como estão. Chamado na inicialização; retorna as
+        contagens de cada caso.
+        """
+        resultado = {'concluidas': 0, 'devolvidas': 0, 'em_andamento': 0, 'erros': 0}
+        if not self.roteador.fragmentado:
+            return resultado
+
+        agora = datetime.now()
+        conn = get_connection()
+        try:
+            pendentes = executar(
+                conn, SQL_PENDENTES_ANTIGAS, (agora - timedelta(seconds=idade),), dictionary=True
+            ).fetchall()
+        finally:
+            conn.close()
+
+        for pendente in pendentes:
+            chave = pendente['chave']
+            shard = self.roteador.shards.get(pendente['shard'])
+            conn = None
+            try:
+                if shard is None:
+                    raise ValueError(f"shard desconhecido: {pendente['shard']}")
+                conn = get_connection()
+                conn.autocommit = False
+                # Travada: o processo dono ainda está vivo (ou outro worker
+                # já a está reconciliando)
+                if executar(conn, SQL_TRAVAR_PENDENTE_LIVRE, (chave,)).fetchone() is None:
+                    resultado['em_andamento'] += 1
+                    continue
+                venda_id = self._venda_da_chave(shard, chave)
+                self._fechar_pendente(conn, chave, pendente['produto_id'], pendente['quantidade'], venda_id)
+            except Exception as e:
+                print(f"Erro ao reconciliar a venda pendente {chave}: {e}")
+                resultado['erros'] += 1
+                continue
+            finally:
+                if conn:
+                    conn.close()
+            resultado['devolvidas' if venda_id is None else 'concluidas'] += 1
+
+        # Sem pendentes antigas, as chaves antigas não protegem mais nada
+        if not resultado['erros'] and not resultado['em_andamento']:
+            expirar = agora - timedelta(days=RETENCAO_CHAVES)
+            for shard in self.roteador.shards.values():
+                if shard.principal:
+                    continue
+                conn = None
+                try:
+                    conn = shard.conectar()
+                    executar(conn, SQL_EXPIRAR_CHAVES, (expirar,))
+                    conn.commit()
+                except Exception as e:
+                    print(f"Erro ao expirar chaves de venda no shard {shard.nome}: {e}")
+                finally:
+                    if conn:
+                        conn.close()
+        return resultado
@@ -5,14 +5,96 @@ CREATE TABLE IF NOT EXISTS produtos (
     preco DECIMAL(10,2) NOT NULL,
     categoria VARCHAR(50),
     estoque INT DEFAULT 0,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Marca d'água de GET /api/produtos/changes (codigo/feed.py)
+    updated_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
+    INDEX idx_produtos_updated_at (updated_at, id),
+    -- Filtro por categoria; cobre fields=id,categoria (o InnoDB inclui o id)
+    INDEX idx_produtos_categoria (categoria)
 );
 
+-- Bases criadas antes de updated_at / idx_produtos_categoria:
+--   ALTER TABLE produtos
+--       ADD COLUMN updated_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
+--       ADD INDEX idx_produtos_updated_at (updated_at, id);
+--   ALTER TABLE produtos ADD INDEX idx_produtos_categoria (categoria);
+
+-- Cada loja fica num shard (codigo/shards.py) e este schema é aplicado em
+-- todos. Nos shards que não são o principal, produtos é só uma cópia do
+-- catálogo replicada do principal (o estoque é baixado no principal) e a
+-- FOREIGN KEY de vendas deve ser removida, como faz "manutencao.py
+-- particionar". Para os ids não se repetirem entre shards, cada servidor usa
+-- um auto_increment_offset diferente, com o mesmo auto_increment_increment
+-- (maior que o número de shards).
 CREATE TABLE IF NOT EXISTS vendas (
     id INT AUTO_INCREMENT PRIMARY KEY,
     produto_id INT,
     quantidade INT NOT NULL,
     data_venda TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     valor_total DECIMAL(10,2) NOT NULL,
-    FOREIGN KEY (produto_id) REFERENCES produtos(id) ON DELETE CASCADE
-);
\ No newline at end of file
+    loja_id INT NOT NULL DEFAULT 1,
+    FOREIGN KEY (produto_id) REFERENCES produtos(id) ON DELETE CASCADE,
+    INDEX idx_vendas_data_venda (data_venda),
+    -- Leituras de uma loja (?loja_id=), por período ou pelo feed
+    INDEX idx_vendas_loja_data (loja_id, data_venda)
+);
+
+-- Bases criadas antes de loja_id (as vendas existentes ficam na loja 1):
+--   ALTER TABLE vendas
+--       ADD COLUMN loja_id INT NOT NULL DEFAULT 1,
+--       ADD INDEX idx_vendas_loja_data (loja_id, data_venda);
+--   ALTER TABLE vendas_arquivo ADD COLUMN loja_id INT NOT NULL DEFAULT 1;
+-- e depois recriar a view vendas_todas abaixo
+
+-- Venda de loja em outro shard (VendaRepo._registrar_venda_em_shard), só no
+-- principal: gravada com a baixa do estoque, travada (FOR UPDATE) enquanto a
+-- venda é gravada no shard e apagada em seguida. As que sobram sem trava
+-- (processo caído no meio) são resolvidas na inicialização da API com
+-- SKIP LOCKED (MySQL 8.0+): concluídas se a chave estiver no shard, senão o
+-- estoque é devolvido.
+CREATE TABLE IF NOT EXISTS vendas_pendentes (
+    chave CHAR(32) PRIMARY KEY,
+    shard VARCHAR(50) NOT NULL,
+    produto_id INT NOT NULL,
+    quantidade INT NOT NULL,
+    valor_total DECIMAL(10,2) NOT NULL,
+    loja_id INT NOT NULL,
+    criada_em DATETIME NOT NULL,
+    INDEX idx_vendas_pendentes_criada_em (criada_em)
+);
+
+-- Chave de cada venda gravada no shard, na mesma transação da venda: uma
+-- nova tentativa com a mesma chave não duplica a venda. Expiram depois de
+-- VENDAS_CHAVES_RETENCAO_DIAS.
+CREATE TABLE IF NOT EXISTS vendas_chaves (
+    chave CHAR(32) PRIMARY KEY,
+    venda_id INT NOT NULL,
+    criada_em DATETIME NOT NULL,
+    INDEX idx_vendas_chaves_criada_em (criada_em)
+);
+
+-- Versão de cada cache em memória da API (invalidacao.py). Cada escrita
+-- incrementa a versão e os demais workers limpam o cache ao notar a mudança.
+CREATE TABLE IF NOT EXISTS cache_versoes (
+    nome VARCHAR(50) PRIMARY KEY,
+    versao BIGINT UNSIGNED NOT NULL DEFAULT 0,
+    atualizado_em TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)
+);
+
+-- Vendas mais antigas que a retenção, movidas da tabela vendas por
+-- "python codigo/manutencao.py arquivar" (ver também "particionar")
+CREATE TABLE IF NOT EXISTS vendas_arquivo (
+    id INT PRIMARY KEY,
+    produto_id INT,
+    quantidade INT NOT NULL,
+    data_venda TIMESTAMP NOT NULL,
+    valor_total DECIMAL(10,2) NOT NULL,
+    loja_id INT NOT NULL DEFAULT 1,
+    INDEX idx_vendas_arquivo_data_venda (data_venda)
+) ROW_FORMAT=COMPRESSED;
+
+-- Vendas atuais e arquivadas, para consultas com incluir_arquivo=True
+CREATE OR REPLACE VIEW vendas_todas AS
+    SELECT id, produto_id, quantidade, data_venda, valor_total, loja_id FROM vendas
+    UNION ALL
+    SELECT id, produto_id, quantidade, data_venda, valor_total, loja_id FROM vendas_arquivo;
@@ -1,35 +1,37 @@
 'use client';
 
-import { buscarProdutoPorId, buscarTodosProdutos } from "@/services/apiProdutos";
-import { buscarTodasVendas } from "@/services/apiVendas";
+import { buscarDashboard } from "@/services/apiDashboard";
+import { assinarEventos } from "@/services/apiEventos";
 import Image from "next/image";
 import { useEffect, useState } from "react";
 import CardDashboard from "@/components/cardDashBoard";
 
 export default function Home() {
-const [produtos, setProdutos] = useState([]);
-const [destaque, setDestaque] = useState<any>(null);
+  // Um único GET /api/dashboard no lugar das listas inteiras de produtos e vendas
+  const [dashboard, setDashboard] = useState<any>(null);
 
   useEffect(() => {
-    // Carregar todos os produtos
-    const carregarDados = async () => {
-      // 1. Busca geral
-      const dados = await buscarTodosProdutos();
-      setProdutos(dados);
+    const carregarDashboard = async () => {
+      const dados = await buscarDashboard();
+      if (dados) setDashboard(dados);
     };
 
-    carregarDados();
-  }, []);
+    carregarDashboard();
 
-  const [vendas, setVendas] = useState([]);
-    useEffect(() => {
-      const carregarVendas = async () => {
-        const dadosVendas = await buscarTodasVendas();
-        setVendas(dadosVendas);
-      };
+    // Qualquer alteração recarrega o painel (a escrita descarta o cache do
+    // painel no servidor; eventos próximos dividem um único recálculo)
+    return assinarEventos({
+      venda_criada: carregarDashboard,
+      estoque_alterado: carregarDashboard,
+      produto_criado: carregarDashboard,
+      produto_atualizado: carregarDashboard,
+      produtos_atualizados: carregarDashboard,
+      reset: carregarDashboard,
+    });
+  }, []);
 
-      carregarVendas();
-    }, []);
+  const produtos = dashboard?.resumo.produtos;
+  const vendas = dashboard?.resumo.vendas;
 
 
   return (
@@ -41,7 +43,7 @@ const [destaque, setDestaque] = useState<any>(null);
             <div className="grid grid-cols-1 md:grid-cols-3 gap-6">
                 <CardDashboard
     title="Total de Produtos"
-    value={produtos.length}
+    value={produtos?.total ?? 0}
     subtitle="↑ 12% vs. mês passado"
     icon={
       <svg className="w-8 h-8 text-blue-600" fill="none" stroke="currentColor" viewBox="0 0 24 24">
@@ -52,7 +54,7 @@ const [destaque, setDestaque] = useState<any>(null);
 
   <CardDashboard
     title="Total de Vendas"
-    value={vendas.length}
+    value={vendas?.total ?? 0}
     subtitle="↑ 12% vs. mês passado"
     icon={
       <svg className="w-8 h-8 text-blue-600" fill="none" stroke="currentColor" viewBox="0 0 24 24">
@@ -64,7 +66,7 @@ const [destaque, setDestaque] = useState<any>(null);
   {/* Estoque baixo */}
   <CardDashboard
     title="Estoque Baixo"
-    value={`${produtos.filter(p => p.estoque < 3).length} produtos`}
+    value={`${produtos?.estoque_baixo ?? 0} produtos`}
     bg="bg-orange-50"
     border="border-orange-200"
     textColor="text-orange-900"
@@ -79,7 +81,7 @@ const [destaque, setDestaque] = useState<any>(null);
   {/* Sem estoque */}
   <CardDashboard
     title="Estoque Zerado"
-    value={`${produtos.filter(p => p.estoque === 0).length} produtos`}
+    value={`${produtos?.sem_estoque ?? 0} produtos`}
     bg="bg-red-50"
     border="border-red-200"
     textColor="text-red-900"
@@ -93,7 +95,7 @@ const [destaque, setDestaque] = useState<any>(null);
 
   <CardDashboard
     title="Valor total de vendas: "
-    value={`R$ ${vendas.reduce((total: number, venda: any) => total + venda.valor_total, 0).toFixed(2)}`}
+    value={`R$ ${(vendas?.valor_total ?? 0).toFixed(2)}`}
     subtitle={"Valor acumulado de todas as vendas"}
     icon={
       <svg className="w-6 h-6 text-green-600" fill="none" stroke="currentColor" viewBox="0 0 24 24">
@@ -3,6 +3,7 @@
 import React, { useState, useEffect } from 'react';
 import { Plus, Search, Filter, X, Package, DollarSign, Calendar, Loader2 } from 'lucide-react';
 import CreateVendaDialog from '@/components/CreateVendaDialog';
+import { assinarEventos } from '@/services/apiEventos';
 
 // Types
 interface Venda {
@@ -186,6 +187,17 @@ export default function VendasPage() {
     carregarVendas();
   }, []);
 
+  // Novas vendas chegam pelo stream de eventos
+  useEffect(() => {
+    return assinarEventos({
+      venda_criada: (venda: Venda) =>
+        setVendas((atual) =>
+          atual.some((v) => v.venda_id === venda.venda_id) ? atual : [venda, ...atual]
+        ),
+      reset: () => carregarVendas(),
+    });
+  }, []);
+
   // Aplicar filtros quando vendas ou filtros mudarem
   useEffect(() => {
     aplicarFiltros();
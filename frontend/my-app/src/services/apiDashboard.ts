@@ -0,0 +1,13 @@
+// Contadores, estoque baixo, mais vendidos e vendas recentes numa única requisição
+const URL_DASHBOARD = 'http://localhost:8000/api/dashboard';
+
+export const buscarDashboard = async (limiteEstoque = 3) => {
+    try {
+        const response = await fetch(`${URL_DASHBOARD}?limite_estoque=${limiteEstoque}`);
+        if (!response.ok) throw new Error('Erro ao buscar dados do dashboard');
+        return await response.json();
+    } catch (error) {
+        console.error(error);
+        return null;
+    }
+};
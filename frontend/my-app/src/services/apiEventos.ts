@@ -0,0 +1,31 @@
+// Stream de eventos (SSE) com as alterações de vendas e estoque
+const URL_EVENTOS = 'http://localhost:8000/api/eventos';
+
+type Handlers = {
+  venda_criada?: (dados: any) => void;
+  estoque_alterado?: (dados: any) => void;
+  produto_criado?: (dados: any) => void;
+  produto_atualizado?: (dados: any) => void;
+  // Atualização em lote (PATCH /api/produtos): só os ids, a lista deve ser recarregada
+  produtos_atualizados?: (dados: any) => void;
+  // Chamado quando o servidor não consegue retomar o stream e os dados precisam ser recarregados
+  reset?: () => void;
+};
+
+// O EventSource reconecta sozinho e envia o Last-Event-ID automaticamente
+export const assinarEventos = (handlers: Handlers) => {
+  const fonte = new EventSource(URL_EVENTOS);
+
+  Object.entries(handlers).forEach(([tipo, handler]) => {
+    fonte.addEventListener(tipo, (evento) => {
+      try {
+        handler(JSON.parse((evento as MessageEvent).data));
+      } catch (error) {
+        console.error(error);
+      }
+    });
+  });
+
+  // Retorna a função de limpeza para o useEffect
+  return () => fonte.close();
+};
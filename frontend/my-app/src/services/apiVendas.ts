@@ -13,4 +13,25 @@ export const buscarTodasVendas = async () => {
 };
 
 
-//falta olhar no nmo back oq esta acontecenfdo com a api vendas pois nao esta renderizando nada
\ No newline at end of file
+//falta olhar no nmo back oq esta acontecenfdo com a api vendas pois nao esta renderizando nada
+// Série agregada por período (hora, dia, semana ou mes) para os gráficos
+export const buscarSerieVendas = async (
+    granularidade: 'hora' | 'dia' | 'semana' | 'mes',
+    inicio?: string,
+    fim?: string,
+    categoria?: string
+) => {
+    const params = new URLSearchParams({ granularidade });
+    if (inicio) params.set('inicio', inicio);
+    if (fim) params.set('fim', fim);
+    if (categoria) params.set('categoria', categoria);
+
+    try{
+        const response = await fetch(`http://localhost:8000/api/relatorios/vendas-serie?${params}`);
+        if (!response.ok) throw new Error('Erro ao buscar série de vendas');
+        return (await response.json()).serie;
+    } catch (error) {
+        console.error(error);
+        return [];
+    }
+};